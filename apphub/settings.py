@@ -222,6 +222,86 @@ STORAGE_MAP = {
 
 DEFAULT_FILE_STORAGE = STORAGE_MAP.get(STORAGE_TYPE, "storage.NginxFileStorage.NginxPrivateFileStorage")  # noqa: E501
 
+# Store byte-identical package binaries once and share them between packages.
+PACKAGE_DEDUPLICATION = get_env_value("PACKAGE_DEDUPLICATION", False)
+
+# Number of package parse results kept to skip parsing re-uploaded binaries,
+# 0 disables the cache.
+PACKAGE_PARSE_CACHE_SIZE = int(get_env_value("PACKAGE_PARSE_CACHE_SIZE", 1000))
+
+# Threads parsing and storing the packages of a batch upload.
+PACKAGE_BATCH_WORKERS = int(get_env_value("PACKAGE_BATCH_WORKERS", 4))
+
+# Number of previous packages of the same app and channel a new package gets
+# delta patches from, 0 disables patches. Every patch reads both packages in
+# the background and is stored next to the package.
+PACKAGE_PATCH_BASES = int(get_env_value("PACKAGE_PATCH_BASES", 0))
+
+# Cache-Control of stored files that never change, like icon renditions.
+IMMUTABLE_CACHE_CONTROL = get_env_value(
+    "IMMUTABLE_CACHE_CONTROL", "public, max-age=31536000, immutable"
+)
+
+# Seconds a worker leases a background job for. A job whose worker stops
+# renewing the lease, e.g. because it died, is run again after that.
+JOB_VISIBILITY_TIMEOUT = int(get_env_value("JOB_VISIBILITY_TIMEOUT", 300))
+# Runs of a failing job before it is left failed, and the seconds before its
+# first retry, doubled for every later one.
+JOB_MAX_ATTEMPTS = int(get_env_value("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_DELAY = int(get_env_value("JOB_RETRY_DELAY", 10))
+# Seconds an idle worker waits before looking for jobs again.
+JOB_POLL_INTERVAL = float(get_env_value("JOB_POLL_INTERVAL", 1))
+# Workers started in threads of every web process, for deployments that
+# cannot run `manage.py worker` next to the web server.
+JOB_EMBEDDED_WORKERS = int(get_env_value("JOB_EMBEDDED_WORKERS", 0))
+# Ready jobs run at the end of a request by deployments whose instances are
+# frozen between requests, like deploy/aliyun_serverless.
+JOB_REQUEST_LIMIT = int(get_env_value("JOB_REQUEST_LIMIT", 10))
+
+# Webhooks of an event sent at the same time, and idle connections kept open
+# to each webhook host.
+WEBHOOK_CONCURRENCY = int(get_env_value("WEBHOOK_CONCURRENCY", 8))
+WEBHOOK_POOL_SIZE = int(get_env_value("WEBHOOK_POOL_SIZE", 4))
+# Deliveries a worker process sends to the same url at the same time. The cap
+# is per process, not global: with N worker processes (or app processes
+# running JOB_EMBEDDED_WORKERS) up to N times as many are in flight to a url.
+WEBHOOK_URL_CONCURRENCY = int(get_env_value("WEBHOOK_URL_CONCURRENCY", 2))
+# Attempts at delivering an event to a webhook, and the seconds before the
+# first retry of a failed one, doubled for every later retry up to the max.
+# Retry delays are randomized between half and all of that.
+WEBHOOK_MAX_ATTEMPTS = int(get_env_value("WEBHOOK_MAX_ATTEMPTS", 5))
+WEBHOOK_RETRY_DELAY = int(get_env_value("WEBHOOK_RETRY_DELAY", 30))
+WEBHOOK_RETRY_MAX_DELAY = int(get_env_value("WEBHOOK_RETRY_MAX_DELAY", 3600))
+
+# Days webhook deliveries, with their payloads, and failed jobs are kept
+# before a daily job deletes them, 0 keeps them.
+RECORD_RETENTION_DAYS = int(get_env_value("RECORD_RETENTION_DAYS", 30))
+
+# Seconds a store gets to answer when refreshing the current versions of an
+# app, the stores are asked at the same time.
+STORE_TIMEOUT = float(get_env_value("STORE_TIMEOUT", 10))
+
+# Sink of the timing spans of the package ingest path: "log", "statsd",
+# "memory" or the dotted path of a sink class, empty disables spans.
+SPAN_SINK = get_env_value("SPAN_SINK", "")
+# host:port and metric prefix of the "statsd" span sink.
+SPAN_STATSD_ADDRESS = get_env_value("SPAN_STATSD_ADDRESS", "127.0.0.1:8125")
+SPAN_STATSD_PREFIX = get_env_value("SPAN_STATSD_PREFIX", "apphub")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "apphub.span": {"handlers": ["console"], "level": "INFO", "propagate": False},
+        "apphub.distribute": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
 
 if DEFAULT_FILE_STORAGE == "storage.AliyunOssStorage.AliyunOssMediaStorage":
     ALIYUN_OSS_ACCESS_KEY_ID = get_env_value("ALIYUN_OSS_ACCESS_KEY_ID")
@@ -32,8 +32,10 @@ urlpatterns = [
     path("user/", include("user.urls")),
     path("users/<username>", user_info),
     path("upload/file", TokenAppPackageUpload.as_view()),
+    path("upload/batch", TokenAppPackageBatchUpload.as_view()),
     path("upload/request", RequestUploadPackage.as_view()),
     path("upload/record/<record_id>", CheckUploadPackage.as_view()),
+    path("upload/record/<record_id>/chunks", UploadPackageChunk.as_view()),
     path("download/<slug>", SlugAppDetail.as_view()),
     path("download/<slug>/packages", SlugAppPackageList.as_view()),
     path("download/<slug>/packages/latest", SlugAppPackageLatest.as_view()),
@@ -81,6 +83,14 @@ urlpatterns = [
         OrganizationUniversalAppWebhookDetail.as_view(),
         name="org-app-webhook",
     ),
+    path(
+        "orgs/<namespace>/apps/<path>/webhooks/<webhook_id>/deliveries",
+        OrganizationUniversalAppWebhookDeliveryList.as_view(),
+    ),
+    path(
+        "orgs/<namespace>/apps/<path>/webhooks/<webhook_id>/deliveries/<delivery_id>/redeliver",
+        OrganizationUniversalAppWebhookRedeliver.as_view(),
+    ),
     path("orgs/<namespace>/apps/<path>/packages", OrganizationAppPackageList.as_view()),
     path(
         "orgs/<namespace>/apps/<path>/packages/upload_via_file",
@@ -151,6 +161,14 @@ urlpatterns = [
         UserUniversalAppWebhookDetail.as_view(),
         name="user-app-webhook",
     ),
+    path(
+        "users/<namespace>/apps/<path>/webhooks/<webhook_id>/deliveries",
+        UserUniversalAppWebhookDeliveryList.as_view(),
+    ),
+    path(
+        "users/<namespace>/apps/<path>/webhooks/<webhook_id>/deliveries/<delivery_id>/redeliver",
+        UserUniversalAppWebhookRedeliver.as_view(),
+    ),
     path("users/<namespace>/apps/<path>/packages", UserAppPackageList.as_view()),
     path(
         "users/<namespace>/apps/<path>/packages/upload_via_file",
@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "apphub.settings")
 
 application = get_wsgi_application()
+
+if settings.JOB_EMBEDDED_WORKERS:
+    from distribute.task import start_workers
+
+    start_workers(settings.JOB_EMBEDDED_WORKERS)
@@ -3,6 +3,7 @@ from django.db import models
 
 from util.choice import ChoiceField, CustomChoicesMeta
 from util.role import Role
+from util.template import compile_template, render_template
 from util.url import get_file_extension
 from util.visibility import VisibilityType
 
@@ -190,5 +191,66 @@ class Webhook(models.Model):
     when_new_release = models.BooleanField(default=False)
     when_new_upgrade = models.BooleanField(default=False)
     when_store_state_change = models.BooleanField(default=False)
+    # Seconds to connect to the url, and to wait for each read of its response.
+    connect_timeout = models.FloatField(default=5)
+    read_timeout = models.FloatField(default=10)
+    # Seconds events are collected for before they are sent together as one
+    # digest, 0 sends every event on its own.
+    coalesce_window = models.IntegerField(default=0)
+    # The body of the template, compiled when the webhook is saved.
+    compiled_template = models.JSONField(default=list)
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        self.compiled_template = compile_template(self.template.get("body", ""))
+        super().save(*args, **kwargs)
+
+    def render(self, data):
+        """
+        The payload of the webhook for the values of an event, a TemplateData.
+        """
+        compiled = self.compiled_template
+        if not compiled and self.template.get("body"):
+            # Saved before templates were compiled.
+            compiled = compile_template(self.template["body"])
+        return render_template(compiled, data)
+
+
+class PendingWebhookEvent(models.Model):
+    """
+    An event waiting in the coalescing window of a webhook, to be sent in the
+    next digest.
+    """
+
+    webhook = models.ForeignKey(Webhook, on_delete=models.CASCADE)
+    event = models.CharField(max_length=32)
+    data = models.JSONField(default=dict)
+    create_time = models.DateTimeField(auto_now_add=True)
+
+
+class WebhookDelivery(models.Model):
+    """
+    One attempt at sending an event to a webhook. A failed attempt that is
+    retried has the time of the next one, which gets a delivery of its own.
+    """
+
+    webhook = models.ForeignKey(Webhook, on_delete=models.CASCADE)
+    event = models.CharField(max_length=32)
+    payload = models.JSONField(null=True)
+    attempt = models.IntegerField(default=1)
+    success = models.BooleanField(default=False)
+    status_code = models.IntegerField(null=True)
+    # Milliseconds from sending the request to the end of the response.
+    latency = models.IntegerField(default=0)
+    response = models.CharField(max_length=1024, blank=True, default="")
+    error = models.CharField(max_length=1024, blank=True, default="")
+    next_retry_time = models.DateTimeField(null=True)
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["webhook", "-create_time"], name="webhook_delivery_index"
+            ),
+        ]
@@ -5,10 +5,11 @@ from django.core.files import File
 from rest_framework import serializers
 
 from application.models import (AppAPIToken, Application, UniversalApp,
-                                UniversalAppUser, Webhook)
+                                UniversalAppUser, Webhook, WebhookDelivery)
 from util.choice import ChoiceField
 from util.image import generate_icon_image
 from util.role import Role
+from util.template import TemplateData, compile_template, render_template
 from util.visibility import VisibilityType
 
 
@@ -285,7 +286,52 @@ class WebhookSerializer(serializers.ModelSerializer):
             "when_new_release",
             "when_new_upgrade",
             "when_store_state_change",
+            "connect_timeout",
+            "read_timeout",
+            "coalesce_window",
             "update_time",
             "create_time",
         ]
         read_only_fields = ["id", "update_time", "create_time"]
+        extra_kwargs = {
+            "connect_timeout": {"min_value": 0.1, "max_value": 60},
+            "read_timeout": {"min_value": 0.1, "max_value": 60},
+            "coalesce_window": {"min_value": 0, "max_value": 3600},
+        }
+
+    def validate_template(self, template):
+        if not isinstance(template, dict):
+            raise serializers.ValidationError("The template must be an object.")
+        body = template.get("body")
+        if body is None:
+            return template
+        if not isinstance(body, str):
+            raise serializers.ValidationError("The body must be a string.")
+        # Every placeholder filled, the body must be a JSON object.
+        compiled = compile_template(body)
+        keys = [item[0] for item in compiled if not isinstance(item, str)]
+        try:
+            payload = render_template(compiled, TemplateData(dict.fromkeys(keys)))
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            raise serializers.ValidationError("The body must be a JSON object.")
+        return template
+
+
+class WebhookDeliverySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WebhookDelivery
+        fields = [
+            "id",
+            "event",
+            "payload",
+            "attempt",
+            "success",
+            "status_code",
+            "latency",
+            "response",
+            "error",
+            "next_retry_time",
+            "create_time",
+        ]
@@ -10,7 +10,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from application.models import (AppAPIToken, UniversalApp, UniversalAppUser,
-                                Webhook)
+                                Webhook, WebhookDelivery)
 from application.permissions import (Namespace, UserRoleKind,
                                      check_app_manager_permission,
                                      check_app_view_permission)
@@ -21,7 +21,9 @@ from application.serializers import (UniversalAppCreateSerializer,
                                      UniversalAppUserAddSerializer,
                                      UniversalAppUserSerializer,
                                      UserUniversalAppSerializer,
+                                     WebhookDeliverySerializer,
                                      WebhookSerializer)
+from distribute.task import resend_webhook_delivery, run_in_background
 from organization.models import Organization, OrganizationUser
 from organization.views import check_org_manager_permission
 from util.pagination import get_pagination_params
@@ -524,6 +526,67 @@ class OrganizationUniversalAppWebhookDetail(UserUniversalAppWebhookDetail):
         return Namespace.organization(path)
 
 
+class UserUniversalAppWebhookDeliveryList(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_namespace(self, path):
+        return Namespace.user(path)
+
+    def get(self, request, namespace, path, webhook_id):
+        app, role = check_app_manager_permission(
+            request.user, path, self.get_namespace(namespace)
+        )
+        page, per_page = get_pagination_params(request)
+        if not Webhook.objects.filter(id=webhook_id, app=app).exists():
+            raise Http404
+        query = WebhookDelivery.objects.filter(webhook_id=webhook_id)
+        count = query.count()
+        deliveries = query.order_by("-create_time", "-id")[
+            (page - 1) * per_page : page * per_page
+        ]
+        serializer = WebhookDeliverySerializer(deliveries, many=True)
+        headers = {"X-Total-Count": count}
+        return Response(serializer.data, headers=headers)
+
+
+class OrganizationUniversalAppWebhookDeliveryList(
+    UserUniversalAppWebhookDeliveryList
+):
+    def get_namespace(self, path):
+        return Namespace.organization(path)
+
+
+class UserUniversalAppWebhookRedeliver(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_namespace(self, path):
+        return Namespace.user(path)
+
+    def post(self, request, namespace, path, webhook_id, delivery_id):
+        app, role = check_app_manager_permission(
+            request.user, path, self.get_namespace(namespace)
+        )
+        try:
+            delivery = WebhookDelivery.objects.get(
+                id=delivery_id, webhook_id=webhook_id, webhook__app=app
+            )
+        except WebhookDelivery.DoesNotExist:
+            raise Http404
+        if delivery.payload is None:
+            return Response(
+                {"message": "The delivery has no payload to send."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # Sent by a worker, the new delivery shows up in the list.
+        run_in_background(resend_webhook_delivery, delivery.id, 1)
+        return Response(status=status.HTTP_202_ACCEPTED)
+
+
+class OrganizationUniversalAppWebhookRedeliver(UserUniversalAppWebhookRedeliver):
+    def get_namespace(self, path):
+        return Namespace.organization(path)
+
+
 class OrganizationUniversalAppList(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
@@ -296,6 +296,21 @@ class Api:
         def remove_webhook(self, webhook_id):
             return self.client.delete(self.base_path + "/webhooks/" + str(webhook_id))
 
+        def get_webhook_delivery_list(self, webhook_id, page=1, per_page=10):
+            query = {"page": page, "per_page": per_page}
+            path = self.base_path + "/webhooks/" + str(webhook_id) + "/deliveries"
+            return self.client.get(path, query)
+
+        def redeliver_webhook(self, webhook_id, delivery_id):
+            return self.client.post(
+                self.base_path
+                + "/webhooks/"
+                + str(webhook_id)
+                + "/deliveries/"
+                + str(delivery_id)
+                + "/redeliver"
+            )
+
         def get_stores(self):
             return self.client.get(self.base_path + "/stores")
 
@@ -386,6 +401,17 @@ class Api:
             url = "/upload/file"
             return self.client.upload_post(url, data=data, token=token)
 
+    def upload_packages(self, file_paths, token, channels=None):
+        fps = [open(file_path, "rb") for file_path in file_paths]
+        try:
+            data = {"file": fps}
+            if channels is not None:
+                data["channel"] = channels
+            return self.client.upload_post("/upload/batch", data=data, token=token)
+        finally:
+            for fp in fps:
+                fp.close()
+
     def get_appstore_app_version(self, appstore_app_id, country_code_alpha2):
         return self.client.get(
             "/stores/appstore/" + country_code_alpha2 + "/" + appstore_app_id
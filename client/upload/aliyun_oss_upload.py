@@ -1,7 +1,9 @@
+import hashlib
 import os.path
 import sys
 
 import requests
+from multipart import PART_SIZE, upload_parts, wait_for_record
 
 
 def main():
@@ -15,12 +17,24 @@ def main():
     headers = {
         'Authorization': 'Token ' + token
     }
+    md5 = hashlib.md5()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
     payload = {
         'filename': os.path.basename(file),
         'commit_id': commit_id,
-        'build_type': build_type
+        'build_type': build_type,
+        'md5': md5.hexdigest()
     }
 
+    # Upload in parallel parts when the file is bigger than a part.
+    size = os.path.getsize(file)
+    if size > PART_SIZE:
+        payload['multipart'] = True
+        payload['size'] = size
+        payload['part_size'] = PART_SIZE
+
     if len(sys.argv) == 7:
         description = sys.argv[6]
         payload['description'] = description
@@ -28,17 +42,24 @@ def main():
 
     r = requests.post(url, data=payload, headers=headers)
     print(r.json())
-    upload_url = r.json()['upload_url']
-    record_id = r.json()['record_id']
-    with open(file, 'rb') as f:
-        r = requests.put(upload_url, data=f)
-        print(r.status_code)
-        print(r.text)
-        # print(r.json())
+    response = r.json()
+    record_id = response['record_id']
+    if 'parts' in response:
+        upload_parts(file, response)
+    else:
+        upload_url = response['upload_url']
+        upload_headers = response.get('headers', {})
+        with open(file, 'rb') as f:
+            r = requests.put(upload_url, data=f, headers=upload_headers)
+            print(r.status_code)
+            print(r.text)
+            # print(r.json())
 
     url = os.path.join(api_url, 'upload/record/' + str(record_id))
     r = requests.post(url, headers=headers)
     print(r.status_code)
+    # The package is processed in the background, wait until it is done.
+    r = wait_for_record(url, headers, r)
     print(r.json())
 
 
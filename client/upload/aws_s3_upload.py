@@ -2,6 +2,7 @@ import os.path
 import sys
 
 import requests
+from multipart import PART_SIZE, upload_parts, wait_for_record
 
 
 def main():
@@ -21,6 +22,13 @@ def main():
         'build_type': build_type
     }
 
+    # Upload in parallel parts when the file is bigger than a part.
+    size = os.path.getsize(file)
+    if size > PART_SIZE:
+        payload['multipart'] = True
+        payload['size'] = size
+        payload['part_size'] = PART_SIZE
+
     if len(sys.argv) == 7:
         description = sys.argv[6]
         payload['description'] = description
@@ -29,17 +37,22 @@ def main():
     r = requests.post(url, data=payload, headers=headers)
     print(r.json())
     response = r.json()
-    record_id = r.json()['record_id']
-    with open(file, 'rb') as f:
-        files = {'file': (file, f)}
-        r = requests.post(response['url'], data=response['fields'], files=files)
-        print(r.status_code)
-        # print(r.text)
-        # print(r.json())
+    record_id = response['record_id']
+    if 'parts' in response:
+        upload_parts(file, response)
+    else:
+        with open(file, 'rb') as f:
+            files = {'file': (file, f)}
+            r = requests.post(response['url'], data=response['fields'], files=files)
+            print(r.status_code)
+            # print(r.text)
+            # print(r.json())
 
     url = os.path.join(api_url, 'upload/record/' + str(record_id))
     r = requests.post(url, headers=headers)
     print(r.status_code)
+    # The package is processed in the background, wait until it is done.
+    r = wait_for_record(url, headers, r)
     print(r.json())
 
 
@@ -0,0 +1,59 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Part size and number of parallel part uploads, UPLOAD_PART_SIZE is in bytes.
+PART_SIZE = int(os.environ.get('UPLOAD_PART_SIZE', 16 * 1024 * 1024))
+CONCURRENCY = int(os.environ.get('UPLOAD_CONCURRENCY', 4))
+RETRIES = 5
+# Seconds to wait for the package to be processed, UPLOAD_WAIT_TIMEOUT, and
+# seconds each poll waits on the server, which caps it at 5.
+WAIT_TIMEOUT = int(os.environ.get('UPLOAD_WAIT_TIMEOUT', 30 * 60))
+POLL_WAIT = 5
+
+
+def upload_part(file, part, part_size):
+    with open(file, 'rb') as f:
+        f.seek((part['part_number'] - 1) * part_size)
+        data = f.read(part_size)
+    for i in range(RETRIES):
+        try:
+            r = requests.put(part['upload_url'], data=data)
+            if r.status_code == 200:
+                return
+            print(r.status_code, r.text)
+        except requests.RequestException as e:
+            print(e)
+        time.sleep(2 ** i)
+    raise RuntimeError('upload part %d failed' % part['part_number'])
+
+
+def upload_parts(file, response):
+    """
+    Upload the parts of a multipart upload returned by upload/request.
+    """
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        futures = [
+            executor.submit(upload_part, file, part, response['part_size'])
+            for part in response['parts']
+        ]
+        for future in futures:
+            future.result()
+
+
+def wait_for_record(url, headers, r):
+    """
+    Poll the upload record until the package is processed, giving up after
+    WAIT_TIMEOUT seconds. Returns the last response.
+    """
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while r.status_code == 200 and r.json()['status'] not in ('completed', 'failed'):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RuntimeError('the package was not processed in %d seconds' % WAIT_TIMEOUT)  # noqa: E501
+        print(r.json()['status'])
+        params = {'wait': min(POLL_WAIT, max(1, int(remaining)))}
+        r = requests.get(url, params=params, headers=headers)
+    return r
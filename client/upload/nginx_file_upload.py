@@ -1,22 +1,122 @@
+import hashlib
+import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from multipart import wait_for_record
+
+CHUNK_SIZE = 8 * 1024 * 1024
+# Parallel chunk uploads, UPLOAD_CONCURRENCY. Every chunk updates the upload
+# record, a server on the default sqlite database fails concurrent ones with
+# "database is locked", raise it for other databases only.
+CONCURRENCY = int(os.environ.get('UPLOAD_CONCURRENCY', 1))
+RETRIES = 5
+
+
+def missing_ranges(size, received):
+    ranges = []
+    offset = 0
+    for start, end in received:
+        if start > offset:
+            ranges.append((offset, start))
+        offset = max(offset, end)
+    if offset < size:
+        ranges.append((offset, size))
+    chunks = []
+    for start, end in ranges:
+        for offset in range(start, end, CHUNK_SIZE):
+            chunks.append((offset, min(offset + CHUNK_SIZE, end)))
+    return chunks
+
+
+def file_md5(file):
+    md5 = hashlib.md5()
+    with open(file, 'rb') as f:
+        for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+            md5.update(data)
+    return md5.hexdigest()
+
+
+def chunk_received(url, headers, start, end):
+    r = requests.get(url, headers=headers)
+    if r.status_code != 200:
+        return False
+    return any(s <= start and end <= e for s, e in r.json()['received'])
+
+
+def put_chunk(url, headers, file, start, end):
+    with open(file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    for i in range(RETRIES):
+        try:
+            r = requests.put(url, params={'offset': start}, data=data, headers=headers)
+            if r.status_code == 200:
+                return
+            print(r.status_code, r.text)
+        except requests.RequestException as e:
+            print(e)
+        try:
+            # The chunk may be stored with its response lost, sending it
+            # again would be rejected as overlapping.
+            if chunk_received(url, headers, start, end):
+                return
+        except requests.RequestException as e:
+            print(e)
+        time.sleep(2 ** i)
+    raise RuntimeError('upload chunk %d-%d failed' % (start, end))
 
 
 def main():
+    # upload_url is the /upload/file endpoint, the chunk API lives next to it.
     upload_url = sys.argv[1]
     token = sys.argv[2]
     file = sys.argv[3]
-    headers = {"Authorization": "Token " + token}
-    with open(file, "rb") as fp:
-        data = {"file": fp}
+    api_url = upload_url[: upload_url.rindex('upload/file')]
+    headers = {'Authorization': 'Token ' + token}
+    size = os.path.getsize(file)
+
+    # An interrupted upload is resumed from the record saved next to the file.
+    state_file = file + '.upload'
+    record_id = None
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            record_id = f.read().strip()
+    if not record_id:
+        # The server checks the assembled file against the md5.
+        payload = {
+            'filename': os.path.basename(file),
+            'size': size,
+            'md5': file_md5(file),
+        }
         if len(sys.argv) >= 5:
-            data["commit_id"] = sys.argv[4]
+            payload['commit_id'] = sys.argv[4]
         if len(sys.argv) >= 6:
-            data["description"] = sys.argv[5]
-
-        r = requests.post(upload_url, headers=headers, files=data)
+            payload['description'] = sys.argv[5]
+        r = requests.post(api_url + 'upload/request', data=payload, headers=headers)
         print(r.json())
+        record_id = str(r.json()['record_id'])
+        with open(state_file, 'w') as f:
+            f.write(record_id)
+
+    record_url = api_url + 'upload/record/' + record_id
+    chunk_url = record_url + '/chunks'
+    r = requests.get(chunk_url, headers=headers)
+    chunks = missing_ranges(size, r.json()['received'])
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        futures = [
+            executor.submit(put_chunk, chunk_url, headers, file, start, end)
+            for start, end in chunks
+        ]
+        for future in futures:
+            future.result()
+
+    r = requests.post(record_url, headers=headers)
+    r = wait_for_record(record_url, headers, r)
+    print(r.json())
+    os.remove(state_file)
 
 
 if __name__ == "__main__":
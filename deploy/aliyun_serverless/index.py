@@ -4,8 +4,10 @@ import shutil
 
 import oss2
 import requests
+from django.conf import settings
 
 from apphub.wsgi import application
+from distribute.task import run_ready_jobs
 
 
 def handler(environ, start_response):
@@ -34,11 +36,20 @@ def handler(environ, start_response):
 
     ret = application(environ, start_response)
 
-    if (
+    sqlite = (
         os.environ.get("DATABASES_ENGINE", None)
         == "django.db.backends.sqlite3"
-        and environ.get("REQUEST_METHOD", "") != "GET"
-    ):
+    )
+    # The instance is frozen between requests, no worker can run in the
+    # background. Queued jobs, like processing an upload or sending webhooks,
+    # run here, before a sqlite database is uploaded again.
+    if not sqlite or environ.get("REQUEST_METHOD", "") != "GET":
+        try:
+            run_ready_jobs(settings.JOB_REQUEST_LIMIT)
+        except:  # noqa: E722
+            logging.exception("Can not run jobs")
+
+    if sqlite and environ.get("REQUEST_METHOD", "") != "GET":
         if file and os.path.isfile(file):
             bucket.put_object_from_file(remote_db_file, file)
     return ret
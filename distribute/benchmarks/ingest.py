@@ -0,0 +1,629 @@
+"""
+Benchmark of the package ingest paths, by storage backend and package size.
+
+Drives the three ways a package comes in:
+
+    create   create_package with a package file on disk
+    direct   RequestUploadPackage, the client uploading the parts (chunks on
+             the local storage), CheckUploadPackage.post and polling until
+             the background worker has created the package
+    token    TokenAppPackageUpload, a multipart POST streamed to the API
+
+against the local file storage and the OSS and S3 storages talking to an
+in-process object store (see object_store.py). The API is served by a
+threaded WSGI server in this process, on a throwaway test database.
+
+Every case records its wall time, the time spent in each stage of the
+ingest path, the peak RSS of the process and the bytes read. Stage times are
+inclusive, a stage may run inside another one (storage_save inside
+store_files). Bytes read are counted by the read syscalls of the whole
+process, which also runs the API, the worker and the object store, and by
+the GETs served by the object store.
+
+    python -m distribute.benchmarks.ingest [--sizes 10M,100M,1G,2G] \\
+        [--backends local,oss,s3] [--flows create,direct,token] \\
+        [--output ingest.json] [--baseline previous.json]
+
+The JSON report carries the commit it was run on, --baseline prints the
+wall time of every case against the same case of an earlier report. The
+run exits with status 1 when a case failed.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+
+import django
+import requests
+
+from distribute.benchmarks.object_store import ObjectStoreServer
+
+SIZE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3}
+DEFAULT_SIZES = "10M,100M,1G,2G"
+BACKENDS = ["local", "oss", "s3"]
+FLOWS = ["create", "direct", "token"]
+# Size of the filler entries the generated packages are made of.
+ENTRY_SIZE = 4 * 1024 * 1024
+# Chunk size and parallel requests of the direct upload client.
+CHUNK_SIZE = 16 * 1024 * 1024
+UPLOAD_WORKERS = 4
+POLL_SECONDS = 5
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def parse_size(value):
+    value = value.strip().upper().rstrip("B")
+    if value[-1:] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def format_size(size):
+    for unit in "GMK":
+        if size >= SIZE_UNITS[unit]:
+            return "%.4g%s" % (size / SIZE_UNITS[unit], unit)
+    return str(size)
+
+
+class StageTimer:
+    """
+    Accumulates the wall time of wrapped functions by stage, across threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def add(self, name, seconds):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            stage["seconds"] += seconds
+            stage["calls"] += 1
+
+    def wrap(self, name, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+
+        return wrapper
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def reset(self):
+        with self.lock:
+            stages, self.stages = self.stages, {}
+        return stages
+
+
+def stage_targets(storage):
+    from distribute import views
+    from distribute.models import Package
+
+    targets = [
+        ("parse", views, "parse_package_file"),
+        ("build", views, "build_package"),
+        ("store_files", views, "store_package_files"),
+        ("save", Package, "save"),
+        ("finish", views, "finish_package"),
+        ("open_upload", views, "open_uploaded_file"),
+        ("storage_save", storage, "_save"),
+        ("storage_open", storage, "_open"),
+    ]
+    if hasattr(storage, "complete_multipart_upload"):
+        targets.append(("complete_multipart", storage, "complete_multipart_upload"))
+    return targets
+
+
+def read_process_io():
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(":") for line in f)}
+    except OSError:
+        return {}
+
+
+def reset_peak_rss():
+    # Resets VmHWM of the process, Linux only.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+class UploadBody:
+    """
+    A request body of `length` bytes of a file from `offset`, between `head`
+    and `tail`. Its length is known, so requests sends it with a
+    Content-Length instead of chunked.
+    """
+
+    def __init__(self, path, offset, length, head=b"", tail=b""):
+        self.file = open(path, "rb")
+        self.file.seek(offset)
+        self.remaining = length
+        self.head = head
+        self.tail = tail
+        self.len = len(head) + length + len(tail)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len
+        data = self.head[:size]
+        self.head = self.head[size:]
+        if len(data) < size and self.remaining:
+            chunk = self.file.read(min(size - len(data), self.remaining))
+            self.remaining -= len(chunk)
+            data += chunk
+        if len(data) < size and not self.remaining:
+            n = size - len(data)
+            data += self.tail[:n]
+            self.tail = self.tail[n:]
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def local_storage():
+    from storage.NginxFileStorage import NginxPrivateFileStorage
+
+    # Under the MEDIA_ROOT of the environment.
+    return NginxPrivateFileStorage()
+
+
+def oss_storage(endpoint):
+    from storage.AliyunOssStorage import AliyunOssStorage
+
+    # The settings based AliyunOssMediaStorage, pointed at the object store.
+    storage = AliyunOssStorage.__new__(AliyunOssStorage)
+    storage.access_key_id = storage.access_key_secret = "benchmark"
+    storage.end_point = storage.public_url = endpoint
+    storage.bucket_name = "media"
+    storage.public_read = False
+    storage.key_prefix = "media"
+    storage.role_arn = storage.region_id = ""
+    AliyunOssStorage.__init__(storage)
+    return storage
+
+
+def s3_storage(endpoint):
+    from botocore.config import Config
+
+    from storage.AWSS3Storage import AWSS3MediaStorage
+
+    config = Config(
+        s3={"addressing_style": "path"},
+        signature_version="s3v4",
+        request_checksum_calculation="when_required",
+        response_checksum_validation="when_required",
+    )
+    return AWSS3MediaStorage(
+        access_key="benchmark",
+        secret_key="benchmark",
+        bucket_name="media",
+        endpoint_url=endpoint,
+        region_name="us-east-1",
+        location="media",
+        client_config=config,
+    )
+
+
+class Environment:
+    """
+    The test database, the API server and an app with an upload token.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.settings = None
+        self.server = None
+        self.workers = []
+
+    def __enter__(self):
+        from django.core.servers.basehttp import (
+            ThreadedWSGIServer, WSGIRequestHandler,
+            get_internal_wsgi_application)
+        from django.db import connection
+        from django.test import override_settings
+        from django.test.utils import setup_test_environment
+
+        from distribute import task
+
+        setup_test_environment()
+        if connection.vendor == "sqlite":
+            # A file, the server and worker threads have connections of their
+            # own.
+            test_settings = connection.settings_dict.setdefault("TEST", {})
+            test_settings["NAME"] = os.path.join(self.directory, "db.sqlite3")
+        self.old_name = connection.creation.create_test_db(verbosity=0)
+        self.settings = override_settings(
+            ALLOWED_HOSTS=["127.0.0.1", "testserver"],
+            MEDIA_ROOT=os.path.join(self.directory, "media"),
+            # Every case parses and stores its package from scratch.
+            PACKAGE_PARSE_CACHE_SIZE=0,
+            PACKAGE_DEDUPLICATION=False,
+            PACKAGE_PATCH_BASES=0,
+            AWS_STORAGE_PUBLIC_READ=False,
+            JOB_POLL_INTERVAL=0.05,
+        )
+        self.settings.enable()
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadedWSGIServer(("127.0.0.1", 0), QuietHandler)
+        self.server.set_app(get_internal_wsgi_application())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.workers = task.start_workers(2)
+        self.create_app()
+        return self
+
+    def __exit__(self, *args):
+        from django.db import connection
+        from django.test.utils import teardown_test_environment
+
+        for worker in self.workers:
+            worker.stop()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.settings is not None:
+            self.settings.disable()
+        connection.creation.destroy_test_db(self.old_name, verbosity=0)
+        teardown_test_environment()
+
+    def create_app(self):
+        from application.models import AppAPIToken
+        from client.api import Api
+        from client.unit_test_client import UnitTestClient
+
+        api = Api(UnitTestClient(), "benchmark", True)
+        namespace = api.get_user_api(api.client.username)
+        app = {
+            "path": "benchmark",
+            "name": "Benchmark",
+            "install_slug": "benchmark",
+            "visibility": "Private",
+            "enable_os": ["iOS", "Android"],
+        }
+        r = namespace.create_app(app)
+        if r.status_code != 201:
+            raise BenchmarkError("create app: %s" % r.content)
+        r = namespace.get_app_api("benchmark").create_token(
+            {"name": "benchmark", "enable_upload_package": True}
+        )
+        if r.status_code != 201:
+            raise BenchmarkError("create token: %s" % r.content)
+        self.token_key = r.json()["token"]
+        self.token = AppAPIToken.objects.get(token=self.token_key)
+
+    def url(self, path):
+        from django.conf import settings
+
+        prefix = "/" + settings.API_URL_PREFIX if settings.API_URL_PREFIX else ""
+        return "http://127.0.0.1:%d%s%s" % (self.server.server_port, prefix, path)
+
+    def request(self, method, path, expected, **kwargs):
+        headers = kwargs.pop("headers", {})
+        headers["Authorization"] = "Token " + self.token_key
+        r = requests.request(method, self.url(path), headers=headers, **kwargs)
+        if r.status_code != expected:
+            raise BenchmarkError(
+                "%s %s: %d %s" % (method, path, r.status_code, r.text[:200])
+            )
+        return r
+
+    def cleanup(self):
+        from django.db.models import Q
+        from django.utils import timezone
+
+        from distribute.models import FileUploadRecord, Job, Package
+        from distribute.task import ready_jobs
+
+        # Wait for the background jobs of the case, retries excluded.
+        running = Q(state=Job.State.Running)
+        while Job.objects.filter(ready_jobs(timezone.now()) | running).exists():
+            time.sleep(0.05)
+        for package in Package.objects.all():
+            for field in [package.package_file, package.icon_file]:
+                try:
+                    field.delete(save=False)
+                except:  # noqa: E722
+                    pass
+        FileUploadRecord.objects.all().delete()
+        Package.objects.all().delete()
+
+
+def ingest_create(env, path, timer):
+    from django.core.files import File
+
+    from distribute.views import create_package
+
+    with open(path, "rb") as f:
+        create_package(env.token, env.token.app, File(f, os.path.basename(path)))
+
+
+def ingest_direct(env, path, timer):
+    from django.db import connection
+
+    size = os.path.getsize(path)
+    with timer.measure("request_upload"):
+        data = {"filename": os.path.basename(path), "size": size, "multipart": True}
+        ret = env.request("POST", "/upload/request", 200, json=data).json()
+    record = "/upload/record/%d" % ret["record_id"]
+
+    def put_part(part):
+        offset = (part["part_number"] - 1) * ret["part_size"]
+        body = UploadBody(path, offset, min(ret["part_size"], size - offset))
+        try:
+            r = requests.put(part["upload_url"], data=body)
+        finally:
+            body.close()
+        if r.status_code != 200:
+            raise BenchmarkError("upload part: %d %s" % (r.status_code, r.text[:200]))
+
+    def put_chunk(offset):
+        body = UploadBody(path, offset, min(CHUNK_SIZE, size - offset))
+        try:
+            env.request(
+                "PUT", record + "/chunks", 200, params={"offset": offset}, data=body
+            )
+        finally:
+            body.close()
+
+    workers = UPLOAD_WORKERS
+    if "parts" not in ret and connection.vendor == "sqlite":
+        # Concurrent chunk PUTs fail with "database is locked" when SQLite
+        # cannot upgrade the lock of their transactions.
+        workers = 1
+    with timer.measure("client_upload"):
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            if "parts" in ret:
+                futures = [executor.submit(put_part, x) for x in ret["parts"]]
+            else:
+                offsets = range(0, size, CHUNK_SIZE)
+                futures = [executor.submit(put_chunk, x) for x in offsets]
+            for future in futures:
+                future.result()
+
+    with timer.measure("processing"):
+        status = env.request("POST", record, 200, json={}).json()
+        while status["status"] not in ("completed", "failed"):
+            params = {"wait": POLL_SECONDS}
+            status = env.request("GET", record, 200, params=params).json()
+    if status["status"] == "failed":
+        raise BenchmarkError(status["error"]["message"])
+
+
+def ingest_token(env, path, timer):
+    boundary = uuid.uuid4().hex
+    head = (
+        "--%s\r\n"
+        'Content-Disposition: form-data; name="file"; filename="%s"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ) % (boundary, os.path.basename(path))
+    tail = "\r\n--%s--\r\n" % boundary
+    body = UploadBody(
+        path, 0, os.path.getsize(path), head.encode(), tail.encode()
+    )
+    headers = {"Content-Type": "multipart/form-data; boundary=" + boundary}
+    try:
+        env.request("POST", "/upload/file", 201, data=body, headers=headers)
+    finally:
+        body.close()
+
+
+INGEST_FLOWS = {
+    "create": ingest_create,
+    "direct": ingest_direct,
+    "token": ingest_token,
+}
+
+
+def run_case(env, flow, path, timer, object_store):
+    timer.reset()
+    sent = object_store.bytes_sent if object_store else 0
+    io_before = read_process_io()
+    rss_reset = reset_peak_rss()
+    error = ""
+    start = time.perf_counter()
+    try:
+        INGEST_FLOWS[flow](env, path, timer)
+    except Exception as e:
+        error = " ".join(("%s: %s" % (type(e).__name__, e)).split())
+    wall = time.perf_counter() - start
+    io_after = read_process_io()
+    result = {
+        "flow": flow,
+        "wall_seconds": round(wall, 4),
+        "stages": {
+            name: {"seconds": round(x["seconds"], 4), "calls": x["calls"]}
+            for name, x in sorted(timer.reset().items())
+        },
+        "peak_rss_bytes": peak_rss(),
+        "peak_rss_reset": rss_reset,
+        "read_bytes": io_after.get("rchar", 0) - io_before.get("rchar", 0),
+        "storage_read_bytes": object_store.bytes_sent - sent if object_store else None,
+        "error": error,
+    }
+    env.cleanup()
+    return result
+
+
+@contextlib.contextmanager
+def backend_storage(name):
+    if name == "local":
+        yield local_storage(), None
+        return
+    with ObjectStoreServer(bucket="media") as server:
+        if name == "oss":
+            yield oss_storage(server.endpoint), server
+        else:
+            yield s3_storage(server.endpoint), server
+
+
+def run(args, directory):
+    from django.core.files.storage import default_storage
+    from django.utils.functional import empty
+
+    from distribute.tests.packages import make_apk
+    from distribute.views import CheckUploadPackage
+
+    timer = StageTimer()
+    results = []
+    with Environment(directory) as env:
+        for size in args.sizes:
+            path = os.path.join(directory, "benchmark-%s.apk" % format_size(size))
+            make_apk(path, entries=max(1, size // ENTRY_SIZE), payload_size=size)
+            for backend in args.backends:
+                with backend_storage(backend) as (storage, server):
+                    default_storage._wrapped = storage
+                    with contextlib.ExitStack() as stack:
+                        # Polls often enough not to round up the direct uploads.
+                        stack.enter_context(
+                            mock.patch.object(CheckUploadPackage, "poll_interval", 0.02)
+                        )
+                        for stage, target, attribute in stage_targets(storage):
+                            func = timer.wrap(stage, getattr(target, attribute))
+                            stack.enter_context(
+                                mock.patch.object(target, attribute, func)
+                            )
+                        for flow in args.flows:
+                            result = run_case(env, flow, path, timer, server)
+                            result = dict(
+                                backend=backend,
+                                size=os.path.getsize(path),
+                                **result,
+                            )
+                            print_result(result)
+                            results.append(result)
+                    default_storage._wrapped = empty
+                shutil.rmtree(os.path.join(directory, "media"), ignore_errors=True)
+            os.remove(path)
+    return results
+
+
+def print_result(result, baseline=None):
+    line = "%-6s %-7s %7s %9.2fs %9s rss %9s read" % (
+        result["backend"],
+        result["flow"],
+        format_size(result["size"]),
+        result["wall_seconds"],
+        format_size(result["peak_rss_bytes"]),
+        format_size(result["read_bytes"]),
+    )
+    if baseline:
+        line += "  %+.1f%%" % (
+            (result["wall_seconds"] / baseline["wall_seconds"] - 1) * 100
+        )
+    if result["error"]:
+        line += "  " + result["error"][:120]
+    print(line, flush=True)
+
+
+def compare(results, baseline):
+    cases = {(x["backend"], x["flow"], x["size"]): x for x in baseline["results"]}
+    print("\nagainst %s:" % (baseline.get("commit") or "baseline"))
+    for result in results:
+        old = cases.get((result["backend"], result["flow"], result["size"]))
+        if old and not old["error"] and not result["error"]:
+            print_result(result, old)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", default=DEFAULT_SIZES)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--flows", default=",".join(FLOWS))
+    parser.add_argument("--output", default="")
+    parser.add_argument("--baseline", default="")
+    args = parser.parse_args()
+    args.sizes = [parse_size(x) for x in args.sizes.split(",")]
+    args.backends = args.backends.split(",")
+    args.flows = args.flows.split(",")
+    for value, choices in [(args.backends, BACKENDS), (args.flows, FLOWS)]:
+        unknown = set(value) - set(choices)
+        if unknown:
+            parser.error("unknown %s" % ", ".join(sorted(unknown)))
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "apphub.settings")
+    django.setup()
+    from django.db import connection
+
+    directory = tempfile.mkdtemp(prefix="ingest-benchmark-")
+    try:
+        results = run(args, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    report = {
+        "benchmark": "ingest",
+        "commit": git_commit(),
+        "database": connection.vendor,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    # A failed case is reported, and fails the run.
+    if any(result["error"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+"""
+An in-process stand-in for S3 and OSS, for benchmarks.
+
+Serves the part of the object APIs the storages use: objects with ranged
+GETs, server side copies, multipart uploads with part copies, and listing.
+Objects are kept in files under a temporary directory, so big packages do
+not inflate the memory of the process being measured. Requests are not
+authenticated, signed urls work as they are.
+
+    with ObjectStoreServer(bucket="media") as server:
+        server.endpoint     # http://127.0.0.1:<port>
+        server.bytes_sent   # object bytes served by GETs
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+BUFFER_SIZE = 1024 * 1024
+
+
+def iso8601(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp))
+
+
+def element(name, fields, children=()):
+    body = "".join("<%s>%s</%s>" % (x, escape(str(value)), x) for x, value in fields)
+    return "<%s>%s%s</%s>" % (name, body, "".join(children), name)
+
+
+def xml(name, fields, children=()):
+    return ('<?xml version="1.0" encoding="UTF-8"?>' + element(name, fields, children)).encode()  # noqa: E501
+
+
+def strip_namespace(tag):
+    return tag.split("}", 1)[-1]
+
+
+class StoredObject:
+    def __init__(self, path, size, etag, object_type, content_type):
+        self.path = path
+        self.size = size
+        self.etag = etag
+        self.object_type = object_type
+        self.content_type = content_type
+        self.modified = time.time()
+
+
+class ObjectStoreHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def parse(self):
+        url = urlsplit(self.path)
+        self.query = dict(parse_qsl(url.query, keep_blank_values=True))
+        self.key = self.store.key_from_path(unquote(url.path))
+
+    def read_body(self, out):
+        """
+        Copy the request body to `out`, returning its size and MD5.
+        """
+        md5 = hashlib.md5()
+        size = 0
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                length = int(self.rfile.readline().split(b";")[0], 16)
+                if length == 0:
+                    self.rfile.readline()
+                    break
+                data = self.rfile.read(length)
+                self.rfile.readline()
+                out.write(data)
+                md5.update(data)
+                size += len(data)
+            return size, md5.hexdigest()
+        remaining = int(self.headers.get("Content-Length", 0))
+        while remaining > 0:
+            data = self.rfile.read(min(remaining, BUFFER_SIZE))
+            if not data:
+                break
+            out.write(data)
+            md5.update(data)
+            size += len(data)
+            remaining -= len(data)
+        return size, md5.hexdigest()
+
+    def send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("x-oss-request-id", uuid.uuid4().hex)
+        if body:
+            self.send_header("Content-Type", "application/xml")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_error_xml(self, status, code):
+        self.send(status, xml("Error", [("Code", code), ("Message", code)]))
+
+    def object_headers(self, obj):
+        return {
+            "ETag": '"%s"' % obj.etag,
+            "Last-Modified": formatdate(obj.modified, usegmt=True),
+            "Content-Type": obj.content_type,
+            "Accept-Ranges": "bytes",
+            "x-oss-object-type": obj.object_type,
+        }
+
+    def parse_range(self, value, size):
+        # Only the single "bytes=start-[end]" ranges the storages send.
+        start, end = value.split("=", 1)[1].split("-", 1)
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+        return start, end
+
+    def do_HEAD(self):
+        self.parse()
+        obj = self.store.get(self.key)
+        if obj is None:
+            return self.send(404)
+        headers = self.object_headers(obj)
+        self.send_response(200)
+        self.send_header("Content-Length", str(obj.size))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_GET(self):
+        self.parse()
+        if "uploadId" in self.query:
+            return self.list_parts()
+        if not self.key:
+            return self.list_objects()
+        obj = self.store.get(self.key)
+        if obj is None:
+            return self.send_error_xml(404, "NoSuchKey")
+        headers = self.object_headers(obj)
+        start, end = 0, obj.size - 1
+        status = 200
+        if self.headers.get("Range"):
+            start, end = self.parse_range(self.headers["Range"], obj.size)
+            if start >= obj.size:
+                return self.send_error_xml(416, "InvalidRange")
+            status = 206
+            headers["Content-Range"] = "bytes %d-%d/%d" % (start, end, obj.size)
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start + 1))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        with open(obj.path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(remaining, BUFFER_SIZE))
+                if not data:
+                    break
+                self.wfile.write(data)
+                self.store.count_sent(len(data))
+                remaining -= len(data)
+
+    def do_PUT(self):
+        self.parse()
+        source = self.headers.get("x-amz-copy-source") or self.headers.get(
+            "x-oss-copy-source"
+        )
+        if "uploadId" in self.query:
+            upload = self.store.uploads.get(self.query["uploadId"])
+            if upload is None:
+                return self.send_error_xml(404, "NoSuchUpload")
+            part_number = int(self.query["partNumber"])
+            if source:
+                return self.copy(source, upload=upload, part_number=part_number)
+            path, size, etag = self.store.write(self.read_body)
+            upload["parts"][part_number] = (path, size, etag, time.time())
+            return self.send(200, headers={"ETag": '"%s"' % etag})
+        if source:
+            return self.copy(source)
+        path, size, etag = self.store.write(self.read_body)
+        content_type = self.headers.get("Content-Type", "application/octet-stream")
+        self.store.put(self.key, StoredObject(path, size, etag, "Normal", content_type))
+        self.send(200, headers={"ETag": '"%s"' % etag})
+
+    def copy(self, source, upload=None, part_number=None):
+        source = self.store.key_from_path(unquote(source.split("?")[0]))
+        obj = self.store.get(source)
+        if obj is None:
+            return self.send_error_xml(404, "NoSuchKey")
+        start, end = 0, obj.size - 1
+        byte_range = self.headers.get("x-amz-copy-source-range") or self.headers.get(
+            "x-oss-copy-source-range"
+        )
+        if byte_range:
+            start, end = self.parse_range(byte_range, obj.size)
+
+        def read_range(out):
+            md5 = hashlib.md5()
+            with open(obj.path, "rb") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    data = f.read(min(remaining, BUFFER_SIZE))
+                    out.write(data)
+                    md5.update(data)
+                    remaining -= len(data)
+            return end - start + 1, md5.hexdigest()
+
+        path, size, etag = self.store.write(read_range)
+        now = time.time()
+        if upload is not None:
+            upload["parts"][part_number] = (path, size, etag, now)
+            root = "CopyPartResult"
+        else:
+            self.store.put(
+                self.key,
+                StoredObject(path, size, etag, obj.object_type, obj.content_type),
+            )
+            root = "CopyObjectResult"
+        body = xml(root, [("LastModified", iso8601(now)), ("ETag", '"%s"' % etag)])
+        self.send(200, body, {"ETag": '"%s"' % etag})
+
+    def do_POST(self):
+        self.parse()
+        if "uploads" in self.query:
+            upload_id = self.store.create_upload(
+                self.key, self.headers.get("Content-Type", "application/octet-stream")
+            )
+            body = xml(
+                "InitiateMultipartUploadResult",
+                [
+                    ("Bucket", self.store.bucket),
+                    ("Key", self.key),
+                    ("UploadId", upload_id),
+                ],
+            )
+            return self.send(200, body)
+        if "uploadId" in self.query:
+            return self.complete_upload()
+        self.send_error_xml(400, "InvalidRequest")
+
+    def complete_upload(self):
+        upload = self.store.uploads.get(self.query["uploadId"])
+        if upload is None:
+            return self.send_error_xml(404, "NoSuchUpload")
+        length = int(self.headers.get("Content-Length", 0))
+        root = ElementTree.fromstring(self.rfile.read(length))
+        numbers = [
+            int(child.text)
+            for part in root
+            for child in part
+            if strip_namespace(child.tag) == "PartNumber"
+        ]
+        parts = [upload["parts"][n] for n in numbers]
+
+        def concatenate(out):
+            for path, size, etag, modified in parts:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out, BUFFER_SIZE)
+            return sum(x[1] for x in parts), None
+
+        path, size, etag = self.store.write(concatenate)
+        digest = hashlib.md5(b"".join(bytes.fromhex(x[2]) for x in parts))
+        etag = "%s-%d" % (digest.hexdigest(), len(parts))
+        obj = StoredObject(path, size, etag, "Multipart", upload["content_type"])
+        self.store.put(upload["key"], obj)
+        self.store.drop_upload(self.query["uploadId"])
+        body = xml(
+            "CompleteMultipartUploadResult",
+            [
+                ("Location", self.store.bucket + "/" + upload["key"]),
+                ("Bucket", self.store.bucket),
+                ("Key", upload["key"]),
+                ("ETag", '"%s"' % etag),
+            ],
+        )
+        self.send(200, body, {"ETag": '"%s"' % etag})
+
+    def list_parts(self):
+        upload = self.store.uploads.get(self.query["uploadId"])
+        if upload is None:
+            return self.send_error_xml(404, "NoSuchUpload")
+        numbers = sorted(upload["parts"])
+        fields = [
+            ("Bucket", self.store.bucket),
+            ("Key", upload["key"]),
+            ("UploadId", self.query["uploadId"]),
+            ("PartNumberMarker", 0),
+            ("NextPartNumberMarker", numbers[-1] if numbers else 0),
+            ("MaxParts", 10000),
+            ("IsTruncated", "false"),
+        ]
+        parts = []
+        for n in numbers:
+            path, size, etag, modified = upload["parts"][n]
+            parts.append(
+                element(
+                    "Part",
+                    [
+                        ("PartNumber", n),
+                        ("LastModified", iso8601(modified)),
+                        ("ETag", '"%s"' % etag),
+                        ("Size", size),
+                    ],
+                )
+            )
+        self.send(200, xml("ListPartsResult", fields, parts))
+
+    def list_objects(self):
+        prefix = self.query.get("prefix", "")
+        keys = self.store.keys(prefix)
+        fields = [
+            ("Name", self.store.bucket),
+            ("Prefix", prefix),
+            ("KeyCount", len(keys)),
+            ("MaxKeys", 1000),
+            ("IsTruncated", "false"),
+        ]
+        contents = []
+        for key in keys:
+            obj = self.store.get(key)
+            contents.append(
+                element(
+                    "Contents",
+                    [
+                        ("Key", key),
+                        ("LastModified", iso8601(obj.modified)),
+                        ("ETag", '"%s"' % obj.etag),
+                        ("Type", obj.object_type),
+                        ("Size", obj.size),
+                        ("StorageClass", "Standard"),
+                    ],
+                )
+            )
+        self.send(200, xml("ListBucketResult", fields, contents))
+
+    def do_DELETE(self):
+        self.parse()
+        if "uploadId" in self.query:
+            self.store.drop_upload(self.query["uploadId"])
+        else:
+            self.store.delete(self.key)
+        self.send(204)
+
+
+class ObjectStore:
+    def __init__(self, bucket, directory):
+        self.bucket = bucket
+        self.directory = directory
+        self.objects = {}
+        self.uploads = {}
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+    def key_from_path(self, path):
+        # The bucket is in the path, as in S3 path style urls and in OSS urls
+        # of an IP endpoint. Copy sources name it too.
+        key = path.lstrip("/")
+        if key.split("/", 1)[0] == self.bucket:
+            key = key[len(self.bucket) + 1 :]
+        return key
+
+    def count_sent(self, size):
+        with self.lock:
+            self.bytes_sent += size
+
+    def write(self, copy):
+        path = os.path.join(self.directory, uuid.uuid4().hex)
+        with open(path, "wb") as out:
+            size, etag = copy(out)
+        return path, size, etag
+
+    def get(self, key):
+        with self.lock:
+            return self.objects.get(key)
+
+    def keys(self, prefix):
+        with self.lock:
+            return sorted(x for x in self.objects if x.startswith(prefix))
+
+    def put(self, key, obj):
+        with self.lock:
+            old = self.objects.get(key)
+            self.objects[key] = obj
+        if old is not None:
+            os.remove(old.path)
+
+    def delete(self, key):
+        with self.lock:
+            obj = self.objects.pop(key, None)
+        if obj is not None:
+            os.remove(obj.path)
+
+    def create_upload(self, key, content_type):
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[upload_id] = {
+                "key": key,
+                "content_type": content_type,
+                "parts": {},
+            }
+        return upload_id
+
+    def drop_upload(self, upload_id):
+        with self.lock:
+            upload = self.uploads.pop(upload_id, None)
+        for path, size, etag, modified in (upload or {"parts": {}})["parts"].values():
+            os.remove(path)
+
+
+class ObjectStoreServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, bucket="media"):
+        super().__init__(("127.0.0.1", 0), ObjectStoreHandler)
+        self.directory = tempfile.mkdtemp(prefix="object-store-")
+        self.store = ObjectStore(bucket, self.directory)
+        self.endpoint = "http://127.0.0.1:%d" % self.server_address[1]
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def handle_error(self, request, client_address):
+        # Ranged reads drop their stream once they have read enough.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def bytes_sent(self):
+        return self.store.bytes_sent
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,112 @@
+import os.path
+
+from django.conf import settings
+
+from application.models import Webhook
+from distribute.models import Package, Release, StoreAppVersionRecord, Upgrade
+from distribute.task import notify_webhooks, run_in_background
+from util.span import span
+
+
+def package_data(package):
+    # distribute.serializers publishes events, import it when sending them.
+    from distribute.serializers import PackageSerializer
+
+    app = package.app.universal_app
+    plist_url_name = ""
+    namespace = ""
+    if app.owner:
+        plist_url_name = "user-app-package-plist"
+        namespace = app.owner.username
+    elif app.org:
+        plist_url_name = "org-app-package-plist"
+        namespace = app.org.path
+
+    context = {
+        "plist_url_name": plist_url_name,
+        "namespace": namespace,
+        "path": app.path,
+    }
+    serializer = PackageSerializer(package, context=context)
+
+    data = serializer.data
+    data["short_commit_id"] = data.get("commit_id", "")[:8]
+    data["download_url"] = os.path.join(settings.EXTERNAL_WEB_URL, 'd/' + app.install_slug)   # noqa: E501
+    return data
+
+
+def release_data(release):
+    data = package_data(release.package)
+    data["release_id"] = release.release_id
+    data["release_notes"] = release.release_notes
+    data["enabled"] = release.enabled
+    return data
+
+
+def upgrade_data(upgrade):
+    data = release_data(upgrade.release)
+    data["upgrade_id"] = upgrade.upgrade_id
+    data["upgrade_notes"] = upgrade.release_notes
+    data["target_version"] = upgrade.target_version
+    data["mandatory"] = upgrade.mandatory
+    return data
+
+
+def store_version_data(record):
+    from distribute.serializers import StoreAppVersionSerializer
+
+    app = record.app.universal_app
+    data = StoreAppVersionSerializer(record).data
+    data["name"] = app.name
+    data["path"] = app.path
+    data["download_url"] = os.path.join(settings.EXTERNAL_WEB_URL, 'd/' + app.install_slug)   # noqa: E501
+    return data
+
+
+# The Webhook flag subscribing to an event, the model of the object the event
+# is about and the values of that object substituted into webhook templates.
+EVENTS = {
+    "new_package": ("when_new_package", Package, package_data),
+    "new_release": ("when_new_release", Release, release_data),
+    "new_upgrade": ("when_new_upgrade", Upgrade, upgrade_data),
+    "store_state_change": (
+        "when_store_state_change",
+        StoreAppVersionRecord,
+        store_version_data,
+    ),
+}
+
+
+def subscribers(event, universal_app):
+    flag = EVENTS[event][0]
+    return Webhook.objects.filter(app=universal_app, **{flag: True})
+
+
+def publish(event, universal_app, object_id):
+    """
+    Send `event` about the object with `object_id` to the webhooks of
+    `universal_app`, or the app with that id, subscribed to it. The caller
+    pays for one query on the webhooks of the app, and when there are
+    subscribers, the job that sends to them.
+    """
+    if subscribers(event, universal_app).exists():
+        run_in_background(dispatch_event, event, object_id)
+
+
+def instance_app(instance):
+    if isinstance(instance, Upgrade):
+        return instance.release.app.universal_app
+    return instance.app.universal_app
+
+
+def dispatch_event(event, object_id):
+    flag, model, get_data = EVENTS[event]
+    instance = model.objects.filter(id=object_id).first()
+    if instance is None:
+        return
+    data = get_data(instance)
+    webhook_list = list(subscribers(event, instance_app(instance)))
+    with span("webhook.notify", event=event) as s:
+        s.set(webhooks=len(webhook_list))
+        # Every database query runs here, the threads only send.
+        notify_webhooks(event, webhook_list, data)
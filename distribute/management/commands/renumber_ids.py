@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+
+from application.models import Application
+from distribute.models import Counter, Package, Release
+
+
+class Command(BaseCommand):
+    help = (
+        "Give duplicate package ids and release ids of a universal app new "
+        "values, then fill the universal_app column of packages and releases "
+        "the unique constraints on (universal_app, package_id) and "
+        "(universal_app, release_id) use. Run it after adding the column to an "
+        "existing database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only print what would be renumbered.",
+        )
+
+    def handle(self, *args, **options):
+        for model, field, name in [
+            (Package, "package_id", "package"),
+            (Release, "release_id", "release"),
+        ]:
+            self.renumber(model, field, name, options["dry_run"])
+            if not options["dry_run"]:
+                # Renumbered first, so the filled column breaks no constraint.
+                self.fill_universal_app(model, name)
+
+    def renumber(self, model, field, name, dry_run):
+        # Ids are numbered per universal app, an iOS and an Android package
+        # may have the same one.
+        duplicates = (
+            model.objects.order_by()
+            .values("app__universal_app", field)
+            .annotate(count=Count("id"))
+            .filter(count__gt=1)
+        )
+        for duplicate in duplicates:
+            universal_app_id = duplicate["app__universal_app"]
+            with transaction.atomic():
+                # The oldest one keeps its id, the others get the next values
+                # of the counter of their universal app.
+                instances = list(
+                    model.objects.select_related("app__universal_app")
+                    .filter(
+                        app__universal_app=universal_app_id,
+                        **{field: duplicate[field]}
+                    )
+                    .order_by("id")[1:]
+                )
+                for instance in instances:
+                    value = "?"
+                    if not dry_run:
+                        value = Counter.next_value(instance.app.universal_app, name)
+                        model.objects.filter(id=instance.id).update(**{field: value})
+                    self.stdout.write(
+                        "%s %d of universal app %d: %s %d -> %s"
+                        % (
+                            name,
+                            instance.id,
+                            universal_app_id,
+                            field,
+                            duplicate[field],
+                            value,
+                        )
+                    )
+
+    def fill_universal_app(self, model, name):
+        universal_app = Application.objects.filter(id=OuterRef("app")).values(
+            "universal_app"
+        )[:1]
+        count = model.objects.filter(universal_app__isnull=True).update(
+            universal_app=Subquery(universal_app)
+        )
+        if count:
+            self.stdout.write("Filled the universal app of %d %ss" % (count, name))
@@ -0,0 +1,43 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from distribute.task import Worker
+
+
+class Command(BaseCommand):
+    help = "Run background jobs. Start as many as needed, on any node."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of jobs run at the same time by this process.",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once no job is ready instead of waiting for more.",
+        )
+
+    def handle(self, *args, **options):
+        workers = [Worker() for i in range(max(options["concurrency"], 1))]
+
+        def stop(signum, frame):
+            # Finish the running jobs, their leases would delay them otherwise.
+            for worker in workers:
+                worker.stop()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, stop)
+            signal.signal(signal.SIGINT, stop)
+        threads = [
+            threading.Thread(target=worker.run, args=(options["burst"],))
+            for worker in workers
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
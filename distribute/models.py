@@ -1,14 +1,19 @@
 import hashlib
 
+from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Max, UniqueConstraint
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 
 # from django.conf import settings
 from application.models import Application, UniversalApp
 from distribute.stores.base import StoreType
-from util.choice import ChoiceField
+from util.choice import ChoiceField, CustomChoicesMeta
+from util.span import span
 from util.url import get_file_extension
 
 # from util.storage import make_directory, remove_directory, copy_file
@@ -38,6 +43,12 @@ def distribute_package_path(instance, filename):
         )
 
 
+def distribute_blob_path(instance, filename):
+    return "blobs/{0}/{1}.{2}".format(
+        instance.sha256[:2], instance.sha256, get_file_extension(filename, "zip")
+    )
+
+
 def distribute_icon_path(instance, filename):
     universal_app = instance.app.universal_app
     os = ChoiceField(choices=Application.OperatingSystem.choices).to_representation(
@@ -62,6 +73,52 @@ def distribute_icon_path(instance, filename):
         )
 
 
+class PackageBlob(models.Model):
+    """
+    A package binary shared by every package with the same content.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=distribute_blob_path)
+    size = models.IntegerField()
+    ref_count = models.IntegerField(default=0)
+    create_time = models.DateTimeField(auto_now_add=True)
+    update_time = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def acquire(cls, file, sha256):
+        """
+        Return (blob, created) for the content of `file` with one more
+        reference, storing the file only when no blob has the content yet.
+        """
+        if cls.objects.filter(sha256=sha256).update(ref_count=F("ref_count") + 1):
+            return cls.objects.get(sha256=sha256), False
+        blob = cls(sha256=sha256, size=file.size, ref_count=1)
+        blob.file.save(file.name, file, save=False)
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # The same content was stored concurrently, use that one.
+            blob.file.delete(save=False)
+            return cls.acquire(file, sha256)
+        return blob, True
+
+    @classmethod
+    def release(cls, blob_id):
+        """
+        Drop a reference, deleting the blob and its file with the last one.
+        """
+        with transaction.atomic():
+            blobs = cls.objects.filter(id=blob_id)
+            blobs.update(ref_count=F("ref_count") - 1)
+            blob = blobs.first()
+            if blob is None or blob.ref_count > 0:
+                return
+            blob.delete()
+        blob.file.delete(save=False)
+
+
 class Package(models.Model):
     operator_content_type = models.ForeignKey(ContentType, on_delete=models.DO_NOTHING)
     operator_object_id = models.PositiveIntegerField()
@@ -71,12 +128,21 @@ class Package(models.Model):
     package_id = models.IntegerField()
     build_type = models.CharField(max_length=32, default="Debug")
     app = models.ForeignKey(Application, on_delete=models.CASCADE)
+    # The universal app of `app`, set on save. Package ids are unique in it.
+    universal_app = models.ForeignKey(
+        UniversalApp, null=True, related_name="+", on_delete=models.CASCADE
+    )
     name = models.CharField(
         max_length=32, help_text="The app's name (extracted from the uploaded package)."
     )
     package_file = models.FileField(upload_to=distribute_package_path)
+    blob = models.ForeignKey(
+        PackageBlob, blank=True, null=True, on_delete=models.SET_NULL
+    )
     symbol_file = models.FileField(upload_to=distribute_package_path, blank=True)
     icon_file = models.FileField(upload_to=distribute_icon_path)
+    # {size: {ext: storage name}} of the resized icons, see util.image.
+    icons = models.JSONField(default=dict, blank=True)
     fingerprint = models.CharField(
         max_length=32, help_text="MD5 checksum of the package binary."
     )
@@ -104,12 +170,24 @@ class Package(models.Model):
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                "universal_app",
+                "package_id",
+                name="package_id_unique",
+            ),
+        ]
+
     def save(self, *args, **kwargs):
-        if not self.pk and self.package_file is not None:
-            md5 = hashlib.md5()
-            for chunk in self.package_file.chunks():
-                md5.update(chunk)
-            self.fingerprint = md5.hexdigest()
+        if self.universal_app_id is None:
+            self.universal_app_id = self.app.universal_app_id
+        if not self.pk and self.package_file is not None and not self.fingerprint:
+            with span("package.fingerprint", size=self.size):
+                md5 = hashlib.md5()
+                for chunk in self.package_file.chunks():
+                    md5.update(chunk)
+                self.fingerprint = md5.hexdigest()
         super(Package, self).save(*args, **kwargs)
 
     def make_public(self, install_slug):
@@ -136,7 +214,142 @@ class Package(models.Model):
     #     return install_slug + '/' + os_name + '/' + self.short_version + '/' + self.name + '.' + get_file_extension(file.name, 'zip') # noqa: E501
 
 
+@receiver(post_delete, sender=Package)
+def release_package_blob(sender, instance, **kwargs):
+    if instance.blob_id is not None:
+        PackageBlob.release(instance.blob_id)
+
+
+def distribute_patch_path(instance, filename):
+    package = instance.package
+    name = distribute_package_path(package, package.package_file.name)
+    name = name[: -len(get_file_extension(name, "zip")) - 1]
+    directory, name = name.rsplit("/", 1)
+    return "{0}/patches/{1}_from_{2}.patch".format(
+        directory, name, instance.base.package_id
+    )
+
+
+class PackagePatch(models.Model):
+    """
+    A delta patch that rebuilds `package` from the older package `base`, see
+    distribute.patch.
+    """
+
+    package = models.ForeignKey(
+        Package, on_delete=models.CASCADE, related_name="patches"
+    )
+    base = models.ForeignKey(Package, on_delete=models.CASCADE, related_name="+")
+    file = models.FileField(upload_to=distribute_patch_path)
+    size = models.IntegerField()
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                "package",
+                "base",
+                name="package_patch_unique",
+            ),
+        ]
+
+
+@receiver(post_delete, sender=PackagePatch)
+def delete_package_patch_file(sender, instance, **kwargs):
+    instance.file.delete(save=False)
+
+
+class PackageParseCache(models.Model):
+    """
+    Parse results of package binaries keyed by their MD5 and size, so the same
+    binary uploaded again is not parsed again. It quacks like a parser with
+    the stored icon's storage key in place of the icon bytes.
+
+    Entries belong to a universal app. Neither the parse result nor the icon
+    file of one app is handed to another, whatever the MD5 of its upload.
+    """
+
+    universal_app = models.ForeignKey(UniversalApp, on_delete=models.CASCADE)
+    fingerprint = models.CharField(max_length=32)
+    size = models.BigIntegerField()
+    os = models.IntegerField(choices=Application.OperatingSystem.choices)
+    display_name = models.CharField(max_length=128)
+    bundle_identifier = models.CharField(max_length=64)
+    version = models.CharField(max_length=64)
+    short_version = models.CharField(max_length=64)
+    minimum_os_version = models.CharField(max_length=32)
+    extra = models.JSONField(default=dict)
+    icon_name = models.CharField(max_length=1024, blank=True, default="")
+    icons = models.JSONField(default=dict, blank=True)
+    last_used = models.DateTimeField(db_index=True)
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                "universal_app",
+                "fingerprint",
+                "size",
+                name="package_parse_cache_unique",
+            ),
+        ]
+
+    app_icon = None
+
+    @classmethod
+    def lookup(cls, universal_app, fingerprint, size):
+        if not settings.PACKAGE_PARSE_CACHE_SIZE or not fingerprint:
+            return None
+        entries = cls.objects.filter(
+            universal_app=universal_app, fingerprint=fingerprint, size=size
+        )
+        if not entries.update(last_used=timezone.now()):
+            return None
+        return entries.first()
+
+    @classmethod
+    def store(cls, universal_app, fingerprint, size, pkg, icon_name, icons=None):
+        """
+        Remember the parse result, evicting the least recently used entries
+        beyond PACKAGE_PARSE_CACHE_SIZE.
+        """
+        max_size = settings.PACKAGE_PARSE_CACHE_SIZE
+        if not max_size or not fingerprint:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    universal_app=universal_app,
+                    fingerprint=fingerprint,
+                    size=size,
+                    os=pkg.os,
+                    display_name=pkg.display_name,
+                    bundle_identifier=pkg.bundle_identifier,
+                    version=pkg.version,
+                    short_version=pkg.short_version,
+                    minimum_os_version=pkg.minimum_os_version,
+                    extra=pkg.extra,
+                    icon_name=icon_name or "",
+                    icons=icons or {},
+                    last_used=timezone.now(),
+                )
+        except IntegrityError:
+            return
+        expired = cls.objects.order_by("-last_used").values_list("id", flat=True)
+        expired = list(expired[max_size:])
+        if expired:
+            cls.objects.filter(id__in=expired).delete()
+
+
 class FileUploadRecord(models.Model):
+    class State(models.IntegerChoices, metaclass=CustomChoicesMeta):
+        Uploaded = 1
+        Queued = 2
+        Parsing = 3
+        Storing = 4
+        Completed = 5
+        Failed = 6
+
     universal_app = models.ForeignKey(UniversalApp, on_delete=models.CASCADE)
     package = models.ForeignKey(
         Package,
@@ -145,12 +358,53 @@ class FileUploadRecord(models.Model):
         on_delete=models.CASCADE
     )
     data = models.JSONField(default=dict)
+    state = models.IntegerField(choices=State.choices, default=State.Uploaded)
+    error = models.CharField(max_length=1024, blank=True, default="")
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
 
 
+class Job(models.Model):
+    """
+    A background task, the dotted path of a function and its JSON arguments,
+    run by `manage.py worker`.
+
+    A worker leases the job while running it. When the lease expires, e.g.
+    because the worker died, the job is run again, so jobs must tolerate
+    running more than once. A job that raises is retried after a growing
+    delay until max_attempts, then left Failed with its error. Jobs that
+    succeed are deleted.
+    """
+
+    class State(models.IntegerChoices, metaclass=CustomChoicesMeta):
+        Pending = 1
+        Running = 2
+        Failed = 3
+
+    name = models.CharField(max_length=256)
+    args = models.JSONField(default=list)
+    state = models.IntegerField(choices=State.choices, default=State.Pending)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=1)
+    run_after = models.DateTimeField(default=timezone.now)
+    lease_owner = models.CharField(max_length=128, blank=True, default="")
+    lease_expires = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True, default="")
+    create_time = models.DateTimeField(auto_now_add=True)
+    update_time = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["state", "run_after"], name="job_ready_index"),
+        ]
+
+
 class Release(models.Model):
     app = models.ForeignKey(Application, on_delete=models.CASCADE)
+    # The universal app of `app`, set on save. Release ids are unique in it.
+    universal_app = models.ForeignKey(
+        UniversalApp, null=True, related_name="+", on_delete=models.CASCADE
+    )
     package = models.OneToOneField(Package, on_delete=models.CASCADE)
     release_id = models.IntegerField()
     release_notes = models.CharField(
@@ -163,6 +417,75 @@ class Release(models.Model):
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                "universal_app",
+                "release_id",
+                name="release_id_unique",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.universal_app_id is None:
+            self.universal_app_id = self.app.universal_app_id
+        super().save(*args, **kwargs)
+
+
+class Counter(models.Model):
+    """
+    Per universal app sequences for package_id and release_id. A value is
+    never handed out twice, the values taken by uploads that fail later are
+    skipped.
+    """
+
+    universal_app = models.ForeignKey(UniversalApp, on_delete=models.CASCADE)
+    name = models.CharField(max_length=32)
+    value = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                "universal_app",
+                "name",
+                name="counter_unique",
+            ),
+        ]
+
+    # The models and fields a counter continues from the first time it is used.
+    sources = {
+        "package": (Package, "package_id"),
+        "release": (Release, "release_id"),
+    }
+
+    @classmethod
+    def initial_value(cls, universal_app, name):
+        model, field = cls.sources[name]
+        queryset = model.objects.filter(app__universal_app=universal_app)
+        return queryset.aggregate(value=Max(field))["value"] or 0
+
+    @classmethod
+    def next_value(cls, universal_app, name, count=1):
+        """
+        Allocate `count` consecutive values and return the first one.
+        """
+        counters = cls.objects.filter(universal_app=universal_app, name=name)
+        with transaction.atomic():
+            # The UPDATE locks the row until the transaction commits, so
+            # concurrent uploads never get the same value.
+            if not counters.update(value=F("value") + count):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(
+                            universal_app=universal_app,
+                            name=name,
+                            value=cls.initial_value(universal_app, name),
+                        )
+                except IntegrityError:
+                    pass
+                counters.update(value=F("value") + count)
+            return counters.values_list("value", flat=True).get() - count + 1
+
 
 class Upgrade(models.Model):
     release = models.OneToOneField(Release, on_delete=models.CASCADE)
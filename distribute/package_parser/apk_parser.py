@@ -1,12 +1,65 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import struct
+import zipfile
+import zlib
+
 from androguard.core.bytecodes.apk import APK
 
 from application.models import Application
 
+from .axml import BinaryFormatError, BinaryXml, ResourceTable
 from .base import AppParser
 
+# What reading the manifest and resource table of a broken or unusual
+# package raises, LookupError also covering missing zip entries and values
+# that can not be resolved.
+MANIFEST_ERRORS = (
+    BinaryFormatError,
+    LookupError,
+    NotImplementedError,
+    struct.error,
+    zipfile.BadZipFile,
+    zlib.error,
+)
+
+
+class ApkManifest:
+    """
+    Reads package metadata straight from AndroidManifest.xml and
+    resources.arsc. Accessors return None for absent attributes and raise
+    LookupError when a value exists but cannot be resolved, so the caller
+    knows when to fall back to androguard.
+    """
+
+    def __init__(self, zip):
+        self.zip = zip
+        self.xml = BinaryXml(zip.read("AndroidManifest.xml"))
+        self.__resources = None
+
+    @property
+    def resources(self):
+        if self.__resources is None:
+            self.__resources = ResourceTable(self.zip.read("resources.arsc"))
+        return self.__resources
+
+    def string(self, tag, attribute):
+        value = self.xml.value(tag, attribute)
+        if isinstance(value, tuple):
+            value = self.resources.resolve_string(value[1])
+            if value is None:
+                raise LookupError(attribute)
+        return value
+
+    def file(self, tag, attribute):
+        value = self.xml.value(tag, attribute)
+        if isinstance(value, tuple):
+            value = self.resources.resolve_file(value[1])
+            if value is None:
+                raise LookupError(attribute)
+        return value
+
 
 class ApkParser(AppParser):
     @staticmethod
@@ -16,7 +69,34 @@ class ApkParser(AppParser):
         )
 
     def __init__(self, file):
-        self.apk = APK(file.read(), raw=True)
+        self.file = file
+        self.__apk = None
+        try:
+            self.zip = zipfile.ZipFile(file)
+            self.manifest = ApkManifest(self.zip)
+        except MANIFEST_ERRORS:
+            self.manifest = None
+            # Load it with androguard right away, so a broken package fails
+            # to parse instead of failing when a field is read.
+            self.apk
+
+    @property
+    def apk(self):
+        if self.__apk is None:
+            self.file.seek(0)
+            self.__apk = APK(self.file.read(), raw=True)
+        return self.__apk
+
+    def _string(self, tag, attribute, fallback, required=False):
+        if self.manifest is None:
+            return fallback()
+        try:
+            value = self.manifest.string(tag, attribute)
+        except MANIFEST_ERRORS:
+            return fallback()
+        if value is None and required:
+            return fallback()
+        return value
 
     @property
     def os(self):
@@ -24,15 +104,24 @@ class ApkParser(AppParser):
 
     @property
     def display_name(self):
-        return self.apk.get_app_name()
+        return self._string(
+            "application", "label", lambda: self.apk.get_app_name(), required=True
+        )
 
     @property
     def version(self):
-        return self.apk.get_androidversion_code()
+        return self._string(
+            "manifest",
+            "versionCode",
+            lambda: self.apk.get_androidversion_code(),
+            required=True,
+        )
 
     @property
     def short_version(self):
-        return self.apk.get_androidversion_name()
+        return self._string(
+            "manifest", "versionName", lambda: self.apk.get_androidversion_name()
+        )
 
     @property
     def minimum_os_version(self):
@@ -57,19 +146,40 @@ class ApkParser(AppParser):
             "28": "9",
             "29": "10.0",
         }
-        return sdk_version_dict.get(self.apk.get_min_sdk_version(), "")
+        return sdk_version_dict.get(self.min_sdk_version, "")
+
+    @property
+    def min_sdk_version(self):
+        return self._string(
+            "uses-sdk", "minSdkVersion", lambda: self.apk.get_min_sdk_version()
+        )
+
+    @property
+    def target_sdk_version(self):
+        return self._string(
+            "uses-sdk", "targetSdkVersion", lambda: self.apk.get_target_sdk_version()
+        )
 
     @property
     def bundle_identifier(self):
-        return self.apk.get_package()
+        return self._string(
+            "manifest", "package", lambda: self.apk.get_package(), required=True
+        )
 
     @property
     def app_icon(self):
+        if self.manifest is not None:
+            try:
+                path = self.manifest.file("application", "icon")
+                if path is not None:
+                    return self.zip.read(path)
+            except MANIFEST_ERRORS:
+                pass
         return self.apk.get_file(self.apk.get_app_icon())
 
     @property
     def extra(self):
         return {
-            "min_sdk_version": self.apk.get_min_sdk_version(),
-            "target_sdk_version": self.apk.get_target_sdk_version(),
+            "min_sdk_version": self.min_sdk_version,
+            "target_sdk_version": self.target_sdk_version,
         }
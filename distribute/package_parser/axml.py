@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Minimal readers for the Android binary XML (AndroidManifest.xml) and
+resource table (resources.arsc) formats.
+
+Only the pieces needed to read package metadata are decoded, so an APK can
+be inspected by reading a couple of zip entries instead of loading the whole
+archive into androguard.
+"""
+
+import struct
+
+RES_STRING_POOL_TYPE = 0x0001
+RES_TABLE_TYPE = 0x0002
+RES_XML_TYPE = 0x0003
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+RES_TABLE_PACKAGE_TYPE = 0x0200
+RES_TABLE_TYPE_TYPE = 0x0201
+
+TYPE_NULL = 0x00
+TYPE_REFERENCE = 0x01
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+TYPE_INT_BOOLEAN = 0x12
+
+UTF8_FLAG = 1 << 8
+NO_ENTRY = 0xFFFFFFFF
+
+ENTRY_FLAG_COMPLEX = 0x0001
+ENTRY_FLAG_COMPACT = 0x0008
+TYPE_FLAG_SPARSE = 0x01
+TYPE_FLAG_OFFSET16 = 0x02
+
+DENSITY_DEFAULT = 0
+DENSITY_MEDIUM = 160
+DENSITY_ANY = 0xFFFE
+DENSITY_NONE = 0xFFFF
+
+ANDROID_ATTRIBUTES = {
+    0x01010001: "label",
+    0x01010002: "icon",
+    0x01010003: "name",
+    0x0101020C: "minSdkVersion",
+    0x0101021B: "versionCode",
+    0x0101021C: "versionName",
+    0x01010270: "targetSdkVersion",
+}
+
+
+class BinaryFormatError(ValueError):
+    pass
+
+
+class StringPool:
+    """Decodes strings from a ResStringPool chunk on demand."""
+
+    def __init__(self, data, offset):
+        (
+            chunk_type,
+            header_size,
+            size,
+            count,
+            style_count,
+            flags,
+            strings_start,
+            styles_start,
+        ) = struct.unpack_from("<HHIIIIII", data, offset)
+        if chunk_type != RES_STRING_POOL_TYPE:
+            raise BinaryFormatError("string pool expected")
+        self.data = data
+        self.count = count
+        self.utf8 = bool(flags & UTF8_FLAG)
+        self.offsets = struct.unpack_from(
+            "<%dI" % count, data, offset + header_size
+        )
+        self.strings_start = offset + strings_start
+        self.size = size
+        self.cache = {}
+
+    def __len__(self):
+        return self.count
+
+    def get(self, index):
+        if index < 0 or index >= self.count:
+            return None
+        if index not in self.cache:
+            self.cache[index] = self._decode(self.strings_start + self.offsets[index])
+        return self.cache[index]
+
+    def _decode(self, pos):
+        data = self.data
+        if self.utf8:
+            # utf-16 length, then utf-8 byte length, each 1 or 2 bytes.
+            pos += 2 if data[pos] & 0x80 else 1
+            length = data[pos]
+            if length & 0x80:
+                length = ((length & 0x7F) << 8) | data[pos + 1]
+                pos += 2
+            else:
+                pos += 1
+            return data[pos : pos + length].decode("utf-8", errors="replace")
+        length = struct.unpack_from("<H", data, pos)[0]
+        pos += 2
+        if length & 0x8000:
+            high = length & 0x7FFF
+            length = (high << 16) | struct.unpack_from("<H", data, pos)[0]
+            pos += 2
+        return data[pos : pos + length * 2].decode("utf-16-le", errors="replace")
+
+
+def _chunks(data, offset, end):
+    while offset + 8 <= end:
+        chunk_type, header_size, size = struct.unpack_from("<HHI", data, offset)
+        if size < 8 or offset + size > end:
+            raise BinaryFormatError("truncated chunk")
+        yield chunk_type, header_size, offset, size
+        offset += size
+
+
+class BinaryXml:
+    """
+    Parses the start elements of a binary XML document.
+
+    `elements` is a list of (tag, attributes) in document order, where
+    attributes maps the attribute name to a (data_type, data) tuple. Android
+    framework attributes are named from the resource map, so obfuscated
+    attribute name strings are not a problem.
+    """
+
+    def __init__(self, data):
+        chunk_type, header_size, size = struct.unpack_from("<HHI", data, 0)
+        if chunk_type != RES_XML_TYPE:
+            raise BinaryFormatError("binary xml expected")
+        self.strings = None
+        self.resource_ids = ()
+        self.elements = []
+        end = min(size, len(data))
+        for chunk_type, header_size, offset, size in _chunks(data, header_size, end):
+            if chunk_type == RES_STRING_POOL_TYPE:
+                self.strings = StringPool(data, offset)
+            elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+                count = (size - header_size) // 4
+                self.resource_ids = struct.unpack_from(
+                    "<%dI" % count, data, offset + header_size
+                )
+            elif chunk_type == RES_XML_START_ELEMENT_TYPE:
+                self.elements.append(self._start_element(data, offset, header_size))
+
+    def _attribute_name(self, index):
+        if index < len(self.resource_ids):
+            name = ANDROID_ATTRIBUTES.get(self.resource_ids[index])
+            if name:
+                return name
+        return self.strings.get(index)
+
+    def _start_element(self, data, offset, header_size):
+        if self.strings is None:
+            raise BinaryFormatError("string pool missing")
+        ext = offset + header_size
+        (
+            ns,
+            name,
+            attribute_start,
+            attribute_size,
+            attribute_count,
+        ) = struct.unpack_from("<IIHHH", data, ext)
+        attributes = {}
+        pos = ext + attribute_start
+        for i in range(attribute_count):
+            (
+                attr_ns,
+                attr_name,
+                raw_value,
+                value_size,
+                res0,
+                data_type,
+                value,
+            ) = struct.unpack_from("<IIIHBBI", data, pos)
+            attributes[self._attribute_name(attr_name)] = (data_type, value)
+            pos += attribute_size
+        return self.strings.get(name), attributes
+
+    def find(self, tag):
+        for name, attributes in self.elements:
+            if name == tag:
+                return attributes
+        return None
+
+    def value(self, tag, attribute):
+        """
+        Returns the attribute as a string, a ("reference", id) tuple, or None.
+        """
+        attributes = self.find(tag)
+        if attributes is None or attribute not in attributes:
+            return None
+        data_type, data = attributes[attribute]
+        if data_type == TYPE_STRING:
+            return self.strings.get(data)
+        if data_type == TYPE_REFERENCE:
+            return ("reference", data)
+        if data_type == TYPE_INT_BOOLEAN:
+            return "true" if data else "false"
+        if data_type == TYPE_INT_DEC:
+            return str(struct.unpack("<i", struct.pack("<I", data))[0])
+        if data_type == TYPE_INT_HEX:
+            return "0x%x" % data
+        return None
+
+
+class ResourceTable:
+    """Looks up resource values in resources.arsc by resource id."""
+
+    def __init__(self, data):
+        chunk_type, header_size, size = struct.unpack_from("<HHI", data, 0)
+        if chunk_type != RES_TABLE_TYPE:
+            raise BinaryFormatError("resource table expected")
+        self.data = data
+        self.strings = None
+        self.types = {}
+        end = min(size, len(data))
+        for chunk_type, header_size, offset, size in _chunks(data, header_size, end):
+            if chunk_type == RES_STRING_POOL_TYPE:
+                self.strings = StringPool(data, offset)
+            elif chunk_type == RES_TABLE_PACKAGE_TYPE:
+                self._index_package(offset, header_size, size)
+
+    def _index_package(self, offset, header_size, size):
+        package_id = struct.unpack_from("<I", self.data, offset + 8)[0]
+        chunks = _chunks(self.data, offset + header_size, offset + size)
+        for chunk_type, header_size, chunk_offset, chunk_size in chunks:
+            if chunk_type == RES_TABLE_TYPE_TYPE:
+                type_id = self.data[chunk_offset + 8]
+                self.types.setdefault((package_id, type_id), []).append(
+                    (chunk_offset, header_size)
+                )
+
+    def _entry_offset(self, offset, header_size, index):
+        data = self.data
+        flags = data[offset + 9]
+        entry_count, entries_start = struct.unpack_from("<II", data, offset + 12)
+        table = offset + header_size
+        if flags & TYPE_FLAG_SPARSE:
+            for i in range(entry_count):
+                entry_index, entry_offset = struct.unpack_from(
+                    "<HH", data, table + i * 4
+                )
+                if entry_index == index:
+                    return offset + entries_start + entry_offset * 4
+            return None
+        if index >= entry_count:
+            return None
+        if flags & TYPE_FLAG_OFFSET16:
+            entry_offset = struct.unpack_from("<H", data, table + index * 2)[0]
+            if entry_offset == 0xFFFF:
+                return None
+            return offset + entries_start + entry_offset * 4
+        entry_offset = struct.unpack_from("<I", data, table + index * 4)[0]
+        if entry_offset == NO_ENTRY:
+            return None
+        return offset + entries_start + entry_offset
+
+    def _config(self, offset):
+        config = offset + 20
+        config_size = struct.unpack_from("<I", self.data, config)[0]
+        language = country = b""
+        density = DENSITY_DEFAULT
+        if config_size >= 12:
+            language = bytes(self.data[config + 8 : config + 10])
+            country = bytes(self.data[config + 10 : config + 12])
+        if config_size >= 16:
+            density = struct.unpack_from("<H", self.data, config + 14)[0]
+        return {
+            "default_locale": language in (b"", b"\x00\x00")
+            and country in (b"", b"\x00\x00"),
+            "density": density,
+        }
+
+    def values(self, resource_id):
+        """
+        Returns a list of (config, data_type, data) for every configuration
+        that defines a simple value for `resource_id`.
+        """
+        package_id = resource_id >> 24
+        type_id = (resource_id >> 16) & 0xFF
+        index = resource_id & 0xFFFF
+        ret = []
+        for offset, header_size in self.types.get((package_id, type_id), []):
+            entry = self._entry_offset(offset, header_size, index)
+            if entry is None:
+                continue
+            size, flags, key = struct.unpack_from("<HHI", self.data, entry)
+            if flags & ENTRY_FLAG_COMPACT:
+                data_type, data = flags >> 8, key
+            elif flags & ENTRY_FLAG_COMPLEX:
+                continue
+            else:
+                data_type, data = struct.unpack_from("<xxxBI", self.data, entry + size)
+            ret.append((self._config(offset), data_type, data))
+        return ret
+
+    def resolve_string(self, resource_id, depth=0):
+        if depth > 8:
+            return None
+        values = self.values(resource_id)
+        values.sort(key=lambda item: not item[0]["default_locale"])
+        for config, data_type, data in values:
+            if data_type == TYPE_STRING:
+                return self.strings.get(data)
+            if data_type == TYPE_REFERENCE:
+                return self.resolve_string(data, depth + 1)
+        return None
+
+    def resolve_file(self, resource_id, exclude=(".xml",), depth=0):
+        """
+        Returns the path of the highest density file for `resource_id`,
+        skipping paths ending with one of `exclude`.
+        """
+        if depth > 8:
+            return None
+        candidates = []
+        for config, data_type, data in self.values(resource_id):
+            path = None
+            if data_type == TYPE_STRING:
+                path = self.strings.get(data)
+            elif data_type == TYPE_REFERENCE:
+                path = self.resolve_file(data, exclude, depth + 1)
+            if path and not path.endswith(exclude):
+                density = config["density"]
+                if density == DENSITY_DEFAULT:
+                    density = DENSITY_MEDIUM
+                elif density in (DENSITY_ANY, DENSITY_NONE):
+                    density = 0
+                candidates.append((density, path))
+        if not candidates:
+            return None
+        return max(candidates)[1]
@@ -17,8 +17,43 @@ class IpaParser(AppParser):
 
     def __init__(self, file):
         self.zip = zipfile.ZipFile(file)
+        self.app_files, self.app_icons = self._index(self.zip)
         self.__plist = None
 
+    @staticmethod
+    def _index(zip):
+        """
+        Index the entries directly inside Payload/*.app/ by file name, and the
+        png files among them by icon name (without scale and device suffixes).
+        """
+        app_dir = None
+        files = {}
+        icons = {}
+        for info in zip.infolist():
+            name = info.filename
+            if not name.startswith("Payload/") or name.count("/") != 2:
+                continue
+            _, directory, filename = name.split("/")
+            if not directory.endswith(".app") or not filename:
+                continue
+            if app_dir is None:
+                app_dir = directory
+            elif directory != app_dir:
+                continue
+            files[filename] = info
+            if filename.endswith(".png"):
+                icons.setdefault(IpaParser._icon_name(filename), []).append(info)
+        return files, icons
+
+    @staticmethod
+    def _icon_name(filename):
+        if filename.endswith(".png"):
+            filename = filename[:-4]
+        for suffix in ("~ipad", "~iphone"):
+            if filename.endswith(suffix):
+                filename = filename[: -len(suffix)]
+        return re.sub(r"@\d+(\.\d+)?x$", "", filename)
+
     @property
     def os(self):
         return Application.OperatingSystem.iOS
@@ -47,33 +82,40 @@ class IpaParser(AppParser):
     def minimum_os_version(self):
         return self.plist.get("MinimumOSVersion")
 
+    @property
+    def icon_names(self):
+        names = []
+        for key in ("CFBundleIcons", "CFBundleIcons~ipad"):
+            primary = (self.plist.get(key) or {}).get("CFBundlePrimaryIcon") or {}
+            if isinstance(primary, dict):
+                names += primary.get("CFBundleIconFiles") or []
+        names += self.plist.get("CFBundleIconFiles") or []
+        if self.plist.get("CFBundleIconFile"):
+            names.append(self.plist.get("CFBundleIconFile"))
+        return [self._icon_name(name) for name in names]
+
     @property
     def app_icon(self):
-        icons = self.plist.get("CFBundleIcons", {})
-        icons = icons.get("CFBundlePrimaryIcon").get("CFBundleIconFiles")
-        if len(icons) == 0:
+        candidates = []
+        for name in self.icon_names:
+            candidates += self.app_icons.get(name, [])
+        if not candidates:
+            # Asset catalogs compile the app icon to AppIcon*.png files.
+            for name, infos in self.app_icons.items():
+                if name.startswith("AppIcon"):
+                    candidates += infos
+        if not candidates:
             return None
-        icons = sorted(icons, reverse=True)
-        pattern = re.compile(r"Payload/[^/]*.app/[^/]*.png")
-        for path in self.zip.namelist():
-            m = pattern.match(path)
-            if m is not None:
-                name = path.split("/")[-1]
-                if name.startswith(icons[0]) and name.endswith(".png"):
-                    return self.zip.read(path)
-
-        return None
+        # The largest rendition is the highest resolution one.
+        info = max(candidates, key=lambda info: info.file_size)
+        return self.zip.read(info)
 
     @property
     def plist(self):
         if self.__plist:
             return self.__plist
 
-        pattern = re.compile(r"Payload/[^/]*.app/Info.plist")
-        for path in self.zip.namelist():
-            m = pattern.match(path)
-            if m is not None:
-                # print(m)
-                data = self.zip.read(m.group())
-                self.__plist = plistlib.loads(data)
+        info = self.app_files.get("Info.plist")
+        if info is not None:
+            self.__plist = plistlib.loads(self.zip.read(info))
         return self.__plist
@@ -1,10 +1,20 @@
-from .apk_parser import ApkParser
+import plistlib
+from xml.parsers.expat import ExpatError
+
+from util.span import span
+
+from .apk_parser import MANIFEST_ERRORS, ApkParser
 from .ipa_parser import IpaParser
 
+# What parsing a broken package raises. Other errors, of the storage the
+# package is read from for example, are not about the package.
+PARSE_ERRORS = MANIFEST_ERRORS + (plistlib.InvalidFileException, ExpatError)
+
 
-def parse(fd, ext, os=None):
+def parse(fd, ext, os=None, size=None):
     parser_list = [IpaParser, ApkParser]
     for p in parser_list:
         if p.can_parse(ext, os):
-            return p(fd)
+            with span("package.parse", parser=p.__name__, size=size):
+                return p(fd)
     return None
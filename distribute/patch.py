@@ -0,0 +1,242 @@
+"""
+Delta patches between two zip archives, such as consecutive builds of an app.
+
+A patch rebuilds the new archive from the old one with two operations: copy
+a byte range of the old archive, or insert bytes carried by the patch. The
+compressed data of every entry that is unchanged in the old archive is
+copied, everything else (changed entries, local headers and the central
+directory) is inserted. The operations and inserted bytes are compressed
+with lzma, and the MD5 of the new archive is checked when the patch is
+applied. Both ends stream, neither holds the patch or an archive in memory.
+"""
+
+import hashlib
+import io
+import itertools
+import lzma
+import struct
+import zipfile
+
+MAGIC = b"AHPATCH1"
+# A patch bigger than this share of the new archive is not worth keeping.
+MAX_PATCH_RATIO = 0.8
+COPY = 0
+INSERT = 1
+
+_HEADER = struct.Struct("<QI16s")
+_OPERATION = struct.Struct("<BQQ")
+_LOCAL_HEADER = struct.Struct("<4s22xHH")
+_BLOCK_SIZE = 1024 * 1024
+
+
+class PatchError(ValueError):
+    pass
+
+
+def _data_offset(file, info):
+    # The extra field of the local header may differ from the central one.
+    file.seek(info.header_offset)
+    signature, name_length, extra_length = _LOCAL_HEADER.unpack(
+        file.read(_LOCAL_HEADER.size)
+    )
+    if signature != b"PK\x03\x04":
+        raise PatchError("bad local header of %s" % info.filename)
+    return info.header_offset + _LOCAL_HEADER.size + name_length + extra_length
+
+
+def _same_bytes(old, old_offset, new, new_offset, length):
+    while length > 0:
+        n = min(length, _BLOCK_SIZE)
+        old.seek(old_offset)
+        new.seek(new_offset)
+        if old.read(n) != new.read(n):
+            return False
+        old_offset += n
+        new_offset += n
+        length -= n
+    return True
+
+
+def _copy_range(src, offset, length, out, md5):
+    src.seek(offset)
+    while length > 0:
+        data = src.read(min(length, _BLOCK_SIZE))
+        if not data:
+            raise PatchError("unexpected end of file at offset %d" % offset)
+        out.write(data)
+        md5.update(data)
+        length -= len(data)
+
+
+class _PatchWriter:
+    def __init__(self):
+        self.operations = []
+        # The ranges of the new archive carried by the patch.
+        self.inserts = []
+        self.inserted = 0
+
+    def insert(self, start, end):
+        if end <= start:
+            return
+        self.inserts.append((start, end))
+        self._append(INSERT, self.inserted, end - start)
+        self.inserted += end - start
+
+    def copy(self, offset, length):
+        self._append(COPY, offset, length)
+
+    def _append(self, kind, offset, length):
+        if self.operations:
+            last_kind, last_offset, last_length = self.operations[-1]
+            if last_kind == kind and last_offset + last_length == offset:
+                self.operations[-1] = (kind, last_offset, last_length + length)
+                return
+        self.operations.append((kind, offset, length))
+
+
+def _read_range(src, offset, length):
+    src.seek(offset)
+    while length > 0:
+        data = src.read(min(length, _BLOCK_SIZE))
+        if not data:
+            raise PatchError("unexpected end of file at offset %d" % offset)
+        yield data
+        length -= len(data)
+
+
+def make_patch(old, new, out, digest="", max_size=None):
+    """
+    Write the patch that rebuilds the archive `new` from the archive `old`,
+    both seekable binary files, to `out` and return its size. `digest` is
+    the hex MD5 of `new`, computed when not given. Raise PatchError as soon
+    as the patch is bigger than `max_size`.
+    """
+    try:
+        old_entries = zipfile.ZipFile(old).infolist()
+        new_entries = zipfile.ZipFile(new).infolist()
+    except zipfile.BadZipFile as e:
+        raise PatchError(str(e))
+    candidates = {}
+    for info in old_entries:
+        key = (info.filename, info.CRC, info.compress_type, info.compress_size)
+        candidates[key] = info
+
+    writer = _PatchWriter()
+    pos = 0
+    for info in sorted(new_entries, key=lambda x: x.header_offset):
+        key = (info.filename, info.CRC, info.compress_type, info.compress_size)
+        base = candidates.get(key)
+        if base is None or not info.compress_size:
+            continue
+        start = _data_offset(new, info)
+        base_start = _data_offset(old, base)
+        if not _same_bytes(old, base_start, new, start, info.compress_size):
+            continue
+        writer.insert(pos, start)
+        writer.copy(base_start, info.compress_size)
+        pos = start + info.compress_size
+    new.seek(0, io.SEEK_END)
+    size = new.tell()
+    writer.insert(pos, size)
+
+    if digest:
+        digest = bytes.fromhex(digest)
+    else:
+        md5 = hashlib.md5()
+        for data in _read_range(new, 0, size):
+            md5.update(data)
+        digest = md5.digest()
+
+    # The inserted bytes are read from `new` again while compressing, so
+    # neither they nor the patch are held in memory.
+    header = [_HEADER.pack(size, len(writer.operations), digest)]
+    header += [_OPERATION.pack(*x) for x in writer.operations]
+    blocks = [[b"".join(header)]]
+    blocks += [_read_range(new, start, end - start) for start, end in writer.inserts]
+    compressor = lzma.LZMACompressor()
+    out.write(MAGIC)
+    written = len(MAGIC)
+    # None flushes the compressor after the last block.
+    for data in itertools.chain(*blocks, [None]):
+        if data is None:
+            data = compressor.flush()
+        else:
+            data = compressor.compress(data)
+        out.write(data)
+        written += len(data)
+        if max_size is not None and written > max_size:
+            raise PatchError("patch is bigger than %d bytes" % max_size)
+    return written
+
+
+class _PatchReader:
+    """
+    The decompressed body of the patch file `patch`, decompressed as it is
+    read.
+    """
+
+    def __init__(self, patch):
+        self.patch = patch
+        self.decompressor = lzma.LZMADecompressor()
+        self.buffer = b""
+
+    def _decompress(self):
+        data = b""
+        if self.decompressor.needs_input:
+            data = self.patch.read(_BLOCK_SIZE)
+            if not data:
+                raise PatchError("truncated patch")
+        try:
+            self.buffer += self.decompressor.decompress(data, _BLOCK_SIZE)
+        except lzma.LZMAError as e:
+            raise PatchError(str(e))
+
+    def read(self, n):
+        while len(self.buffer) < n:
+            if self.decompressor.eof:
+                raise PatchError("truncated patch")
+            self._decompress()
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+    def finish(self):
+        # Read to the end of the lzma stream, whose check covers all of it.
+        while not self.buffer and not self.decompressor.eof:
+            self._decompress()
+        if self.buffer:
+            raise PatchError("trailing data in patch")
+
+
+def apply_patch(old, patch, out):
+    """
+    Write the archive rebuilt from `old` and the patch read from the binary
+    file `patch` to `out`. Neither the patch nor the archive are held in
+    memory.
+    """
+    if patch.read(len(MAGIC)) != MAGIC:
+        raise PatchError("not a patch")
+    body = _PatchReader(patch)
+    size, count, digest = _HEADER.unpack(body.read(_HEADER.size))
+    operations = []
+    for i in range(count):
+        operations.append(_OPERATION.unpack(body.read(_OPERATION.size)))
+    md5 = hashlib.md5()
+    written = 0
+    inserted = 0
+    for kind, offset, length in operations:
+        written += length
+        if kind == COPY:
+            _copy_range(old, offset, length, out, md5)
+        elif offset == inserted:
+            # Inserted bytes follow the operations in the order they are used.
+            inserted += length
+            while length > 0:
+                data = body.read(min(length, _BLOCK_SIZE))
+                out.write(data)
+                md5.update(data)
+                length -= len(data)
+        else:
+            raise PatchError("bad insert at offset %d" % offset)
+    body.finish()
+    if written != size or md5.digest() != digest:
+        raise PatchError("patched file does not match")
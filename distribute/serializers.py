@@ -1,13 +1,17 @@
+from django.core.files.storage import default_storage
 from django.core.signing import TimestampSigner
 # from django.db.models import Max
 from django.urls import reverse
 from rest_framework import serializers
 
 from application.models import Application
-from distribute.models import Package, Release, StoreApp, StoreAppVersionRecord
+from distribute.events import publish
+from distribute.models import (Counter, Package, PackagePatch, Release,
+                               StoreApp, StoreAppVersionRecord)
 from distribute.stores.base import StoreType
 from distribute.stores.store import get_store
 from util.choice import ChoiceField
+from util.image import ICON_SIZES
 from util.url import build_absolute_uri
 
 
@@ -15,11 +19,41 @@ def compare_short_version(short_version1, short_version2):
     return True
 
 
+def package_icon_url(package, size=None):
+    """
+    Return the url of the smallest png rendition of the package icon that is
+    at least `size` pixels, or the biggest one.
+    """
+    if not package.icon_file:
+        return ""
+    sizes = sorted(int(x) for x in package.icons)
+    if not sizes:
+        return package.icon_file.url
+    size = size or ICON_SIZES[-1]
+    fit = [x for x in sizes if x >= size] or sizes[-1:]
+    return default_storage.url(package.icons[str(fit[0])]["png"])
+
+
+def package_icons(package):
+    return {
+        size: {ext: default_storage.url(name) for ext, name in formats.items()}
+        for size, formats in package.icons.items()
+    }
+
+
+def get_icon_size(request):
+    try:
+        return int(request.GET.get("icon_size", ""))
+    except ValueError:
+        return None
+
+
 class PackageSerializer(serializers.ModelSerializer):
     os = serializers.SerializerMethodField()
     install_url = serializers.SerializerMethodField()
     package_file = serializers.SerializerMethodField()
     icon_file = serializers.SerializerMethodField()
+    icons = serializers.SerializerMethodField()
     uploader = serializers.SerializerMethodField()
     short_commit_id = serializers.SerializerMethodField()
 
@@ -50,9 +84,10 @@ class PackageSerializer(serializers.ModelSerializer):
         return obj.package_file.url
 
     def get_icon_file(self, obj):
-        if not obj.icon_file:
-            return ""
-        return obj.icon_file.url
+        return package_icon_url(obj, self.context.get("icon_size"))
+
+    def get_icons(self, obj):
+        return package_icons(obj)
 
     def get_uploader(self, obj):
         if obj.operator_content_type.model == "appapitoken":
@@ -81,6 +116,7 @@ class PackageSerializer(serializers.ModelSerializer):
             "install_url",
             "package_file",
             "icon_file",
+            "icons",
             "fingerprint",
             "version",
             "short_version",
@@ -103,6 +139,7 @@ class PackageSerializer(serializers.ModelSerializer):
             "install_url",
             "package_file",
             "icon_file",
+            "icons",
             "fingerprint",
             "version",
             "short_version",
@@ -117,6 +154,27 @@ class PackageSerializer(serializers.ModelSerializer):
         ]
 
 
+class PackagePatchSerializer(serializers.ModelSerializer):
+    base_package_id = serializers.ReadOnlyField(source="base.package_id")
+    base_version = serializers.ReadOnlyField(source="base.version")
+    base_short_version = serializers.ReadOnlyField(source="base.short_version")
+    patch_file = serializers.SerializerMethodField()
+
+    def get_patch_file(self, obj):
+        return obj.file.url
+
+    class Meta:
+        model = PackagePatch
+        fields = [
+            "base_package_id",
+            "base_version",
+            "base_short_version",
+            "patch_file",
+            "size",
+            "create_time",
+        ]
+
+
 class PackageUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Package
@@ -134,15 +192,50 @@ class UploadPackageSerializer(serializers.Serializer):
         fields = ["file", "description", "commit_id", "channel", "build_type"]
 
 
+class BatchUploadPackageSerializer(serializers.Serializer):
+    file = serializers.ListField(child=serializers.FileField(), min_length=1)
+    channel = serializers.ListField(
+        child=serializers.CharField(max_length=32, allow_blank=True), required=False
+    )
+    description = serializers.CharField(default="", allow_blank=True)
+    commit_id = serializers.CharField(max_length=40, default="", allow_blank=True)
+    build_type = serializers.CharField(max_length=32, default="Debug")
+
+    class Meta:
+        fields = ["file", "channel", "description", "commit_id", "build_type"]
+
+    def validate(self, data):
+        channel = data.get("channel")
+        if channel and len(channel) != len(data["file"]):
+            raise serializers.ValidationError(
+                {"channel": "Give one channel per file."}
+            )
+        return data
+
+
 class RequestUploadPackageSerializer(serializers.Serializer):
     filename = serializers.CharField(default="")
     description = serializers.CharField(default="", allow_blank=True)
     commit_id = serializers.CharField(max_length=40, default="", allow_blank=True)
     channel = serializers.CharField(max_length=32, default="", allow_blank=True)
     build_type = serializers.CharField(max_length=32, default="Debug")
+    md5 = serializers.RegexField("^[0-9a-fA-F]{32}$", required=False)
+    size = serializers.IntegerField(min_value=1, required=False)
+    multipart = serializers.BooleanField(default=False)
+    part_size = serializers.IntegerField(min_value=1, required=False)
 
     class Meta:
-        fields = ["filename", "description", "commit_id", "channel", "build_type"]
+        fields = [
+            "filename",
+            "description",
+            "commit_id",
+            "channel",
+            "build_type",
+            "md5",
+            "size",
+            "multipart",
+            "part_size",
+        ]
 
 
 class UploadAliyunOssPackageSerializer(serializers.Serializer):
@@ -171,6 +264,7 @@ class ReleaseSerializer(serializers.ModelSerializer):
 
     package_file = serializers.SerializerMethodField()
     icon_file = serializers.SerializerMethodField()
+    icons = serializers.SerializerMethodField()
 
     def get_os(self, obj):
         return ChoiceField(
@@ -181,9 +275,10 @@ class ReleaseSerializer(serializers.ModelSerializer):
         return obj.package.package_file.url
 
     def get_icon_file(self, obj):
-        if not obj.package.icon_file:
-            return ""
-        return obj.package.icon_file.url
+        return package_icon_url(obj.package, self.context.get("icon_size"))
+
+    def get_icons(self, obj):
+        return package_icons(obj.package)
 
     class Meta:
         model = Release
@@ -195,6 +290,7 @@ class ReleaseSerializer(serializers.ModelSerializer):
             "name",
             "package_file",
             "icon_file",
+            "icons",
             "fingerprint",
             "version",
             "short_version",
@@ -213,6 +309,7 @@ class ReleaseSerializer(serializers.ModelSerializer):
             "name",
             "package_file",
             "icon_file",
+            "icons",
             "fingerprint",
             "version",
             "short_version",
@@ -287,9 +384,7 @@ class ReleaseCreateSerializer(serializers.Serializer):
         if validated_data["enabled"]:
             package.make_public(install_slug)
 
-        release_id = (
-            Release.objects.filter(app__universal_app=universal_app).count() + 1
-        )
+        release_id = Counter.next_value(universal_app, "release")
         app = package.app
         instance = Release.objects.create(
             app=app,
@@ -298,6 +393,7 @@ class ReleaseCreateSerializer(serializers.Serializer):
             release_notes=validated_data.get("release_notes", package.description),
             enabled=validated_data["enabled"],
         )
+        publish("new_release", universal_app, instance.id)
         return instance
 
     def update(self, instance, validated_data):
@@ -36,7 +36,7 @@ class AppStore(StoreBase):
             + "/id"
             + self.appstore_app_id
         )
-        r = requests.get(url)
+        r = requests.get(url, timeout=self.timeout)
         key_word = self.key_word
         start = r.text.find(key_word)
         if start == -1:
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 
 
@@ -74,6 +75,11 @@ class StoreBase:
     def __init__(self, auth_data):
         pass
 
+    @property
+    def timeout(self):
+        # Seconds to wait on the store to connect and for each read.
+        return settings.STORE_TIMEOUT
+
     @staticmethod
     def store_type():
         pass
@@ -26,6 +26,6 @@ class HuaweiStore(StoreBase):
         headers = {
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36"  # noqa: E501
         }
-        r = requests.get(self.store_url, headers=headers)
+        r = requests.get(self.store_url, headers=headers, timeout=self.timeout)
         version = r.json()["layoutData"][1]["dataList"][0]["versionName"]
         return {"version": version}
@@ -52,7 +52,7 @@ class VivoStore(StoreBase):
         )
         request_payload["sign"] = sign.hexdigest()
         url = "https://developer-api.vivo.com.cn/router/rest"
-        r = requests.post(url, data=request_payload)
+        r = requests.post(url, data=request_payload, timeout=self.timeout)
         return r.json()
 
     def submit(self, package):
@@ -93,7 +93,7 @@ class VivoStore(StoreBase):
             "h5_websource": "h5appstore",
             "frompage": "messageh5",
         }
-        r = requests.post(url, payload)
+        r = requests.post(url, payload, timeout=self.timeout)
         version = r.json()["version_name"]
         return {"version": version}
 
@@ -27,6 +27,6 @@ class XiaomiStore(StoreBase):
         headers = {
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36"  # noqa: E501
         }
-        r = requests.get(url, headers=headers)
+        r = requests.get(url, headers=headers, timeout=self.timeout)
         version = r.json()["appMap"]["versionName"]
         return {"version": version}
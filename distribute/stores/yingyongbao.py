@@ -32,7 +32,7 @@ class YingyongbaoStore(StoreBase):
         headers = {
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36"  # noqa: E501
         }
-        r = requests.get(url, headers=headers)
+        r = requests.get(url, headers=headers, timeout=self.timeout)
         start = r.text.find("版本")
         if start != -1:
             sub = r.text[start + 3 : start + 20]
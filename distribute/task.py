@@ -1,80 +1,473 @@
-import json
+import contextlib
+import logging
 import os.path
-import queue
+import random
+import socket
 import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlsplit
 
 import requests
 from django.conf import settings
+from django.db import (OperationalError, close_old_connections, connection,
+                       transaction)
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
 
-from application.models import Webhook
-from distribute.models import Package
-from distribute.serializers import PackageSerializer
-
-
-def send_webhook(webhook, package):
-    app = package.app.universal_app
-    plist_url_name = ""
-    namespace = ""
-    if app.owner:
-        plist_url_name = "user-app-package-plist"
-        namespace = app.owner.username
-    elif app.org:
-        plist_url_name = "org-app-package-plist"
-        namespace = app.org.path
-
-    context = {
-        "plist_url_name": plist_url_name,
-        "namespace": namespace,
-        "path": app.path,
-    }
-    serializer = PackageSerializer(package, context=context)
-
-    url = webhook.url
-    payload = webhook.template["body"]
-    data = serializer.data
-    data["short_commit_id"] = data.get("commit_id", "")[:8]
-    data["download_url"] = os.path.join(settings.EXTERNAL_WEB_URL, 'd/' + app.install_slug)   # noqa: E501
-    for k in data:
-        payload = payload.replace("${" + k + "}", str(data[k]))
-    payload = json.loads(payload)
-    requests.post(url, json=payload)
-
-
-def run_new_package_task(id):
-    package = Package.objects.get(id=id)
-    webhook_list = Webhook.objects.filter(
-        app=package.app.universal_app,
-        when_new_package=True
+from application.models import PendingWebhookEvent, Webhook, WebhookDelivery
+from distribute.models import Job
+from util.template import TemplateData
+
+logger = logging.getLogger("apphub.distribute")
+_sessions = {}
+_url_slots = {}
+_sessions_lock = threading.Lock()
+
+
+def webhook_session(url):
+    """
+    The session shared by every webhook sent to the scheme and host of `url`,
+    keeping connections to it open between events.
+    """
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=settings.WEBHOOK_POOL_SIZE
+            )
+            session.mount(parts.scheme + "://", adapter)
+            _sessions[key] = session
+    return session
+
+
+def webhook_url_slot(url):
+    """
+    The semaphore capping the deliveries in flight to `url` at
+    WEBHOOK_URL_CONCURRENCY, across the events and workers of this process.
+    Other processes have semaphores of their own.
+    """
+    with _sessions_lock:
+        slot = _url_slots.get(url)
+        if slot is None:
+            slot = threading.BoundedSemaphore(settings.WEBHOOK_URL_CONCURRENCY)
+            _url_slots[url] = slot
+    return slot
+
+
+def post_webhook(webhook, payload):
+    """
+    Post `payload` to the webhook and return the fields of its delivery.
+    """
+    result = {}
+    with webhook_url_slot(webhook.url):
+        begin = time.monotonic()
+        try:
+            r = webhook_session(webhook.url).post(
+                webhook.url,
+                json=payload,
+                timeout=(webhook.connect_timeout, webhook.read_timeout),
+            )
+            result["status_code"] = r.status_code
+            result["success"] = 200 <= r.status_code < 300
+            result["response"] = r.text[:1024]
+        except requests.RequestException as e:
+            result["error"] = str(e)[:1024]
+        result["latency"] = int((time.monotonic() - begin) * 1000)
+    return result
+
+
+def webhook_retry_delay(attempt):
+    """
+    Seconds before retrying a delivery that failed on its `attempt`, growing
+    exponentially, with jitter so failures of one endpoint spread out.
+    """
+    delay = min(
+        settings.WEBHOOK_RETRY_DELAY * 2 ** (attempt - 1),
+        settings.WEBHOOK_RETRY_MAX_DELAY,
+    )
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def send_webhooks(event, deliveries):
+    """
+    Send the (webhook, payload, attempt) of `deliveries` at the same time, at
+    most WEBHOOK_CONCURRENCY of them at once, and record a WebhookDelivery for
+    every one. A slow or failing webhook does not hold up the others, each one
+    waits on its url no longer than its own timeouts. Failed deliveries are
+    retried by jobs of their own, not here.
+    """
+    if not deliveries:
+        return
+    workers = min(len(deliveries), settings.WEBHOOK_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(post_webhook, webhook, payload)
+            for webhook, payload, attempt in deliveries
+        ]
+        results = [future.result() for future in futures]
+    for (webhook, payload, attempt), result in zip(deliveries, results):
+        record_webhook_delivery(webhook, event, payload, attempt, result)
+
+
+def record_webhook_delivery(webhook, event, payload, attempt, result):
+    delivery = WebhookDelivery(
+        webhook=webhook, event=event, payload=payload, attempt=attempt, **result
     )
+    if not delivery.success and attempt < settings.WEBHOOK_MAX_ATTEMPTS:
+        delivery.next_retry_time = timezone.now() + timedelta(
+            seconds=webhook_retry_delay(attempt)
+        )
+    delivery.save()
+    if delivery.next_retry_time is not None:
+        run_in_background(
+            resend_webhook_delivery,
+            delivery.id,
+            attempt + 1,
+            run_after=delivery.next_retry_time,
+        )
+    return delivery
+
+
+def resend_webhook_delivery(delivery_id, attempt):
+    """
+    Send the payload of a delivery again, as `attempt`. Retries continue
+    from the attempt of the delivery, a redelivery starts over at 1.
+    """
+    delivery = (
+        WebhookDelivery.objects.select_related("webhook")
+        .filter(id=delivery_id)
+        .first()
+    )
+    if delivery is None:
+        # The webhook was deleted.
+        return
+    send_webhooks(delivery.event, [(delivery.webhook, delivery.payload, attempt)])
+
+
+def render_webhooks(event, webhook_list, data):
+    """
+    Send the webhooks their payload for `data`, a TemplateData.
+    """
+    deliveries = []
     for webhook in webhook_list:
         try:
-            send_webhook(webhook, package)
-        except:   # noqa: E722
-            import traceback
-            traceback.print_exc()
+            payload = webhook.render(data)
+        except:  # noqa: E722
+            # A broken template fails the same way every time, no retry.
+            WebhookDelivery.objects.create(
+                webhook=webhook,
+                event=event,
+                error="Can not render the template of the webhook.",
+            )
+            continue
+        deliveries.append((webhook, payload, 1))
+    send_webhooks(event, deliveries)
+
+
+def notify_webhooks(event, webhook_list, data):
+    webhooks_now = []
+    for webhook in webhook_list:
+        if webhook.coalesce_window:
+            queue_webhook_digest(webhook, event, data)
+        else:
+            webhooks_now.append(webhook)
+    # Every webhook shares the encoded values of the event.
+    render_webhooks(event, webhooks_now, TemplateData(data))
+
+
+def queue_webhook_digest(webhook, event, data):
+    """
+    Keep the event for the digest of the webhook, which is sent
+    `coalesce_window` seconds after the first event it has.
+    """
+    with transaction.atomic():
+        # Events of the webhook and its digest take turns on the webhook row.
+        Webhook.objects.select_for_update().filter(id=webhook.id).first()
+        PendingWebhookEvent.objects.create(webhook=webhook, event=event, data=data)
+        # A digest job that has started may have read its events already,
+        # only one still pending is sure to send this one.
+        scheduled = Job.objects.filter(
+            name=job_name(send_webhook_digest),
+            args=[webhook.id],
+            state=Job.State.Pending,
+        ).exists()
+        if not scheduled:
+            run_after = timezone.now() + timedelta(seconds=webhook.coalesce_window)
+            run_in_background(send_webhook_digest, webhook.id, run_after=run_after)
+
+
+def webhook_digest_data(data_list):
+    """
+    The values of a digest: those of the latest event, so templates written
+    for single events still work, with the number of events in ${count}, the
+    values of every event in ${events} and one line per event in ${digest}.
+    """
+    data = dict(data_list[-1])
+    data["count"] = len(data_list)
+    data["events"] = data_list
+    lines = []
+    for item in data_list:
+        keys = ["name", "short_version", "version", "channel"]
+        lines.append(" ".join(str(item[k]) for k in keys if item.get(k)))
+    data["digest"] = "\n".join(lines)
+    return data
+
+
+def send_webhook_digest(webhook_id):
+    """
+    Send the events waiting for the webhook, one digest per kind of event.
+    """
+    with transaction.atomic():
+        webhook = Webhook.objects.select_for_update().filter(id=webhook_id).first()
+        if webhook is None:
+            return
+        pending = list(
+            PendingWebhookEvent.objects.filter(webhook=webhook).order_by("id")
+        )
+        PendingWebhookEvent.objects.filter(id__in=[x.id for x in pending]).delete()
+    if not pending:
+        return
+    events = {}
+    for x in pending:
+        events.setdefault(x.event, []).append(x.data)
+    for event, data_list in events.items():
+        data = TemplateData(webhook_digest_data(data_list))
+        render_webhooks(event, [webhook], data)
+
 
+def job_name(func):
+    return func.__module__ + "." + func.__qualname__
 
-q = queue.Queue()
+
+def run_in_background(func, *args, run_after=None):
+    """
+    Queue `func(*args)` in the job table, to run as soon as a worker is free
+    or not before `run_after`. The job is visible to workers once the current
+    transaction commits, and survives restarts of the process that queued it.
+    `func` must be a module level function and `args` JSON serializable.
+    """
+    return Job.objects.create(
+        name=job_name(func),
+        args=list(args),
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+        run_after=run_after or timezone.now(),
+    )
+
+
+def delete_old_records():
+    """
+    Delete the webhook deliveries and failed jobs older than
+    RECORD_RETENTION_DAYS, then again a day later.
+    """
+    now = timezone.now()
+    schedule_old_records_deletion(now + timedelta(days=1))
+    if not settings.RECORD_RETENTION_DAYS:
+        return
+    before = now - timedelta(days=settings.RECORD_RETENTION_DAYS)
+    WebhookDelivery.objects.filter(create_time__lt=before).delete()
+    Job.objects.filter(state=Job.State.Failed, update_time__lt=before).delete()
+
+
+def schedule_old_records_deletion(run_after=None):
+    # One pending job is enough. A second one, queued by workers starting at
+    # the same time, does not queue another when it runs after the first.
+    pending = Job.objects.filter(
+        name=job_name(delete_old_records), state=Job.State.Pending
+    )
+    if not pending.exists():
+        run_in_background(delete_old_records, run_after=run_after)
+
+
+def ready_jobs(now):
+    # Pending jobs that are due, and running jobs whose worker lost the lease.
+    return Q(state=Job.State.Pending, run_after__lte=now) | Q(
+        state=Job.State.Running, lease_expires__lt=now
+    )
+
+
+def claim_job(owner, candidates=10):
+    """
+    Lease the next ready job to `owner`, or return None. The lease is taken
+    with a conditional update, so only one of the workers racing for a job
+    gets it.
+    """
+    now = timezone.now()
+    ids = (
+        Job.objects.filter(ready_jobs(now))
+        .order_by("run_after", "id")
+        .values_list("id", flat=True)[:candidates]
+    )
+    for id in list(ids):
+        claimed = Job.objects.filter(ready_jobs(now), id=id).update(
+            state=Job.State.Running,
+            lease_owner=owner,
+            lease_expires=now + timedelta(seconds=settings.JOB_VISIBILITY_TIMEOUT),
+            attempts=F("attempts") + 1,
+            update_time=now,
+        )
+        if claimed:
+            return Job.objects.get(id=id)
+    return None
+
+
+def renew_lease(job, owner):
+    expires = timezone.now() + timedelta(seconds=settings.JOB_VISIBILITY_TIMEOUT)
+    return Job.objects.filter(
+        id=job.id, state=Job.State.Running, lease_owner=owner
+    ).update(lease_expires=expires)
 
 
-def worker():
-    while True:
+def retry_busy(func, attempts=5):
+    """
+    Call `func`, writing the outcome of a job, again while the database is
+    busy, sqlite raising "database table is locked" for example. A job whose
+    outcome is not written stays leased and runs again when the lease expires.
+    """
+    for i in range(attempts):
         try:
-            item = q.get(timeout=3)
+            return func()
+        except OperationalError:
+            if i + 1 == attempts:
+                raise
+            time.sleep(0.05 * 2**i)
+
+
+def run_job(job, owner):
+    """
+    Run a leased job, then delete it or schedule its retry. Updates are
+    conditional on the lease, a worker that lost it leaves the job alone.
+    """
+    error = ""
+    if job.attempts > job.max_attempts:
+        # The lease of the last attempt expired.
+        error = "The job did not finish within its lease."
+    else:
+        try:
+            import_string(job.name)(*job.args)
+        except:  # noqa: E722
+            error = traceback.format_exc()
+    leased = Job.objects.filter(id=job.id, state=Job.State.Running, lease_owner=owner)
+    if not error:
+        retry_busy(leased.delete)
+        return
+    now = timezone.now()
+    if job.attempts >= job.max_attempts:
+        fields = {"state": Job.State.Failed}
+    else:
+        delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        fields = {
+            "state": Job.State.Pending,
+            "run_after": now + timedelta(seconds=delay),
+        }
+    retry_busy(
+        lambda: leased.update(
+            lease_owner="", lease_expires=None, error=error, update_time=now, **fields
+        )
+    )
+
+
+class Worker:
+    """
+    Runs ready jobs until stopped. Any number of workers, threads of one
+    process or processes on many nodes, can share the job table.
+    """
+
+    def __init__(self, name=""):
+        self.name = name or "%s:%d:%s" % (
+            socket.gethostname(),
+            os.getpid(),
+            uuid.uuid4().hex[:8],
+        )
+        self.stopped = threading.Event()
+
+    @contextlib.contextmanager
+    def heartbeat(self, job):
+        # Renew the lease while the job runs, so long jobs keep it.
+        done = threading.Event()
+
+        def renew():
+            interval = settings.JOB_VISIBILITY_TIMEOUT / 3
             try:
-                run_new_package_task(item)
-            except:    # noqa: E722
-                pass
-            q.task_done()
-        except:    # noqa: E722
-            pass
+                while not done.wait(interval):
+                    renew_lease(job, self.name)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def run_once(self):
+        """
+        Run one ready job, returning False when there was none.
+        """
+        job = claim_job(self.name)
+        if job is None:
+            return False
+        with self.heartbeat(job):
+            run_job(job, self.name)
+        return True
+
+    def run(self, burst=False):
+        """
+        Run jobs until stopped, or with `burst` until no job is ready.
+        """
+        scheduled = False
+        try:
+            while not self.stopped.is_set():
+                close_old_connections()
+                try:
+                    if not scheduled:
+                        schedule_old_records_deletion()
+                        scheduled = True
+                    worked = self.run_once()
+                except:  # noqa: E722
+                    # The database is unavailable, try again later. A burst
+                    # only ends when no job is ready, not on an error.
+                    logger.exception("Can not run jobs")
+                    self.stopped.wait(settings.JOB_POLL_INTERVAL)
+                    continue
+                if not worked:
+                    if burst:
+                        break
+                    self.stopped.wait(settings.JOB_POLL_INTERVAL)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
 
 
-threading.Thread(target=worker, daemon=True).start()
+def run_ready_jobs(limit):
+    """
+    Run up to `limit` ready jobs in the calling thread, for deployments that
+    can not keep a worker running between requests.
+    """
+    schedule_old_records_deletion()
+    worker = Worker()
+    for i in range(limit):
+        if not worker.run_once():
+            break
 
 
-def notify_new_package(id):
-    try:
-        q.put_nowait(id)
-    except:    # noqa: E722
-        pass
+def start_workers(count):
+    """
+    Run `count` workers in daemon threads of this process.
+    """
+    workers = [Worker() for i in range(count)]
+    for worker in workers:
+        threading.Thread(target=worker.run, daemon=True).start()
+    return workers
@@ -0,0 +1,312 @@
+"""
+Synthetic APK and IPA files for tests and benchmarks.
+
+The packages are small but valid: an APK has a binary AndroidManifest.xml,
+a resources.arsc resolving the app name and icon, and density specific
+icons; an IPA has a binary Info.plist and the icon files it names. Filler
+entries of random bytes make up any requested size.
+
+    make_apk("sample.apk", version_code=2, min_sdk=26)
+    make_ipa(io.BytesIO(), entries=5000, payload_size=200 * 1024 * 1024)
+"""
+
+import io
+import os
+import plistlib
+import random
+import struct
+import zipfile
+
+from PIL import Image
+
+ANDROID_NAMESPACE = "http://schemas.android.com/apk/res/android"
+ANDROID_ATTRIBUTES = {
+    "label": 0x01010001,
+    "icon": 0x01010002,
+    "name": 0x01010003,
+    "minSdkVersion": 0x0101020C,
+    "versionCode": 0x0101021B,
+    "versionName": 0x0101021C,
+    "targetSdkVersion": 0x01010270,
+}
+NO_INDEX = 0xFFFFFFFF
+
+TYPE_REFERENCE = 0x01
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+
+LABEL_ID = 0x7F010000
+ICON_ID = 0x7F020000
+ANDROID_ICONS = [
+    (160, "res/mipmap-mdpi-v4/ic_launcher.png", 48),
+    (480, "res/mipmap-xxhdpi-v4/ic_launcher.png", 144),
+]
+
+# Variants of the sample app for release tests, by min SDK.
+APK_VARIANTS = [25, 26, 28, 30]
+
+
+def png_bytes(size=192, color=(52, 120, 246, 255)):
+    fp = io.BytesIO()
+    Image.new("RGBA", (size, size), color).save(fp, "PNG")
+    return fp.getvalue()
+
+
+def filler_entries(prefix, entries, payload_size, seed=0):
+    """
+    Yield (name, data) of `entries` files with `payload_size` random bytes
+    in total, the same for the same arguments.
+    """
+    generator = random.Random(seed)
+    for i in range(entries):
+        size = payload_size // entries + (1 if i < payload_size % entries else 0)
+        # Random.randbytes is 3.9+, and getrandbits(0) raises before 3.9.
+        data = generator.getrandbits(8 * size).to_bytes(size, "little") if size else b""
+        yield prefix + "%05d.bin" % i, data
+
+
+def string_pool(strings):
+    offsets = []
+    data = b""
+    for value in strings:
+        offsets.append(len(data))
+        data += struct.pack("<H", len(value)) + value.encode("utf-16-le") + b"\0\0"
+    data += b"\0" * (-len(data) % 4)
+    header_size = 28
+    strings_start = header_size + 4 * len(strings)
+    header = struct.pack(
+        "<HHIIIIII",
+        0x0001,
+        header_size,
+        strings_start + len(data),
+        len(strings),
+        0,
+        0,
+        strings_start,
+        0,
+    )
+    return header + b"".join(struct.pack("<I", x) for x in offsets) + data
+
+
+def android_manifest(package, version_code, version_name, min_sdk, target_sdk):
+    attribute_names = list(ANDROID_ATTRIBUTES)
+    strings = attribute_names + [
+        ANDROID_NAMESPACE,
+        "android",
+        "manifest",
+        "package",
+        "uses-sdk",
+        "application",
+        package,
+        version_name,
+    ]
+    index = {value: i for i, value in enumerate(strings)}
+    resource_map = struct.pack("<HHI", 0x0180, 8, 8 + 4 * len(attribute_names))
+    resource_map += b"".join(
+        struct.pack("<I", ANDROID_ATTRIBUTES[x]) for x in attribute_names
+    )
+
+    def node(chunk_type, body):
+        header = struct.pack("<HHIII", chunk_type, 16, 16 + len(body), 1, NO_INDEX)
+        return header + body
+
+    def attribute(namespace, name, raw_value, data_type, data):
+        return struct.pack(
+            "<IIIHBBI", namespace, index[name], raw_value, 8, 0, data_type, data
+        )
+
+    def start(name, attributes):
+        body = struct.pack(
+            "<IIHHHHHH", NO_INDEX, index[name], 20, 20, len(attributes), 0, 0, 0
+        )
+        return node(0x0102, body + b"".join(attributes))
+
+    def end(name):
+        return node(0x0103, struct.pack("<II", NO_INDEX, index[name]))
+
+    ns = index[ANDROID_NAMESPACE]
+    body = node(0x0100, struct.pack("<II", index["android"], ns))
+    body += start(
+        "manifest",
+        [
+            attribute(ns, "versionCode", NO_INDEX, TYPE_INT_DEC, version_code),
+            attribute(
+                ns,
+                "versionName",
+                index[version_name],
+                TYPE_STRING,
+                index[version_name],
+            ),
+            attribute(
+                NO_INDEX, "package", index[package], TYPE_STRING, index[package]
+            ),
+        ],
+    )
+    body += start(
+        "uses-sdk",
+        [
+            attribute(ns, "minSdkVersion", NO_INDEX, TYPE_INT_DEC, min_sdk),
+            attribute(ns, "targetSdkVersion", NO_INDEX, TYPE_INT_DEC, target_sdk),
+        ],
+    )
+    body += end("uses-sdk")
+    body += start(
+        "application",
+        [
+            attribute(ns, "label", NO_INDEX, TYPE_REFERENCE, LABEL_ID),
+            attribute(ns, "icon", NO_INDEX, TYPE_REFERENCE, ICON_ID),
+        ],
+    )
+    body += end("application")
+    body += end("manifest")
+    body += node(0x0101, struct.pack("<II", index["android"], ns))
+    content = string_pool(strings) + resource_map + body
+    return struct.pack("<HHI", 0x0003, 8, 8 + len(content)) + content
+
+
+def resource_table(package, label, icons):
+    """
+    A resources.arsc with the string LABEL_ID and the file ICON_ID, which
+    has one configuration for each (density, path) of `icons`.
+    """
+
+    def config(density):
+        return (
+            struct.pack("<I", 64)
+            + b"\0" * 10
+            + struct.pack("<H", density)
+            + b"\0" * 48
+        )
+
+    def type_spec(type_id, count):
+        header = struct.pack(
+            "<HHIBBHI", 0x0202, 16, 16 + 4 * count, type_id, 0, 0, count
+        )
+        return header + b"\0" * 4 * count
+
+    def type_chunk(type_id, density, value):
+        header_size = 20 + 64
+        entries_start = header_size + 4
+        entry = struct.pack("<HHI", 8, 0, 0)
+        entry += struct.pack("<HBBI", 8, 0, TYPE_STRING, value)
+        header = struct.pack(
+            "<HHIBBHII",
+            0x0201,
+            header_size,
+            entries_start + len(entry),
+            type_id,
+            0,
+            0,
+            1,
+            entries_start,
+        )
+        return header + config(density) + struct.pack("<I", 0) + entry
+
+    values = string_pool([label] + [path for density, path in icons])
+    type_strings = string_pool(["string", "mipmap"])
+    key_strings = string_pool(["app_name", "ic_launcher"])
+    chunks = type_spec(1, 1) + type_chunk(1, 0, 0) + type_spec(2, 1)
+    for i, (density, path) in enumerate(icons):
+        chunks += type_chunk(2, density, i + 1)
+    header_size = 288
+    body = type_strings + key_strings + chunks
+    name = package.encode("utf-16-le")[:254].ljust(256, b"\0")
+    package_chunk = struct.pack(
+        "<HHII", 0x0200, header_size, header_size + len(body), 0x7F
+    )
+    package_chunk += name + struct.pack(
+        "<IIIII", header_size, 0, header_size + len(type_strings), 0, 0
+    )
+    content = values + package_chunk + body
+    return struct.pack("<HHII", 0x0002, 12, 12 + len(content), 1) + content
+
+
+def make_apk(
+    file,
+    package="com.example.sample",
+    version_code=1,
+    version_name="1.0.0",
+    min_sdk=21,
+    target_sdk=30,
+    label="Sample",
+    entries=0,
+    payload_size=0,
+):
+    """
+    Write an APK to `file`, a path or a binary file, and return `file`.
+    `entries` assets hold `payload_size` random bytes.
+    """
+    with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(
+            "AndroidManifest.xml",
+            android_manifest(package, version_code, version_name, min_sdk, target_sdk),
+        )
+        icons = [(density, path) for density, path, size in ANDROID_ICONS]
+        z.writestr("resources.arsc", resource_table(package, label, icons))
+        for density, path, size in ANDROID_ICONS:
+            z.writestr(path, png_bytes(size))
+        for name, data in filler_entries("assets/filler/", entries, payload_size):
+            z.writestr(name, data, zipfile.ZIP_STORED)
+    return file
+
+
+def make_ipa(
+    file,
+    bundle_identifier="com.example.sample",
+    version="100",
+    short_version="1.0.0",
+    name="Sample",
+    minimum_os_version="12.0",
+    entries=0,
+    payload_size=0,
+):
+    """
+    Write an IPA to `file`, a path or a binary file, and return `file`.
+    `entries` framework files hold `payload_size` random bytes.
+    """
+    app = "Payload/%s.app/" % name
+    plist = {
+        "CFBundleDisplayName": name,
+        "CFBundleName": name,
+        "CFBundleIdentifier": bundle_identifier,
+        "CFBundleVersion": version,
+        "CFBundleShortVersionString": short_version,
+        "MinimumOSVersion": minimum_os_version,
+        "CFBundleIcons": {
+            "CFBundlePrimaryIcon": {"CFBundleIconFiles": ["AppIcon60x60"]}
+        },
+        "CFBundleIcons~ipad": {
+            "CFBundlePrimaryIcon": {
+                "CFBundleIconFiles": ["AppIcon60x60", "AppIcon76x76"]
+            }
+        },
+    }
+    with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as z:
+        prefix = app + "Frameworks/Filler.framework/"
+        for filename, data in filler_entries(prefix, entries, payload_size):
+            z.writestr(filename, data, zipfile.ZIP_STORED)
+        z.writestr(app + "Info.plist", plistlib.dumps(plist, fmt=plistlib.FMT_BINARY))
+        z.writestr(app + "AppIcon60x60@2x.png", png_bytes(120))
+        z.writestr(app + "AppIcon60x60@3x.png", png_bytes(180))
+        z.writestr(app + "AppIcon76x76@2x~ipad.png", png_bytes(152))
+        z.writestr(app + name, b"\0" * 1024)
+    return file
+
+
+def make_apk_variants(directory, min_sdks=APK_VARIANTS):
+    """
+    Write one APK of the sample app for each min SDK, with increasing version
+    codes, and return their paths.
+    """
+    paths = []
+    for i, min_sdk in enumerate(min_sdks):
+        path = os.path.join(directory, "android-sample-%d.apk" % min_sdk)
+        make_apk(
+            path,
+            version_code=i + 2,
+            version_name="1.%d.0" % (i + 1),
+            min_sdk=min_sdk,
+            target_sdk=max(min_sdk, 30),
+        )
+        paths.append(path)
+    return paths
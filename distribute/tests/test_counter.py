@@ -0,0 +1,82 @@
+import io
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+
+from application.models import UniversalApp
+from client.api import Api
+from client.unit_test_client import UnitTestClient
+from distribute.models import Counter, Package
+from distribute.tests.packages import make_apk, make_ipa
+from distribute.tests.test_distribute_base import DistributeBaseTest
+
+
+class CounterTest(DistributeBaseTest):
+    def test_next_value(self):
+        app_api = self.create_app_api()
+        universal_app = UniversalApp.objects.get(path=self.chrome_app()["path"])
+
+        r = app_api.upload_package(self.apk_path)
+        self.assert_status_201(r)
+        self.assertEqual(r.json()["package_id"], 1)
+        r = app_api.upload_package(self.ipa_path)
+        self.assertEqual(r.json()["package_id"], 2)
+        r = app_api.remove_package(1)
+        self.assert_status_204(r)
+        r = app_api.upload_package(self.apk_path)
+        self.assertEqual(r.json()["package_id"], 3)
+
+        self.assertEqual(Counter.next_value(universal_app, "package", 5), 4)
+        self.assertEqual(Counter.next_value(universal_app, "package"), 9)
+        self.assertEqual(Counter.next_value(universal_app, "release"), 1)
+
+        # A missing counter continues from the ids already in use.
+        Counter.objects.filter(universal_app=universal_app).delete()
+        self.assertEqual(Counter.next_value(universal_app, "package"), 4)
+
+
+@override_settings(MEDIA_ROOT="var/media/test")
+class RenumberIdsTest(TransactionTestCase):
+    def test_renumber(self):
+        larry = Api(UnitTestClient(), "LarryPage", True)
+        namespace = larry.get_user_api(larry.client.username)
+        app = {
+            "path": "chrome",
+            "name": "Google Chrome",
+            "install_slug": "chrome",
+            "visibility": "Public",
+            "enable_os": ["iOS", "Android"],
+        }
+        namespace.create_app(app)
+        app_api = namespace.get_app_api(app["path"])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            apk_path = make_apk(os.path.join(temp_dir, "sample.apk"))
+            ipa_path = make_ipa(os.path.join(temp_dir, "sample.ipa"))
+            app_api.upload_package(apk_path)
+            app_api.upload_package(ipa_path)
+
+        # A database from before the constraint, with the same id for an
+        # Android and an iOS package of the app.
+        constraint = Package._meta.constraints[0]
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(Package, constraint)
+        try:
+            Package.objects.update(universal_app=None)
+            Package.objects.filter(package_id=2).update(package_id=1)
+            call_command("renumber_ids", "--dry-run", stdout=io.StringIO())
+            ids = Package.objects.order_by("id").values_list("package_id", flat=True)
+            self.assertEqual(list(ids), [1, 1])
+            out = io.StringIO()
+            call_command("renumber_ids", stdout=out)
+            self.assertEqual(list(ids.all()), [1, 3])
+            self.assertIn("package_id 1 -> 3", out.getvalue())
+            universal_app = UniversalApp.objects.get(path=app["path"])
+            self.assertEqual(
+                Package.objects.filter(universal_app=universal_app).count(), 2
+            )
+        finally:
+            with connection.schema_editor() as editor:
+                editor.add_constraint(Package, constraint)
@@ -1,33 +1,43 @@
 import os
 import shutil
+import tempfile
 
-import requests
-from django.conf import settings
-
+from client.api import Api
+from client.unit_test_client import UnitTestClient
+from distribute.tests.packages import make_apk, make_apk_variants, make_ipa
 from util.tests import BaseTestCase
 
 
 class DistributeBaseTest(BaseTestCase):
-    def setUp(self):
-        super().setUp()
-        package_dir = os.path.join(settings.STATIC_ROOT, "downloads")
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Synthetic packages, so the tests run without network access.
+        cls.package_dir = tempfile.mkdtemp()
+        cls.apk_path = make_apk(os.path.join(cls.package_dir, "android-sample.apk"))
+        cls.ipa_path = make_ipa(os.path.join(cls.package_dir, "ios-sample.ipa"))
+        (
+            cls.apk1_path,
+            cls.apk2_path,
+            cls.apk3_path,
+            cls.apk4_path,
+        ) = make_apk_variants(cls.package_dir)
 
-        if not os.path.exists(package_dir):
-            os.makedirs(package_dir)
-        self.apk_path = os.path.join(package_dir, "android-sample.apk")
-        if not os.path.exists(self.apk_path):
-            url = "https://raw.githubusercontent.com/bitbar/test-samples/master/apps/android/bitbar-sample-app.apk"  # noqa: E501
-            with requests.get(url, stream=True) as r:
-                with open(self.apk_path, "wb") as f:
-                    shutil.copyfileobj(r.raw, f)
-        self.ipa_path = os.path.join(package_dir, "ios-sample.ipa")
-        if not os.path.exists(self.ipa_path):
-            url = "https://raw.githubusercontent.com/bitbar/test-samples/master/apps/ios/bitbar-ios-sample.ipa"  # noqa: E501
-            with requests.get(url, stream=True) as r:
-                with open(self.ipa_path, "wb") as f:
-                    shutil.copyfileobj(r.raw, f)
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.package_dir, ignore_errors=True)
+        super().tearDownClass()
 
-        self.apk1_path = os.path.join(package_dir, "android-sample-25.apk")
-        self.apk2_apth = os.path.join(package_dir, "android-sample-26.apk")
-        self.apk3_apth = os.path.join(package_dir, "android-sample-28.apk")
-        self.apk4_apth = os.path.join(package_dir, "android-sample-30.apk")
+    def create_app_api(self, app=None):
+        """
+        Create `app`, by default the Chrome app for iOS and Android, in the
+        namespace of LarryPage and return its api. LarryPage is self.larry.
+        """
+        if getattr(self, "larry", None) is None:
+            self.larry = Api(UnitTestClient(), "LarryPage", True)
+        namespace = self.larry.get_user_api(self.larry.client.username)
+        if app is None:
+            app = self.chrome_app()
+            app["enable_os"] = ["iOS", "Android"]
+        namespace.create_app(app)
+        return namespace.get_app_api(app["path"])
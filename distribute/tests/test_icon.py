@@ -0,0 +1,114 @@
+import io
+import struct
+import zlib
+from unittest import mock
+
+from PIL import Image
+
+from distribute.tests.test_distribute_base import DistributeBaseTest
+from util.image import ICON_SIZES, icon_renditions, normalize_png
+from util.tests import BaseTestCase
+
+
+def png_chunk(kind, body):
+    crc = zlib.crc32(kind + body) & 0xFFFFFFFF
+    return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", crc)
+
+
+def cgbi_png(width, height, rgba):
+    # Premultiplied BGRA rows behind a raw deflate stream, as Xcode writes.
+    # Without alpha the rows are BGR.
+    if len(rgba) == 4:
+        r, g, b, a = rgba
+        pixel = bytes([b * a // 255, g * a // 255, r * a // 255, a])
+        color_type = 6
+    else:
+        r, g, b = rgba
+        pixel = bytes([b, g, r])
+        color_type = 2
+    rows = b"".join(b"\x00" + pixel * width for _ in range(height))
+    compressor = zlib.compressobj(wbits=-15)
+    idat = compressor.compress(rows) + compressor.flush()
+    header = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + png_chunk(b"CgBI", b"\x50\x00\x20\x06")
+        + png_chunk(b"IHDR", header)
+        + png_chunk(b"IDAT", idat)
+        + png_chunk(b"IEND", b"")
+    )
+
+
+def unsigned(url):
+    return url.split("?")[0]
+
+
+class IconImageTest(BaseTestCase):
+    def test_normalize_cgbi(self):
+        data = normalize_png(cgbi_png(4, 3, (200, 100, 50, 128)))
+        image = Image.open(io.BytesIO(data))
+        self.assertEqual(image.format, "PNG")
+        self.assertEqual(image.size, (4, 3))
+        pixel = image.convert("RGBA").getpixel((1, 1))
+        for value, expected in zip(pixel, (200, 100, 50, 128)):
+            self.assertAlmostEqual(value, expected, delta=2)
+
+    def test_normalize_cgbi_rgb(self):
+        data = normalize_png(cgbi_png(4, 3, (200, 100, 50)))
+        image = Image.open(io.BytesIO(data))
+        self.assertEqual(image.getpixel((1, 1)), (200, 100, 50))
+
+    def test_normalize_keeps_standard_images(self):
+        file = io.BytesIO()
+        Image.new("RGBA", (8, 8), (1, 2, 3, 255)).save(file, "PNG")
+        self.assertEqual(normalize_png(file.getvalue()), file.getvalue())
+        self.assertEqual(normalize_png(b"not an image"), b"not an image")
+
+    def test_renditions(self):
+        file = io.BytesIO()
+        Image.new("RGBA", (512, 512), (1, 2, 3, 255)).save(file, "PNG")
+        renditions = icon_renditions(file.getvalue())
+        self.assertEqual(list(renditions), list(ICON_SIZES))
+        for size, formats in renditions.items():
+            for ext, image_format in [("png", "PNG"), ("webp", "WEBP")]:
+                image = Image.open(io.BytesIO(formats[ext]))
+                self.assertEqual(image.format, image_format)
+                self.assertEqual(image.size, (size, size))
+
+
+class PackageIconTest(DistributeBaseTest):
+    def test_upload_renditions(self):
+        app_api = self.create_app_api()
+
+        r = app_api.upload_package(self.ipa_path)
+        self.assert_status_201(r)
+        icons = r.json()["icons"]
+        self.assertEqual(sorted(icons), sorted(str(x) for x in ICON_SIZES))
+        self.assertEqual(sorted(icons["48"]), ["png", "webp"])
+        self.assertEqual(
+            unsigned(r.json()["icon_file"]),
+            unsigned(icons[str(ICON_SIZES[-1])]["png"]),
+        )
+        r2 = self.larry.get_or_head_file(icons["48"]["webp"])
+        self.assert_status_200(r2)
+
+        # The same icon is rendered to the same files.
+        r = app_api.upload_package(self.ipa_path)
+        self.assertEqual(
+            unsigned(r.json()["icons"]["96"]["png"]), unsigned(icons["96"]["png"])
+        )
+
+        r = app_api.client.get(app_api.base_path + "/packages", {"icon_size": 40})
+        self.assert_status_200(r)
+        self.assertEqual(
+            unsigned(r.json()[0]["icon_file"]), unsigned(icons["48"]["png"])
+        )
+
+    def test_upload_broken_icon(self):
+        app_api = self.create_app_api()
+
+        # An icon that can not be normalized is kept as it is.
+        with mock.patch("distribute.views.normalize_png", side_effect=zlib.error):
+            r = app_api.upload_package(self.ipa_path)
+        self.assert_status_201(r)
+        self.assertTrue(r.json()["icon_file"])
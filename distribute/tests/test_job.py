@@ -0,0 +1,150 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import OperationalError
+from django.db.models import QuerySet
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from distribute.models import Job
+from distribute.task import (Worker, claim_job, delete_old_records, job_name,
+                             run_in_background, run_job, run_ready_jobs)
+from util.tests import BaseTestCase
+
+calls = []
+
+
+def record_call(*args):
+    calls.append(list(args))
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+@override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_DELAY=10)
+class JobTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        calls.clear()
+
+    def test_run(self):
+        job = run_in_background(record_call, 1, "a")
+        self.assertEqual(job.name, "distribute.tests.test_job.record_call")
+        self.assertEqual(calls, [])
+
+        self.assertTrue(Worker().run_once())
+        self.assertEqual(calls, [[1, "a"]])
+        self.assertFalse(Job.objects.exists())
+        self.assertFalse(Worker().run_once())
+
+    def test_retry(self):
+        job = run_in_background(fail, "broken")
+        self.assertTrue(Worker().run_once())
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.State.Pending)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("ValueError: broken", job.error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=5))
+        # Not due yet.
+        self.assertFalse(Worker().run_once())
+
+        Job.objects.update(run_after=timezone.now())
+        self.assertTrue(Worker().run_once())
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.State.Failed)
+        self.assertEqual(job.attempts, 2)
+        Job.objects.update(run_after=timezone.now())
+        self.assertFalse(Worker().run_once())
+
+    def test_run_ready_jobs(self):
+        for i in range(3):
+            run_in_background(record_call, i)
+        run_ready_jobs(2)
+        self.assertEqual(calls, [[0], [1]])
+        run_ready_jobs(2)
+        self.assertEqual(calls, [[0], [1], [2]])
+        self.assertFalse(Job.objects.filter(name=job_name(record_call)).exists())
+
+    def test_busy_database(self):
+        run_in_background(record_call, 4)
+        delete = QuerySet.delete
+        errors = [OperationalError("database table is locked")]
+
+        def busy_delete(queryset):
+            if errors:
+                raise errors.pop()
+            return delete(queryset)
+
+        # The job is deleted once the database is free, not run again.
+        with mock.patch.object(QuerySet, "delete", busy_delete):
+            self.assertTrue(Worker().run_once())
+        self.assertEqual(calls, [[4]])
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(RECORD_RETENTION_DAYS=30)
+    def test_delete_old_records(self):
+        old = timezone.now() - timedelta(days=31)
+        for state in [Job.State.Failed, Job.State.Pending]:
+            Job.objects.create(name="old", state=state)
+        Job.objects.update(update_time=old)
+        Job.objects.create(name="new", state=Job.State.Failed)
+
+        delete_old_records()
+        names = Job.objects.order_by("id").values_list("name", "state")
+        self.assertEqual(
+            list(names),
+            [
+                ("old", Job.State.Pending),
+                ("new", Job.State.Failed),
+                (job_name(delete_old_records), Job.State.Pending),
+            ],
+        )
+        # Queued once, however often it runs.
+        delete_old_records()
+        self.assertEqual(Job.objects.count(), 3)
+
+    def test_expired_lease(self):
+        run_in_background(record_call, 2)
+        job = claim_job("dead-worker")
+        self.assertEqual(job.state, Job.State.Running)
+        self.assertIsNone(claim_job("worker"))
+
+        # The first worker died, the job is run again once its lease expires.
+        Job.objects.update(lease_expires=timezone.now() - timedelta(seconds=1))
+        job = claim_job("worker")
+        self.assertEqual(job.attempts, 2)
+        # A late first run does not touch the job it lost.
+        run_job(Job.objects.get(id=job.id), "dead-worker")
+        self.assertTrue(Job.objects.exists())
+        run_job(job, "worker")
+        self.assertEqual(calls, [[2], [2]])
+        self.assertFalse(Job.objects.exists())
+
+        # Out of attempts, the job fails without running.
+        run_in_background(record_call, 3)
+        claim_job("dead-worker")
+        Job.objects.update(
+            attempts=2, lease_expires=timezone.now() - timedelta(seconds=1)
+        )
+        run_job(claim_job("worker"), "worker")
+        self.assertEqual(Job.objects.get().state, Job.State.Failed)
+        self.assertEqual(calls, [[2], [2]])
+
+
+@override_settings(MEDIA_ROOT="var/media/test")
+class WorkerCommandTest(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_command(self):
+        # Workers run in threads, with connections of their own.
+        for i in range(3):
+            run_in_background(record_call, i)
+        call_command("worker", "--burst", "--concurrency", "2")
+        self.assertEqual(sorted(calls), [[0], [1], [2]])
+        self.assertFalse(Job.objects.filter(name=job_name(record_call)).exists())
+        # The workers queued the deletion of old records for the next day.
+        job = Job.objects.get(name=job_name(delete_old_records))
+        self.assertGreater(job.run_after, timezone.now() + timedelta(hours=23))
@@ -0,0 +1,60 @@
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.db import IntegrityError
+from django.test import override_settings
+
+from distribute.models import Package, PackageBlob
+from distribute.tests.test_distribute_base import DistributeBaseTest
+
+
+@override_settings(PACKAGE_DEDUPLICATION=True)
+class PackageBlobTest(DistributeBaseTest):
+    def test_deduplicate(self):
+        app_api = self.create_app_api()
+
+        r = app_api.upload_package(self.apk_path)
+        self.assert_status_201(r)
+        first = Package.objects.get(package_id=r.json()["package_id"])
+        r = app_api.upload_package(self.apk_path)
+        self.assert_status_201(r)
+        second = Package.objects.get(package_id=r.json()["package_id"])
+
+        self.assertEqual(first.package_file.name, second.package_file.name)
+        self.assertEqual(first.icon_file.name, second.icon_file.name)
+        self.assertEqual(first.fingerprint, second.fingerprint)
+        blob = PackageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.file.name, first.package_file.name)
+
+        r = app_api.remove_package(first.package_id)
+        self.assert_status_204(r)
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+        r = app_api.remove_package(second.package_id)
+        self.assert_status_204(r)
+        self.assertFalse(PackageBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+    def test_release_on_failure(self):
+        app_api = self.create_app_api()
+
+        r = app_api.upload_package(self.apk_path)
+        self.assert_status_201(r)
+        blob = PackageBlob.objects.get()
+        with mock.patch.object(Package, "save", side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                app_api.upload_package(self.apk_path)
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+
+        # The blob created for a package that is not saved is deleted.
+        Package.objects.all().delete()
+        self.assertFalse(PackageBlob.objects.exists())
+        with mock.patch.object(Package, "save", side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                app_api.upload_package(self.apk_path)
+        self.assertFalse(PackageBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
@@ -0,0 +1,266 @@
+import io
+import os
+import plistlib
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
+
+import requests
+from django.conf import settings
+from django.test import override_settings
+
+from distribute.models import Package, PackageParseCache
+from distribute.package_parser import parser
+from distribute.package_parser.apk_parser import ApkManifest, ApkParser
+from distribute.package_parser.axml import (TYPE_INT_HEX, BinaryFormatError,
+                                            BinaryXml)
+from distribute.tests.packages import (ANDROID_ICONS, make_apk,
+                                       make_apk_variants, make_ipa, png_bytes)
+from distribute.tests.test_distribute_base import DistributeBaseTest
+from storage.RangeFile import RangeFile
+from util.tests import BaseTestCase
+
+
+def build_ipa(plist, files):
+    fp = io.BytesIO()
+    with zipfile.ZipFile(fp, "w") as z:
+        z.writestr("Payload/Sample.app/Frameworks/A.framework/Info.plist", b"")
+        z.writestr("Payload/Sample.app/Info.plist", plistlib.dumps(plist))
+        for name, data in files.items():
+            z.writestr("Payload/Sample.app/" + name, data)
+    fp.seek(0)
+    return fp
+
+
+def base_plist():
+    return {
+        "CFBundleDisplayName": "Sample",
+        "CFBundleIdentifier": "com.example.sample",
+        "CFBundleVersion": "12",
+        "CFBundleShortVersionString": "1.2.0",
+        "MinimumOSVersion": "12.0",
+    }
+
+
+class IpaParserTest(BaseTestCase):
+    def test_plist(self):
+        fp = build_ipa(base_plist(), {})
+        pkg = parser.parse(fp, "ipa")
+        self.assertEqual(pkg.display_name, "Sample")
+        self.assertEqual(pkg.bundle_identifier, "com.example.sample")
+        self.assertEqual(pkg.version, "12")
+        self.assertEqual(pkg.short_version, "1.2.0")
+        self.assertEqual(pkg.minimum_os_version, "12.0")
+        self.assertIsNone(pkg.app_icon)
+
+    def test_largest_icon(self):
+        plist = base_plist()
+        plist["CFBundleIcons"] = {
+            "CFBundlePrimaryIcon": {"CFBundleIconFiles": ["AppIcon60x60"]}
+        }
+        files = {
+            "AppIcon60x60@2x.png": b"2" * 20,
+            "AppIcon60x60@3x.png": b"3" * 30,
+            "Other@3x.png": b"o" * 90,
+        }
+        pkg = parser.parse(build_ipa(plist, files), "ipa")
+        self.assertEqual(pkg.app_icon, b"3" * 30)
+
+    def test_ipad_icon(self):
+        plist = base_plist()
+        plist["CFBundleIcons~ipad"] = {
+            "CFBundlePrimaryIcon": {"CFBundleIconFiles": ["AppIcon76x76"]}
+        }
+        files = {"AppIcon76x76@2x~ipad.png": b"i" * 40}
+        pkg = parser.parse(build_ipa(plist, files), "ipa")
+        self.assertEqual(pkg.app_icon, b"i" * 40)
+
+    def test_asset_catalog_icon(self):
+        files = {"AppIcon60x60@2x.png": b"a" * 20}
+        pkg = parser.parse(build_ipa(base_plist(), files), "ipa")
+        self.assertEqual(pkg.app_icon, b"a" * 20)
+
+
+def download_sample_apk():
+    """
+    Return the path of a sample app built by the Android tools, downloaded
+    once into STATIC_ROOT, or None without network access.
+    """
+    package_dir = os.path.join(settings.STATIC_ROOT, "downloads")
+    path = os.path.join(package_dir, "bitbar-sample-app.apk")
+    if not os.path.exists(path):
+        os.makedirs(package_dir, exist_ok=True)
+        url = "https://raw.githubusercontent.com/bitbar/test-samples/master/apps/android/bitbar-sample-app.apk"  # noqa: E501
+        try:
+            with requests.get(url, stream=True, timeout=30) as r:
+                r.raise_for_status()
+                with open(path + ".part", "wb") as f:
+                    shutil.copyfileobj(r.raw, f)
+        except requests.RequestException:
+            return None
+        os.rename(path + ".part", path)
+    return path
+
+
+class ApkParserTest(BaseTestCase):
+    def test_manifest(self):
+        fp = make_apk(
+            io.BytesIO(),
+            package="com.example.app",
+            version_code=42,
+            version_name="4.2.0",
+            min_sdk=26,
+            target_sdk=33,
+            label="Example",
+        )
+        pkg = parser.parse(fp, "apk")
+        self.assertEqual(pkg.display_name, "Example")
+        self.assertEqual(pkg.bundle_identifier, "com.example.app")
+        self.assertEqual(pkg.version, "42")
+        self.assertEqual(pkg.short_version, "4.2.0")
+        self.assertEqual(pkg.minimum_os_version, "8.0")
+        self.assertEqual(
+            pkg.extra, {"min_sdk_version": "26", "target_sdk_version": "33"}
+        )
+
+    def test_androguard_fallback(self):
+        fp = make_apk(io.BytesIO(), version_code=42, version_name="4.2.0")
+        expected = parser.parse(fp, "apk")
+        with mock.patch(
+            "distribute.package_parser.apk_parser.ApkManifest",
+            side_effect=BinaryFormatError,
+        ):
+            pkg = ApkParser(fp)
+            self.assertIsNone(pkg.manifest)
+            for name in [
+                "display_name",
+                "bundle_identifier",
+                "version",
+                "short_version",
+                "min_sdk_version",
+                "target_sdk_version",
+                "app_icon",
+            ]:
+                self.assertEqual(getattr(pkg, name), getattr(expected, name))
+
+    def test_aapt_built_apk(self):
+        path = download_sample_apk()
+        if path is None:
+            self.skipTest("the sample apk can not be downloaded")
+        with open(path, "rb") as f:
+            pkg = ApkParser(f)
+            self.assertIsInstance(pkg.manifest, ApkManifest)
+            apk = pkg.apk
+            self.assertEqual(pkg.display_name, apk.get_app_name())
+            self.assertEqual(pkg.bundle_identifier, apk.get_package())
+            self.assertEqual(pkg.version, apk.get_androidversion_code())
+            self.assertEqual(pkg.short_version, apk.get_androidversion_name())
+            self.assertEqual(pkg.min_sdk_version, apk.get_min_sdk_version())
+            self.assertEqual(pkg.app_icon, apk.get_file(apk.get_app_icon()))
+
+    def test_hex_value(self):
+        with zipfile.ZipFile(make_apk(io.BytesIO())) as z:
+            xml = BinaryXml(z.read("AndroidManifest.xml"))
+        xml.elements = [("manifest", {"versionCode": (TYPE_INT_HEX, 0x2A)})]
+        self.assertEqual(xml.value("manifest", "versionCode"), "0x2a")
+
+    def test_highest_density_icon(self):
+        pkg = parser.parse(make_apk(io.BytesIO()), "apk")
+        self.assertEqual(pkg.app_icon, png_bytes(ANDROID_ICONS[-1][2]))
+
+    def test_variants(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = make_apk_variants(temp_dir, [25, 28])
+            pkgs = []
+            for path in paths:
+                with open(path, "rb") as f:
+                    pkgs.append(parser.parse(f, "apk"))
+        self.assertEqual([x.min_sdk_version for x in pkgs], ["25", "28"])
+        self.assertEqual([x.minimum_os_version for x in pkgs], ["7.1, 7.1.1", "9"])
+        self.assertLess(int(pkgs[0].version), int(pkgs[1].version))
+
+    def test_size_and_entries(self):
+        fp = make_apk(io.BytesIO(), entries=10, payload_size=100 * 1024)
+        self.assertGreater(len(fp.getvalue()), 100 * 1024)
+        with zipfile.ZipFile(fp) as z:
+            names = [x for x in z.namelist() if x.startswith("assets/filler/")]
+        self.assertEqual(len(names), 10)
+        fp = make_ipa(io.BytesIO(), entries=3, payload_size=1000)
+        pkg = parser.parse(fp, "ipa")
+        self.assertEqual(pkg.bundle_identifier, "com.example.sample")
+
+
+class RangeFileTest(BaseTestCase):
+    def range_file(self, data, block_size=1024):
+        def open_range(start, end):
+            end = len(data) - 1 if end is None else end
+            return io.BytesIO(data[start : end + 1])
+
+        return RangeFile("sample", len(data), open_range, block_size=block_size)
+
+    def test_read_and_seek(self):
+        data = bytes(range(256)) * 40
+        fp = self.range_file(data)
+        self.assertEqual(fp.read(10), data[:10])
+        fp.seek(-100, io.SEEK_END)
+        self.assertEqual(fp.read(), data[-100:])
+        fp.seek(1000)
+        self.assertEqual(fp.read(2000), data[1000:3000])
+        fp.seek(0)
+        self.assertEqual(fp.read(), data)
+
+    def test_parse_fetches_part_of_package(self):
+        files = {"Frameworks/B.framework/%04d.bin" % i: bytes(2048) for i in range(64)}
+        files["AppIcon60x60@2x.png"] = b"a" * 20
+        data = build_ipa(base_plist(), files).getvalue()
+        fp = self.range_file(data, block_size=4096)
+        pkg = parser.parse(fp, "ipa")
+        self.assertEqual(pkg.bundle_identifier, "com.example.sample")
+        self.assertEqual(pkg.app_icon, b"a" * 20)
+        self.assertLess(fp.bytes_fetched, len(data) / 2)
+
+
+class PackageParseCacheTest(DistributeBaseTest):
+    def test_reupload(self):
+        app_api = self.create_app_api()
+
+        r = app_api.upload_package(self.ipa_path)
+        self.assert_status_201(r)
+        first = Package.objects.get(package_id=r.json()["package_id"])
+        cached = PackageParseCache.objects.get()
+        self.assertEqual(cached.fingerprint, first.fingerprint)
+        self.assertEqual(cached.icon_name, first.icon_file.name)
+
+        with mock.patch.object(parser, "parse") as parse:
+            r = app_api.upload_package(self.ipa_path)
+            self.assert_status_201(r)
+            parse.assert_not_called()
+        second = Package.objects.get(package_id=r.json()["package_id"])
+        for field in ["name", "bundle_identifier", "version", "short_version"]:
+            self.assertEqual(getattr(first, field), getattr(second, field))
+        self.assertEqual(first.extra, second.extra)
+        self.assertEqual(first.icon_file.name, second.icon_file.name)
+
+    def test_other_app(self):
+        todo = self.todo_app()
+        todo["enable_os"] = ["iOS", "Android"]
+        app_apis = [self.create_app_api(), self.create_app_api(todo)]
+
+        r = app_apis[0].upload_package(self.ipa_path)
+        first = Package.objects.get(app__universal_app__path="chrome")
+        # The same binary in another app is parsed again and keeps its icon.
+        r = app_apis[1].upload_package(self.ipa_path)
+        self.assert_status_201(r)
+        second = Package.objects.get(app__universal_app__path="todo")
+        self.assertEqual(PackageParseCache.objects.count(), 2)
+        self.assertNotEqual(first.icon_file.name, second.icon_file.name)
+
+    @override_settings(PACKAGE_PARSE_CACHE_SIZE=1)
+    def test_eviction(self):
+        app_api = self.create_app_api()
+        app_api.upload_package(self.ipa_path)
+        r = app_api.upload_package(self.apk_path)
+        package = Package.objects.get(package_id=r.json()["package_id"])
+        cached = PackageParseCache.objects.get()
+        self.assertEqual(cached.fingerprint, package.fingerprint)
@@ -0,0 +1,109 @@
+import hashlib
+import io
+import os
+import tempfile
+import zipfile
+
+from django.test import override_settings
+
+from distribute.models import Package
+from distribute.patch import PatchError, apply_patch, make_patch
+from distribute.tests.test_distribute_base import DistributeBaseTest
+from distribute.views import create_package_patches
+from util.tests import BaseTestCase
+
+
+def build_zip(entries):
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in entries:
+            z.writestr(name, data)
+    return file
+
+
+class PatchTest(BaseTestCase):
+    def test_make_and_apply(self):
+        library = os.urandom(512 * 1024)
+        old = build_zip(
+            [("lib/libapp.so", library), ("classes.dex", b"version 1" * 100)]
+        )
+        new = build_zip(
+            [
+                ("classes.dex", b"version 2" * 100),
+                ("lib/libapp.so", library),
+                ("assets/new.txt", b"new"),
+            ]
+        )
+        file = io.BytesIO()
+        size = make_patch(old, new, file)
+        patch = file.getvalue()
+        self.assertEqual(size, len(patch))
+        self.assertLess(size, 16 * 1024)
+        digest = hashlib.md5(new.getvalue()).hexdigest()
+        self.assertEqual(make_patch(old, new, io.BytesIO(), digest), size)
+
+        out = io.BytesIO()
+        apply_patch(old, io.BytesIO(patch), out)
+        self.assertEqual(out.getvalue(), new.getvalue())
+
+        other = build_zip([("lib/libapp.so", os.urandom(1024))])
+        with self.assertRaises(PatchError):
+            apply_patch(other, io.BytesIO(patch), io.BytesIO())
+        with self.assertRaises(PatchError):
+            apply_patch(old, io.BytesIO(b"garbage"), io.BytesIO())
+        with self.assertRaises(PatchError):
+            apply_patch(old, io.BytesIO(patch[:-16]), io.BytesIO())
+        with self.assertRaises(PatchError):
+            make_patch(io.BytesIO(b"garbage"), new, io.BytesIO())
+        # Stops once the patch is bigger than max_size.
+        with self.assertRaises(PatchError):
+            make_patch(other, new, io.BytesIO(), max_size=1024)
+
+
+@override_settings(PACKAGE_PATCH_BASES=3)
+class PackagePatchTest(DistributeBaseTest):
+    def test_package_patch(self):
+        app_api = self.create_app_api()
+
+        r = app_api.upload_package(self.apk_path)
+        self.assert_status_201(r)
+        version = r.json()["version"]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # The next build adds an asset and keeps every other entry.
+            path = os.path.join(temp_dir, "next.apk")
+            with zipfile.ZipFile(self.apk_path) as old:
+                with zipfile.ZipFile(path, "w") as new:
+                    for info in old.infolist():
+                        new.writestr(info, old.read(info.filename))
+                    new.writestr("assets/next.txt", b"next build")
+            r = app_api.upload_package(path)
+            self.assert_status_201(r)
+            package_id = r.json()["package_id"]
+            with open(path, "rb") as f:
+                next_apk = f.read()
+
+        package = Package.objects.get(package_id=package_id)
+        create_package_patches(package.id)
+        create_package_patches(package.id)
+        self.assertEqual(package.patches.count(), 1)
+
+        r = app_api.get_one_package(package_id)
+        self.assertNotIn("patch", r.json())
+        query = {"version": version}
+        r = app_api.client.get(app_api.base_path + "/packages/%d" % package_id, query)
+        self.assert_status_200(r)
+        patch = r.json()["patch"]
+        self.assertEqual(patch["base_package_id"], package_id - 1)
+        self.assertLess(patch["size"], len(next_apk))
+
+        out = io.BytesIO()
+        with package.patches.get().file.open() as f:
+            with open(self.apk_path, "rb") as old:
+                apply_patch(old, f, out)
+            self.assertEqual(f.tell(), patch["size"])
+        self.assertEqual(out.getvalue(), next_apk)
+
+        r = app_api.client.get(
+            app_api.base_path + "/packages/%d" % package_id, {"version": "0"}
+        )
+        self.assertIsNone(r.json()["patch"])
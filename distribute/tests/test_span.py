@@ -0,0 +1,73 @@
+import socket
+
+from django.test import override_settings
+
+from distribute.events import dispatch_event
+from distribute.models import Package
+from distribute.tests.test_distribute_base import DistributeBaseTest
+from util.span import NULL_SPAN, memory_sink, span
+from util.tests import BaseTestCase
+
+
+class SpanTest(BaseTestCase):
+    def test_disabled(self):
+        with override_settings(SPAN_SINK=""):
+            self.assertIs(span("package.parse", size=1), NULL_SPAN)
+            with span("package.parse") as s:
+                s.set(parser="ApkParser")
+
+    def test_statsd(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(5)
+        address = "127.0.0.1:%d" % receiver.getsockname()[1]
+        try:
+            with override_settings(SPAN_SINK="statsd", SPAN_STATSD_ADDRESS=address):
+                with span("package.parse", parser="ApkParser", size=1024):
+                    pass
+            lines = receiver.recv(4096).decode().split("\n")
+        finally:
+            receiver.close()
+        self.assertRegex(
+            lines[0],
+            r"^apphub\.package\.parse:[0-9.]+\|ms\|#parser:ApkParser,storage:\w+$",
+        )
+        self.assertRegex(lines[1], r"^apphub\.package\.parse\.size:1024\|h\|#")
+
+    def test_error(self):
+        memory_sink.clear()
+        with override_settings(SPAN_SINK="memory"):
+            with self.assertRaises(ValueError):
+                with span("package.parse"):
+                    raise ValueError()
+        self.assertEqual(memory_sink.spans[0]["error"], "ValueError")
+
+
+@override_settings(SPAN_SINK="memory")
+class IngestSpanTest(DistributeBaseTest):
+    def setUp(self):
+        super().setUp()
+        memory_sink.clear()
+
+    def test_upload(self):
+        app_api = self.create_app_api()
+
+        r = app_api.upload_package(self.apk_path)
+        self.assert_status_201(r)
+        size = r.json()["size"]
+
+        parse = memory_sink.find("package.parse")[0]
+        self.assertEqual(parse["tags"]["parser"], "ApkParser")
+        self.assertEqual(parse["tags"]["size"], size)
+        create = memory_sink.find("package.create")[0]
+        self.assertEqual(create["tags"]["parser"], "ApkParser")
+        self.assertEqual(create["tags"]["storage"], "LocalFileSystem")
+        self.assertGreaterEqual(create["duration"], parse["duration"])
+        saves = memory_sink.find("storage.save")
+        self.assertIn(size, [x["tags"]["size"] for x in saves])
+        self.assertEqual(len(memory_sink.find("package.fingerprint")), 0)
+
+        dispatch_event("new_package", Package.objects.get().id)
+        notify = memory_sink.find("webhook.notify")[0]
+        self.assertEqual(notify["tags"]["webhooks"], 0)
+        self.assertEqual(notify["tags"]["event"], "new_package")
@@ -1,5 +1,16 @@
+import time
+from unittest import mock
+
+from django.test import override_settings
+
 from client.api import Api
 from client.unit_test_client import UnitTestClient
+from distribute.models import StoreAppVersionRecord
+from distribute.stores.app_store import AppStore
+from distribute.stores.huawei import HuaweiStore
+from distribute.stores.vivo import VivoStore
+from distribute.stores.xiaomi import XiaomiStore
+from distribute.tests.test_distribute_base import DistributeBaseTest
 from util.tests import BaseTestCase
 
 
@@ -85,6 +96,50 @@ class UserStoreAppAuthTest(BaseTestCase):
         self.assert_status_200(r)
 
 
+class StoreVersionRefreshTest(DistributeBaseTest):
+    def setUp(self):
+        super().setUp()
+        self.app_api = self.create_app_api()
+
+    def slow(self):
+        time.sleep(2)
+        return {"version": "1.0.0"}
+
+    def broken(self):
+        raise ValueError("broken page")
+
+    @override_settings(STORE_TIMEOUT=0.5)
+    def test_refresh(self):
+        self.app_api.create_appstore("414478124", "cn")
+        self.app_api.create_huawei_store("https://example.com", "https://example.com")
+        self.app_api.create_vivo_store("40413")
+        self.app_api.create_xiaomi_store("1122")
+        with mock.patch.object(
+            AppStore, "store_current", return_value={"version": "2.0.1"}
+        ), mock.patch.object(
+            HuaweiStore, "store_current", self.slow
+        ), mock.patch.object(
+            VivoStore, "store_current", self.broken
+        ), mock.patch.object(
+            XiaomiStore, "store_current", return_value={"version": ""}
+        ):
+            begin = time.monotonic()
+            r = self.app_api.update_stores_versions()
+            # The stores are asked at the same time, the slow one times out.
+            self.assertLess(time.monotonic() - begin, 1.5)
+        self.assert_status_200(r)
+        self.assertEqual(
+            [(x["store"], x.get("short_version"), x.get("error")) for x in r.json()],
+            [
+                ("appstore", "2.0.1", None),
+                ("huawei", None, "The store did not answer in 0.5 seconds."),
+                ("vivo", None, "ValueError: broken page"),
+                ("xiaomi", None, "ValueError: The store did not return a version."),
+            ],
+        )
+        self.assertEqual(StoreAppVersionRecord.objects.get().short_version, "2.0.1")
+
+
 class OrganizationStoreAppAuthTest(UserStoreAppAuthTest):
 
     def create_and_get_namespace(self, api, namespace, visibility="Public"):
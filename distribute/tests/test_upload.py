@@ -1,5 +1,14 @@
+import hashlib
+import os
+import tempfile
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.db import IntegrityError
+
 from client.api import Api
 from client.unit_test_client import UnitTestClient
+from distribute.models import Package
 from distribute.tests.test_distribute_base import DistributeBaseTest
 
 
@@ -25,6 +34,8 @@ class UserUploadPackageTest(DistributeBaseTest):
         r = app_api.upload_package(file_path)
         self.assert_status_201(r)
         package_id = r.json()["package_id"]
+        with open(file_path, "rb") as f:
+            self.assertEqual(r.json()["fingerprint"], hashlib.md5(f.read()).hexdigest())
 
         r2 = app_api.get_package_list()
         self.assert_status_200(r2)
@@ -88,3 +99,62 @@ class OrganizationUploadPackageTest(UserUploadPackageTest):
 
     def get_namespace(self, api, namespace):
         return api.get_org_api(namespace)
+
+
+class BatchUploadPackageTest(DistributeBaseTest):
+    def test_batch_upload(self):
+        app_api = self.create_app_api()
+        r = app_api.create_token({"name": "token1", "enable_upload_package": True})
+        self.assert_status_201(r)
+        token = r.json()["token"]
+
+        anonymous: Api = Api(UnitTestClient())
+        with tempfile.TemporaryDirectory() as temp_dir:
+            invalid_path = os.path.join(temp_dir, "invalid.apk")
+            with open(invalid_path, "wb") as f:
+                f.write(b"not a package")
+            r = anonymous.upload_packages(
+                [self.apk_path, invalid_path, self.ipa_path, self.apk_path],
+                token,
+                ["huawei", "xiaomi", "", "vivo"],
+            )
+        self.assert_status_200(r)
+        results = r.json()["results"]
+        self.assertEqual(len(results), 4)
+        self.assertEqual(
+            results[1]["error"], {"message": "Can not parse the package."}
+        )
+        ok = [results[0], results[2], results[3]]
+        self.assertEqual([x["data"]["package_id"] for x in ok], [1, 2, 3])
+        self.assertEqual(
+            [x["data"]["channel"] for x in ok], ["huawei", "", "vivo"]
+        )
+        r = app_api.get_package_list()
+        self.assert_list_length(r, 3)
+
+        r = anonymous.upload_packages([self.apk_path], token, ["a", "b"])
+        self.assert_status_400(r)
+
+        # A package failing to save does not fail the others.
+        save = Package.save
+
+        def broken_save(package, *args, **kwargs):
+            if package.channel == "broken":
+                raise IntegrityError("broken")
+            return save(package, *args, **kwargs)
+
+        with mock.patch.object(Package, "save", broken_save):
+            r = anonymous.upload_packages(
+                [self.apk_path, self.ipa_path], token, ["broken", "fine"]
+            )
+        self.assert_status_200(r)
+        results = r.json()["results"]
+        self.assertEqual(results[0]["error"], {"message": "Can not save the package."})
+        self.assertEqual(results[1]["data"]["package_id"], 5)
+        r = app_api.get_package_list()
+        self.assert_list_length(r, 4)
+
+        # Streamed uploads are moved into place or deleted, even on errors.
+        if default_storage.exists("temp/upload/stream"):
+            _, files = default_storage.listdir("temp/upload/stream")
+            self.assertEqual(files, [])
@@ -0,0 +1,179 @@
+import hashlib
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import override_settings
+
+from application.models import AppAPIToken
+from client.unit_test_client import UnitTestClient
+from distribute.models import FileUploadRecord, Job
+from distribute.task import job_name
+from distribute.tests.test_distribute_base import DistributeBaseTest
+from distribute.views import process_upload_record
+
+
+class UploadRecordTest(DistributeBaseTest):
+    def setUp(self):
+        super().setUp()
+        app_api = self.create_app_api()
+        token_obj = {
+            "name": "token1",
+            "enable_upload_package": True,
+        }
+        r = app_api.create_token(token_obj)
+        self.assert_status_201(r)
+        self.token = r.json()["token"]
+        self.anonymous = UnitTestClient()
+
+    def create_record(self, content, filename="sample.ipa"):
+        name = default_storage.save("temp/upload/" + filename, ContentFile(content))
+        token = AppAPIToken.objects.get(token=self.token)
+        return FileUploadRecord.objects.create(
+            universal_app=token.app,
+            data={
+                "type": "package",
+                "file": name,
+                "uploader_type": "token",
+                "uploader_id": token.id,
+            },
+        )
+
+    def record_url(self, record):
+        return self.anonymous.build_url("/upload/record/" + str(record.id))
+
+    def check(self, record, method="get", query=None):
+        func = getattr(self.anonymous.client, method)
+        return func(
+            self.record_url(record),
+            data=query,
+            HTTP_AUTHORIZATION="Token " + self.token,
+        )
+
+    def test_process(self):
+        with open(self.ipa_path, "rb") as f:
+            record = self.create_record(f.read())
+        r = self.check(record)
+        self.assert_status_200(r)
+        self.assertEqual(r.json(), {"status": "uploaded"})
+
+        jobs = Job.objects.filter(name=job_name(process_upload_record))
+        r = self.check(record, "post")
+        self.assert_status_200(r)
+        self.assertEqual(r.json(), {"status": "queued"})
+        self.assertEqual(jobs.count(), 1)
+
+        process_upload_record(record.id)
+        r = self.check(record, query={"wait": 5})
+        self.assert_status_200(r)
+        self.assertEqual(r.json()["status"], "completed")
+        self.assertEqual(r.json()["data"]["package_id"], 1)
+        self.assertFalse(default_storage.exists(record.data["file"]))
+
+        r = self.check(record, "post")
+        self.assertEqual(r.json()["status"], "completed")
+        self.assertEqual(jobs.count(), 1)
+
+    def test_failed(self):
+        record = self.create_record(b"not a package")
+        self.check(record, "post")
+        process_upload_record(record.id)
+        r = self.check(record)
+        self.assertEqual(
+            r.json(),
+            {"status": "failed", "error": {"message": "Can not parse the package."}},
+        )
+        self.assertFalse(default_storage.exists(record.data["file"]))
+        # A failed record is not queued again.
+        r = self.check(record, "post")
+        self.assertEqual(r.json()["status"], "failed")
+
+    @override_settings(JOB_MAX_ATTEMPTS=2)
+    def test_storage_error(self):
+        with open(self.ipa_path, "rb") as f:
+            record = self.create_record(f.read())
+        self.check(record, "post")
+        with mock.patch(
+            "distribute.views.open_uploaded_file", side_effect=OSError("timed out")
+        ):
+            # The job is retried, the record waits for it with its file.
+            with self.assertRaises(OSError):
+                process_upload_record(record.id)
+            r = self.check(record)
+            self.assertEqual(r.json(), {"status": "queued"})
+            self.assertTrue(default_storage.exists(record.data["file"]))
+
+            # The last attempt fails the record.
+            process_upload_record(record.id)
+        r = self.check(record)
+        self.assertEqual(r.json()["status"], "failed")
+        self.assertFalse(default_storage.exists(record.data["file"]))
+
+    def request_upload(self, size, md5=""):
+        return self.anonymous.client.post(
+            self.anonymous.build_url("/upload/request"),
+            {"filename": "sample.ipa", "size": size, "md5": md5},
+            HTTP_AUTHORIZATION="Token " + self.token,
+        )
+
+    def put_chunk(self, record_id, offset, data):
+        url = self.anonymous.build_url("/upload/record/%s/chunks" % record_id)
+        return self.anonymous.client.put(
+            url + "?offset=" + str(offset),
+            data,
+            content_type="application/octet-stream",
+            HTTP_AUTHORIZATION="Token " + self.token,
+        )
+
+    def test_chunk_upload(self):
+        with open(self.ipa_path, "rb") as f:
+            content = f.read()
+        r = self.request_upload(len(content))
+        self.assert_status_200(r)
+        record = FileUploadRecord.objects.get(id=r.json()["record_id"])
+        half = len(content) // 2
+
+        r = self.put_chunk(record.id, half, content[half:])
+        self.assert_status_200(r)
+        self.assertEqual(r.json()["offset"], 0)
+        self.assertEqual(r.json()["received"], [[half, len(content)]])
+        r = self.check(record, "post")
+        self.assert_status_400(r)
+        # Received bytes are not overwritten.
+        r = self.put_chunk(record.id, half - 1, b"xx")
+        self.assert_status_400(r)
+        self.assertEqual(self.put_chunk(record.id, 0, b"").status_code, 400)
+
+        r = self.put_chunk(record.id, 0, content[:half])
+        self.assert_status_200(r)
+        self.assertEqual(r.json()["offset"], len(content))
+        r = self.put_chunk(record.id, len(content) - 1, b"xx")
+        self.assert_status_400(r)
+
+        r = self.check(record, "post")
+        self.assertEqual(r.json(), {"status": "queued"})
+        process_upload_record(record.id)
+        r = self.check(record)
+        self.assertEqual(r.json()["status"], "completed")
+        self.assertFalse(default_storage.exists(record.data["file"]))
+        record.refresh_from_db()
+        with record.package.package_file.open() as f:
+            self.assertEqual(f.read(), content)
+
+    def test_chunk_upload_md5(self):
+        with open(self.ipa_path, "rb") as f:
+            content = f.read()
+        r = self.request_upload(len(content), hashlib.md5(b"other").hexdigest())
+        record = FileUploadRecord.objects.get(id=r.json()["record_id"])
+        r = self.put_chunk(record.id, 0, content)
+        self.assert_status_200(r)
+        self.check(record, "post")
+        process_upload_record(record.id)
+        r = self.check(record)
+        self.assertEqual(
+            r.json(),
+            {
+                "status": "failed",
+                "error": {"message": "The uploaded file does not match md5."},
+            },
+        )
@@ -0,0 +1,341 @@
+import json
+import sys
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.test import override_settings
+from django.utils import timezone
+
+from application.models import PendingWebhookEvent, WebhookDelivery
+from distribute.events import dispatch_event, publish
+from distribute.models import Job, Package, StoreAppVersionRecord
+from distribute.stores.base import StoreType
+from distribute.task import (Worker, delete_old_records, job_name,
+                             webhook_retry_delay)
+from distribute.tests.test_distribute_base import DistributeBaseTest
+
+
+class WebhookReceiver(ThreadingHTTPServer):
+    """
+    Records the JSON bodies posted to it. Paths starting with /slow answer
+    after `delay` seconds, paths starting with /fail with a 500.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, delay=2):
+        self.delay = delay
+        self.received = []
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(handler):
+                body = handler.rfile.read(int(handler.headers["Content-Length"]))
+                self.connections.add(handler.client_address)
+                self.received.append((handler.path, json.loads(body)))
+                with self.lock:
+                    self.in_flight += 1
+                    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                if handler.path.startswith("/slow"):
+                    time.sleep(self.delay)
+                with self.lock:
+                    self.in_flight -= 1
+                failed = handler.path.startswith("/fail")
+                content = b"broken" if failed else b""
+                handler.send_response(500 if failed else 200)
+                handler.send_header("Content-Length", str(len(content)))
+                handler.end_headers()
+                handler.wfile.write(content)
+
+            def log_message(handler, format, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+
+    def handle_error(self, request, client_address):
+        # Slow requests time out before they are answered.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def url(self, path):
+        return "http://127.0.0.1:%d%s" % (self.server_port, path)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class WebhookTestBase(DistributeBaseTest):
+    def setUp(self):
+        super().setUp()
+        self.app_api = self.create_app_api()
+        r = self.app_api.upload_package(self.apk_path)
+        self.assert_status_201(r)
+        self.package = Package.objects.get()
+        # Webhooks are sent by calling dispatch_event.
+        Job.objects.all().delete()
+
+    def create_webhook(self, url, **kwargs):
+        webhook = {
+            "name": "integration",
+            "url": url,
+            "template": {"body": '{"text": "${name} ${version}"}'},
+            "when_new_package": True,
+        }
+        webhook.update(kwargs)
+        r = self.app_api.create_webhook(webhook)
+        self.assert_status_201(r)
+        return r.json()
+
+
+class WebhookSendTest(WebhookTestBase):
+    def test_timeouts(self):
+        r = self.app_api.create_webhook(
+            {"name": "integration", "url": "https://example.com", "read_timeout": 0}
+        )
+        self.assert_status_400(r)
+        webhook = self.create_webhook("https://example.com", connect_timeout=2)
+        self.assertEqual(webhook["connect_timeout"], 2)
+        self.assertEqual(webhook["read_timeout"], 10)
+
+    def test_template(self):
+        r = self.app_api.create_webhook(
+            {
+                "name": "integration",
+                "url": "https://example.com",
+                "template": {"body": '{"text": ${name'},
+            }
+        )
+        self.assert_status_400(r)
+
+        Package.objects.update(description='Say "hi"\\n')
+        with WebhookReceiver() as receiver:
+            self.create_webhook(
+                receiver.url("/fast"),
+                template={
+                    "body": '{"text": "\\"${name}\\": ${description}", '
+                    '"size": ${size}, "other": "${unknown}"}'
+                },
+            )
+            dispatch_event("new_package", self.package.id)
+            body = receiver.received[0][1]
+        # Values are escaped inside JSON strings, JSON values outside of them.
+        self.assertEqual(body["text"], '"%s": Say "hi"\\n' % self.package.name)
+        self.assertEqual(body["size"], self.package.size)
+        self.assertEqual(body["other"], "${unknown}")
+
+    def test_slow_webhook(self):
+        with WebhookReceiver() as receiver:
+            self.create_webhook(receiver.url("/slow"), read_timeout=0.2)
+            for i in range(3):
+                self.create_webhook(receiver.url("/fast/%d" % i))
+
+            begin = time.monotonic()
+            dispatch_event("new_package", self.package.id)
+            # The slow webhook times out, the others are not held up by it.
+            self.assertLess(time.monotonic() - begin, 1.5)
+            paths = sorted(path for path, body in receiver.received)
+            self.assertEqual(paths, ["/fast/0", "/fast/1", "/fast/2", "/slow"])
+            body = receiver.received[0][1]
+            self.assertEqual(
+                body["text"], self.package.name + " " + self.package.version
+            )
+
+    def test_keep_alive(self):
+        with WebhookReceiver() as receiver:
+            self.create_webhook(receiver.url("/fast"))
+            for i in range(3):
+                dispatch_event("new_package", self.package.id)
+            self.assertEqual(len(receiver.received), 3)
+            # The events reuse the connection of the first one.
+            self.assertEqual(len(receiver.connections), 1)
+
+    @override_settings(WEBHOOK_MAX_ATTEMPTS=2)
+    def test_retry(self):
+        with WebhookReceiver() as receiver:
+            self.create_webhook(receiver.url("/fail"))
+            self.create_webhook(receiver.url("/fast"))
+            dispatch_event("new_package", self.package.id)
+
+            failed = WebhookDelivery.objects.get(success=False)
+            self.assertEqual(failed.attempt, 1)
+            self.assertEqual(failed.status_code, 500)
+            self.assertEqual(failed.response, "broken")
+            self.assertEqual(failed.payload["text"], receiver.received[0][1]["text"])
+            self.assertGreater(failed.next_retry_time, timezone.now())
+            done = WebhookDelivery.objects.get(success=True)
+            self.assertEqual(done.status_code, 200)
+            self.assertIsNone(done.next_retry_time)
+
+            # The retry waits in the job queue, not in the worker.
+            job = Job.objects.get()
+            self.assertEqual(job.run_after, failed.next_retry_time)
+            self.assertFalse(Worker().run_once())
+            Job.objects.update(run_after=timezone.now())
+            self.assertTrue(Worker().run_once())
+            retried = WebhookDelivery.objects.latest("id")
+            self.assertEqual(retried.attempt, 2)
+            self.assertFalse(retried.success)
+            # Out of attempts.
+            self.assertIsNone(retried.next_retry_time)
+            self.assertFalse(Job.objects.exists())
+            self.assertEqual(len(receiver.received), 3)
+
+    @override_settings(WEBHOOK_RETRY_DELAY=10, WEBHOOK_RETRY_MAX_DELAY=60)
+    def test_retry_delay(self):
+        for attempt, delay in [(1, 10), (2, 20), (3, 40), (4, 60), (10, 60)]:
+            self.assertLessEqual(webhook_retry_delay(attempt), delay)
+            self.assertGreaterEqual(webhook_retry_delay(attempt), delay / 2)
+
+    def test_deliveries(self):
+        with WebhookReceiver() as receiver:
+            webhook_id = self.create_webhook(receiver.url("/fast"))["id"]
+            dispatch_event("new_package", self.package.id)
+
+            r = self.app_api.get_webhook_delivery_list(webhook_id)
+            self.assert_status_200(r)
+            self.assert_list_length(r, 1)
+            delivery = r.json()[0]
+            self.assertTrue(delivery["success"])
+            self.assertEqual(delivery["event"], "new_package")
+
+            r = self.app_api.redeliver_webhook(webhook_id, delivery["id"])
+            self.assertEqual(r.status_code, 202)
+            self.assertTrue(Worker().run_once())
+            self.assertEqual(len(receiver.received), 2)
+            self.assertEqual(receiver.received[0][1], receiver.received[1][1])
+
+            r = self.app_api.get_webhook_delivery_list(webhook_id)
+            self.assert_list_length(r, 2)
+            self.assertEqual(r.headers["X-Total-Count"], "2")
+            self.assertEqual(r.json()[0]["attempt"], 1)
+            self.assertGreater(r.json()[0]["id"], delivery["id"])
+
+            r = self.app_api.get_webhook_delivery_list(webhook_id + 1)
+            self.assert_status_404(r)
+            r = self.app_api.redeliver_webhook(webhook_id + 1, delivery["id"])
+            self.assert_status_404(r)
+
+    @override_settings(RECORD_RETENTION_DAYS=30)
+    def test_delete_old_deliveries(self):
+        webhook_id = self.create_webhook("http://127.0.0.1:9/")["id"]
+        for i in range(2):
+            WebhookDelivery.objects.create(
+                webhook_id=webhook_id, event="new_package", payload={}
+            )
+        first = WebhookDelivery.objects.order_by("id").first()
+        WebhookDelivery.objects.filter(id=first.id).update(
+            create_time=timezone.now() - timedelta(days=31)
+        )
+        delete_old_records()
+        self.assertEqual(WebhookDelivery.objects.count(), 1)
+
+    @override_settings(WEBHOOK_URL_CONCURRENCY=1)
+    def test_url_concurrency(self):
+        with WebhookReceiver(delay=0.1) as receiver:
+            for i in range(3):
+                self.create_webhook(receiver.url("/slow"))
+            dispatch_event("new_package", self.package.id)
+            self.assertEqual(WebhookDelivery.objects.filter(success=True).count(), 3)
+            # The deliveries to the same url went one at a time.
+            self.assertEqual(receiver.max_in_flight, 1)
+
+    def test_coalesce(self):
+        with WebhookReceiver() as receiver:
+            self.create_webhook(
+                receiver.url("/fast"),
+                coalesce_window=60,
+                template={"body": '{"count": ${count}, "text": "${digest}"}'},
+            )
+            for i in range(3):
+                dispatch_event("new_package", self.package.id)
+            self.assertEqual(receiver.received, [])
+            self.assertEqual(PendingWebhookEvent.objects.count(), 3)
+            job = Job.objects.get()
+            self.assertGreater(job.run_after, timezone.now())
+
+            Job.objects.update(run_after=timezone.now())
+            self.assertTrue(Worker().run_once())
+            self.assertEqual(len(receiver.received), 1)
+            body = receiver.received[0][1]
+            self.assertEqual(body["count"], 3)
+            lines = body["text"].split("\n")
+            self.assertEqual(len(lines), 3)
+            self.assertTrue(lines[0].startswith(self.package.name + " "))
+            self.assertFalse(PendingWebhookEvent.objects.exists())
+            self.assertEqual(WebhookDelivery.objects.get().event, "new_package")
+
+            # The next event starts a new window.
+            dispatch_event("new_package", self.package.id)
+            self.assertEqual(Job.objects.count(), 1)
+
+            # A digest that has started may miss a new event, which gets a
+            # digest of its own.
+            Job.objects.update(state=Job.State.Running)
+            dispatch_event("new_package", self.package.id)
+            self.assertEqual(Job.objects.filter(state=Job.State.Pending).count(), 1)
+            dispatch_event("new_package", self.package.id)
+            self.assertEqual(Job.objects.count(), 2)
+
+
+class EventTest(WebhookTestBase):
+    def dispatched(self):
+        return [job.args for job in Job.objects.filter(name=job_name(dispatch_event))]
+
+    def test_no_subscriber(self):
+        self.create_webhook("https://example.com", when_new_package=False)
+        app_id = self.package.app.universal_app_id
+        with self.assertNumQueries(1):
+            publish("new_package", app_id, self.package.id)
+        self.assertEqual(self.dispatched(), [])
+
+    def test_release(self):
+        with WebhookReceiver() as receiver:
+            self.create_webhook(
+                receiver.url("/fast"),
+                when_new_package=False,
+                when_new_release=True,
+                template={"body": '{"release": ${release_id}, "name": "${name}"}'},
+            )
+            r = self.app_api.upload_package(self.apk_path)
+            self.assertEqual(self.dispatched(), [])
+            r = self.app_api.create_release(
+                {"package_id": r.json()["package_id"], "enabled": True}
+            )
+            self.assert_status_201(r)
+            # Sent by the worker, not the request.
+            self.assertEqual(receiver.received, [])
+            self.assertEqual(len(self.dispatched()), 1)
+
+            Job.objects.exclude(name=job_name(dispatch_event)).delete()
+            self.assertTrue(Worker().run_once())
+            body = receiver.received[0][1]
+            self.assertEqual(body, {"release": 1, "name": self.package.name})
+            self.assertEqual(WebhookDelivery.objects.get().event, "new_release")
+
+    def test_store_state_change(self):
+        with WebhookReceiver() as receiver:
+            self.create_webhook(
+                receiver.url("/fast"),
+                when_new_package=False,
+                when_store_state_change=True,
+                template={"body": '{"text": "${name} ${short_version} ${store}"}'},
+            )
+            record = StoreAppVersionRecord.objects.create(
+                app=self.package.app, store=StoreType.Huawei, short_version="2.0"
+            )
+            publish("store_state_change", self.package.app.universal_app, record.id)
+            self.assertTrue(Worker().run_once())
+            body = receiver.received[0][1]
+            self.assertEqual(body["text"], "Google Chrome 2.0 huawei")
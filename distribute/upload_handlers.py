@@ -0,0 +1,90 @@
+import hashlib
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class StorageUploadHandler(FileUploadHandler):
+    """
+    Stream an uploaded package straight into the storage instead of a local
+    temporary file: a multipart upload for object storages, a file in the
+    storage location for the local storage. The fingerprints are computed
+    from the same chunks.
+
+    The uploaded file is returned opened from the storage, so it is parsed
+    with ranged reads and saved with a server side copy or a rename. Its
+    name is the storage name, the client's is kept in `original_name`. The
+    view deletes them with discard_uploaded_files when the request is done.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.request_length = None
+        self.writer = None
+        self.uploaded_names = []
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        # The request size bounds the file size, it picks the part size.
+        self.request_length = content_length
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256() if settings.PACKAGE_DEDUPLICATION else None
+        self.writer = default_storage.open_upload_writer(
+            "stream", self.file_name, self.request_length
+        )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.md5.update(raw_data)
+        if self.sha256 is not None:
+            self.sha256.update(raw_data)
+        try:
+            self.writer.write(raw_data)
+        except:  # noqa: E722
+            self.upload_interrupted()
+            raise
+
+    def file_complete(self, file_size):
+        writer = self.writer
+        self.writer = None
+        file = writer.close()
+        self.uploaded_names.append(writer.name)
+        file.original_name = self.file_name
+        file.fingerprint = self.md5.hexdigest()
+        if self.sha256 is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+    def upload_interrupted(self):
+        writer = self.writer
+        self.writer = None
+        if writer is not None:
+            writer.abort()
+
+    def discard(self):
+        """
+        Delete the uploaded files. A file the local storage moved into place
+        is already gone.
+        """
+        self.upload_interrupted()
+        for name in self.uploaded_names:
+            try:
+                default_storage.delete(name)
+            except:  # noqa: E722
+                pass
+        self.uploaded_names = []
+
+
+def package_upload_handlers(request):
+    # Every storage of STORAGE_MAP has open_upload_writer.
+    return [StorageUploadHandler(request)]
+
+
+def discard_uploaded_files(request):
+    for handler in request.upload_handlers:
+        if isinstance(handler, StorageUploadHandler):
+            handler.discard()
@@ -1,14 +1,21 @@
+import hashlib
+import logging
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import timedelta
 from urllib.parse import unquote
 
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
 from django.core.files.storage import default_storage
 from django.core.signing import BadSignature, TimestampSigner
+from django.db import IntegrityError, transaction
 from django.http import Http404
 from django.shortcuts import render
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import permissions, serializers, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -20,10 +27,15 @@ from application.permissions import (Namespace, UploadPackagePermission,
                                      check_app_upload_permission,
                                      check_app_view_permission, get_app)
 from application.serializers import UniversalAppSerializer
-from distribute.models import (FileUploadRecord, Package, Release, StoreApp,
-                               StoreAppVersionRecord)
+from distribute.events import publish
+from distribute.models import (Counter, FileUploadRecord, Package, PackageBlob,
+                               PackageParseCache, PackagePatch, Release,
+                               StoreApp, StoreAppVersionRecord)
 from distribute.package_parser import parser
-from distribute.serializers import (PackageSerializer, PackageUpdateSerializer,
+from distribute.patch import MAX_PATCH_RATIO, PatchError, make_patch
+from distribute.serializers import (BatchUploadPackageSerializer,
+                                    PackagePatchSerializer, PackageSerializer,
+                                    PackageUpdateSerializer,
                                     ReleaseCreateSerializer, ReleaseSerializer,
                                     RequestUploadPackageSerializer,
                                     StoreAppAppStoreAuthSerializer,
@@ -33,7 +45,7 @@ from distribute.serializers import (PackageSerializer, PackageUpdateSerializer,
                                     StoreAppVivoAuthSerializer,
                                     StoreAppXiaomiStoreAuthSerializer,
                                     StoreAppYingyongbaoStoreAuthSerializer,
-                                    UploadPackageSerializer)
+                                    UploadPackageSerializer, get_icon_size)
 from distribute.stores.app_store import AppStore
 from distribute.stores.base import StoreType
 from distribute.stores.huawei import HuaweiStore
@@ -41,11 +53,17 @@ from distribute.stores.store import get_store
 from distribute.stores.vivo import VivoStore
 from distribute.stores.xiaomi import XiaomiStore
 from distribute.stores.yingyongbao import YingyongbaoStore
-from distribute.task import notify_new_package
+from distribute.task import run_in_background
+from distribute.upload_handlers import (discard_uploaded_files,
+                                        package_upload_handlers)
 from util.choice import ChoiceField
+from util.image import icon_renditions, normalize_png
 from util.pagination import get_pagination_params
+from util.span import span
 from util.url import build_absolute_uri, get_file_extension
 
+logger = logging.getLogger("apphub.distribute")
+
 
 class SlugAppDetail(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -93,6 +111,7 @@ class SlugAppPackageList(APIView):
             "plist_url_name": self.plist_url_name(app),
             "namespace": namespace,
             "path": app.path,
+            "icon_size": get_icon_size(request),
         }
         serializer = PackageSerializer(packages, many=True, context=context)
         headers = {"X-Total-Count": count}
@@ -174,7 +193,11 @@ class SlugAppPackageDetail(APIView):
             "path": app.path,
         }
         serializer = PackageSerializer(package, context=context)
-        return Response(serializer.data)
+        data = serializer.data
+        version = request.GET.get("version", None)
+        if version:
+            data["patch"] = get_package_patch(package, version)
+        return Response(data)
 
 
 class UserAppPackageList(APIView):
@@ -213,6 +236,7 @@ class UserAppPackageList(APIView):
             "plist_url_name": self.plist_url_name(),
             "namespace": namespace,
             "path": path,
+            "icon_size": get_icon_size(request),
         }
         serializer = PackageSerializer(packages, many=True, context=context)
         headers = {"X-Total-Count": count}
@@ -227,24 +251,26 @@ class OrganizationAppPackageList(UserAppPackageList):
         return "org-app-package-plist"
 
 
-def create_package(
-    operator_content_object,
-    universal_app,
-    file,
-    commit_id="",
-    description="",
-    channel="",
-    build_type="Debug",
-):
+def parse_package_file(file):
     ext = get_file_extension(file.name)
-    pkg = parser.parse(file.file, ext)
+    try:
+        pkg = parser.parse(file.file, ext, size=file.size)
+    except parser.PARSE_ERRORS:
+        pkg = None
     if pkg is None:
         raise serializers.ValidationError({"message": "Can not parse the package."})
-    if pkg.app_icon is not None:
-        icon_file = ContentFile(pkg.app_icon)
-        icon_file.name = "icon.png"
-    else:
-        icon_file = None
+    return pkg
+
+
+def parse_package(universal_app, file):
+    fingerprint = getattr(file, "fingerprint", "")
+    cached = PackageParseCache.lookup(universal_app, fingerprint, file.size)
+    if cached is not None:
+        return cached
+    return parse_package_file(file)
+
+
+def get_package_app(universal_app, pkg):
     app = None
     if pkg.os == Application.OperatingSystem.iOS:
         app = universal_app.iOS
@@ -252,17 +278,89 @@ def create_package(
         app = universal_app.android
     if app is None:
         raise serializers.ValidationError({"message": "OS not supported."})
-    package_id = (
-        Package.objects.filter(app__universal_app=universal_app).count() + 1
-    )
-    instance = Package.objects.create(
+    return app
+
+
+def build_icon_renditions(icon):
+    """
+    Return the {size: {ext: name}} of the icon's renditions and the
+    {name: bytes} to store. Names are derived from the icon, so every package
+    with the same icon shares them.
+    """
+    digest = hashlib.sha256(icon).hexdigest()
+    try:
+        renditions = icon_renditions(icon)
+    except:  # noqa: E722
+        return {}, {}
+    icons = {}
+    files = {}
+    for size, formats in renditions.items():
+        for ext, data in formats.items():
+            name = "icons/{0}/{1}/{2}.{3}".format(digest[:2], digest, size, ext)
+            icons.setdefault(str(size), {})[ext] = name
+            files[name] = data
+    return icons, files
+
+
+def build_package(
+    operator_content_object,
+    app,
+    file,
+    pkg,
+    package_id,
+    commit_id="",
+    description="",
+    channel="",
+    build_type="Debug",
+):
+    """
+    Return an unsaved Package for a parsed file. Its files are written to
+    storage when it is saved, or earlier by store_package_files.
+    """
+    icons = {}
+    renditions = {}
+    if isinstance(pkg, PackageParseCache) and pkg.icon_name:
+        icon_file = pkg.icon_name
+        icons = pkg.icons
+    elif pkg.app_icon is not None:
+        try:
+            icon = normalize_png(pkg.app_icon)
+        except:  # noqa: E722
+            # A broken icon is kept as it is, it does not fail the upload.
+            icon = pkg.app_icon
+        icon_file = ContentFile(icon)
+        icon_file.name = "icon.png"
+        icons, renditions = build_icon_renditions(icon)
+    else:
+        icon_file = None
+    blob = None
+    package_file = file
+    sha256 = getattr(file, "sha256", "")
+    if settings.PACKAGE_DEDUPLICATION and sha256:
+        # Identical binaries share one stored file, a duplicate upload only
+        # adds a reference and reuses the icon stored for the first one of
+        # the same app.
+        blob, created = PackageBlob.acquire(file, sha256)
+        package_file = blob.file.name
+        if not created:
+            stored = (
+                Package.objects.filter(blob=blob, app=app)
+                .exclude(icon_file="")
+                .values_list("icon_file", "icons")
+                .first()
+            )
+            if stored:
+                icon_file, icons = stored
+                renditions = {}
+    instance = Package(
         operator_object_id=operator_content_object.id,
         operator_content_object=operator_content_object,
         build_type=build_type,
         channel=channel,
         app=app,
         name=pkg.display_name,
-        package_file=file,
+        package_file=package_file,
+        blob=blob,
         icon_file=icon_file,
         version=pkg.version,
         short_version=pkg.short_version,
@@ -273,17 +371,188 @@ def create_package(
         description=description,
         extra=pkg.extra,
         size=file.size,
+        fingerprint=getattr(file, "fingerprint", ""),
+        icons=icons,
     )
-    if not app.icon_file and icon_file is not None:
-        app.icon_file = icon_file
+    # Written by store_package_files.
+    instance.icon_renditions = renditions
+    return instance
+
+
+def store_icon_renditions(instance):
+    renditions = getattr(instance, "icon_renditions", None)
+    if not renditions:
+        return
+    names = {}
+    for name, data in renditions.items():
+        if hasattr(default_storage, "save_immutable"):
+            names[name] = default_storage.save_immutable(name, ContentFile(data))
+        else:
+            names[name] = default_storage.save(name, ContentFile(data))
+    instance.icons = {
+        size: {ext: names.get(name, name) for ext, name in formats.items()}
+        for size, formats in instance.icons.items()
+    }
+    instance.icon_renditions = None
+
+
+def discard_package(instance):
+    # Drop the blob reference build_package took for a package never saved.
+    if instance.pk is None and instance.blob_id is not None:
+        PackageBlob.release(instance.blob_id)
+
+
+def store_package_files(instance):
+    # Write the files of an unsaved package without touching the database.
+    for field in [instance.package_file, instance.icon_file]:
+        if field and not field._committed:
+            field.save(field.name, field.file, save=False)
+    store_icon_renditions(instance)
+
+
+def finish_package(instance, pkg):
+    if not isinstance(pkg, PackageParseCache):
+        PackageParseCache.store(
+            instance.app.universal_app,
+            instance.fingerprint,
+            instance.size,
+            pkg,
+            instance.icon_file.name,
+            instance.icons,
+        )
+    app = instance.app
+    if not app.icon_file and instance.icon_file:
+        # The app keeps its own copy, an app icon is deleted on its own.
+        with instance.icon_file.open() as f:
+            icon = f.read()
+        app.icon_file = ContentFile(icon, name="icon.png")
         app.save()
-    notify_new_package(instance.id)
+    publish("new_package", app.universal_app_id, instance.id)
+    if settings.PACKAGE_PATCH_BASES:
+        run_in_background(create_package_patches, instance.id)
+
+
+def open_package_file(package):
+    name = package.package_file.name
+    if hasattr(default_storage, "open_ranged"):
+        return default_storage.open_ranged(name)
+    return default_storage.open(name)
+
+
+def create_package_patches(package_id):
+    """
+    Store delta patches to a package from the previous packages of its app
+    and channel. Runs in the background worker.
+    """
+    package = Package.objects.filter(id=package_id).first()
+    if package is None:
+        return
+    bases = (
+        Package.objects.filter(
+            app=package.app,
+            channel=package.channel,
+            package_id__lt=package.package_id,
+        )
+        .exclude(fingerprint=package.fingerprint)
+        .exclude(id__in=package.patches.values_list("base_id", flat=True))
+        .order_by("-package_id")[: settings.PACKAGE_PATCH_BASES]
+    )
+    if not bases:
+        return
+    new = open_package_file(package)
+    try:
+        for base in bases:
+            old = open_package_file(base)
+            with tempfile.TemporaryFile() as data:
+                try:
+                    size = make_patch(
+                        old,
+                        new,
+                        data,
+                        package.fingerprint,
+                        package.size * MAX_PATCH_RATIO,
+                    )
+                except PatchError:
+                    continue
+                finally:
+                    old.close()
+                patch = PackagePatch(package=package, base=base, size=size)
+                data.seek(0)
+                patch.file.save("patch", File(data), save=False)
+            try:
+                with transaction.atomic():
+                    patch.save()
+            except IntegrityError:
+                patch.file.delete(save=False)
+    finally:
+        new.close()
+
+
+def get_package_patch(package, version):
+    """
+    Return the patch to the package from the latest package of `version`.
+    """
+    patch = (
+        package.patches.filter(base__version=version)
+        .select_related("base")
+        .order_by("-base__package_id")
+        .first()
+    )
+    if patch is None:
+        return None
+    return PackagePatchSerializer(patch).data
+
+
+def create_package(
+    operator_content_object,
+    universal_app,
+    file,
+    commit_id="",
+    description="",
+    channel="",
+    build_type="Debug",
+    pkg=None,
+):
+    with span("package.create", size=file.size) as s:
+        if pkg is None:
+            pkg = parse_package(universal_app, file)
+        s.set(parser=type(pkg).__name__)
+        app = get_package_app(universal_app, pkg)
+        package_id = Counter.next_value(universal_app, "package")
+        instance = build_package(
+            operator_content_object,
+            app,
+            file,
+            pkg,
+            package_id,
+            commit_id,
+            description,
+            channel,
+            build_type,
+        )
+        try:
+            store_package_files(instance)
+            instance.save()
+        except:  # noqa: E722
+            discard_package(instance)
+            raise
+        finish_package(instance, pkg)
     return instance
 
 
 class UserAppPackageUpload(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = package_upload_handlers(request)
+        return super().initialize_request(request, *args, **kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            discard_uploaded_files(request)
+
     def get_namespace(self, namespace):
         return Namespace.user(namespace)
 
@@ -396,6 +665,122 @@ class TokenAppPackageUpload(UserAppPackageUpload):
         return response
 
 
+class TokenAppPackageBatchUpload(TokenAppPackageUpload):
+    """
+    Upload several packages of an app, e.g. the channel builds of one
+    commit, in a single request.
+
+    Parsing and storage writes run in a thread pool while every database
+    write stays on the request thread. The packages get consecutive
+    package ids and the response has one result per file, in order.
+
+    Package ids are allocated for the files that parse, before their files
+    are stored, as the storage paths contain them. A file failing to store
+    or save gets an error of its own and leaves its id unused, so the ids of
+    one batch may have gaps.
+    """
+
+    def run_in_threads(self, func, items):
+        """
+        Return {index: result} and {index: error detail} of func(item).
+        """
+        results = {}
+        errors = {}
+        workers = settings.PACKAGE_BATCH_WORKERS
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {i: executor.submit(func, item) for i, item in items.items()}
+            for i, future in futures.items():
+                try:
+                    results[i] = future.result()
+                except serializers.ValidationError as e:
+                    errors[i] = e.detail
+                except:  # noqa: E722
+                    logger.exception("Can not process package %d of the batch", i)
+                    errors[i] = {"message": "Can not process the package."}
+        return results, errors
+
+    def post(self, request):
+        serializer = BatchUploadPackageSerializer(data=request.data)
+        if not serializer.is_valid():
+            raise serializers.ValidationError(serializer.errors)
+        app = request.token.app
+        files = serializer.validated_data["file"]
+        channels = serializer.validated_data.get("channel") or [""] * len(files)
+        commit_id = serializer.validated_data.get("commit_id", "")
+        description = serializer.validated_data.get("description", "")
+        build_type = serializer.validated_data.get("build_type", "Debug")
+        # Load what the storage paths are built from before the threads run.
+        namespace = self.get_namespace(app).path
+
+        cached = {}
+        uncached = {}
+        for i, file in enumerate(files):
+            fingerprint = getattr(file, "fingerprint", "")
+            cached[i] = PackageParseCache.lookup(app, fingerprint, file.size)
+            if cached[i] is None:
+                del cached[i]
+                uncached[i] = file
+        pkgs, errors = self.run_in_threads(parse_package_file, uncached)
+        pkgs.update(cached)
+
+        apps = {}
+        for i in list(pkgs):
+            try:
+                apps[i] = get_package_app(app, pkgs[i])
+                apps[i].universal_app = app
+            except serializers.ValidationError as e:
+                errors[i] = e.detail
+                del pkgs[i]
+
+        instances = {}
+        if pkgs:
+            package_id = Counter.next_value(app, "package", len(pkgs))
+            for offset, i in enumerate(sorted(pkgs)):
+                instances[i] = build_package(
+                    request.token,
+                    apps[i],
+                    files[i],
+                    pkgs[i],
+                    package_id + offset,
+                    commit_id,
+                    description,
+                    channels[i],
+                    build_type,
+                )
+        _, store_errors = self.run_in_threads(store_package_files, instances)
+        errors.update(store_errors)
+        for i in store_errors:
+            discard_package(instances[i])
+
+        context = {
+            "plist_url_name": self.plist_url_name(app),
+            "namespace": namespace,
+            "path": app.path,
+        }
+        results = []
+        for i, file in enumerate(files):
+            name = getattr(file, "original_name", file.name)
+            if i in errors:
+                results.append({"file": name, "error": errors[i]})
+                continue
+            instance = instances[i]
+            try:
+                with transaction.atomic():
+                    instance.save()
+            except:  # noqa: E722
+                # The packages saved before it are kept and published.
+                logger.exception("Can not save package %d of the batch", i)
+                discard_package(instance)
+                results.append(
+                    {"file": name, "error": {"message": "Can not save the package."}}
+                )
+                continue
+            finish_package(instance, pkgs[i])
+            serializer = PackageSerializer(instance, context=context)
+            results.append({"file": name, "data": serializer.data})
+        return Response({"results": results})
+
+
 class RequestUploadPackage(APIView):
     permission_classes = [UploadPackagePermission]
 
@@ -409,8 +794,23 @@ class RequestUploadPackage(APIView):
         commit_id = serializer.validated_data.get("commit_id", "")
         build_type = serializer.validated_data.get("build_type", "Debug")
         channel = serializer.validated_data.get("channel", "")
+        md5 = serializer.validated_data.get("md5", "").lower()
+        size = serializer.validated_data.get("size", None)
 
-        ret = default_storage.request_upload_url(app.install_slug, filename)
+        multipart = serializer.validated_data["multipart"] and hasattr(
+            default_storage, "request_multipart_upload"
+        )
+        if (multipart or hasattr(default_storage, "open_movable")) and size is None:
+            raise serializers.ValidationError({"size": "This field is required."})
+        if multipart:
+            ret = default_storage.request_multipart_upload(
+                app.install_slug,
+                filename,
+                size,
+                serializer.validated_data.get("part_size", None),
+            )
+        else:
+            ret = default_storage.request_upload_url(app.install_slug, filename, md5)
         data = {
             "type": "package",
             "file": ret["file"],
@@ -419,8 +819,14 @@ class RequestUploadPackage(APIView):
             "build_type": build_type,
             "channel": channel,
             "uploader_type": "token",
-            "uploader_id": request.token.id
+            "uploader_id": request.token.id,
+            "md5": md5,
+            "size": size,
         }
+        if hasattr(default_storage, "open_movable"):
+            data["chunks"] = []
+        if multipart:
+            data["upload_id"] = ret["upload_id"]
         instance = FileUploadRecord.objects.create(
             universal_app=app,
             data=data
@@ -430,8 +836,113 @@ class RequestUploadPackage(APIView):
         return Response(ret)
 
 
+def open_uploaded_file(name, md5=""):
+    # Object storages read the package with ranged requests, so parsing only
+    # fetches the parts of the archive it needs.
+    # The local storage moves assembled chunk uploads into place instead.
+    if hasattr(default_storage, "open_ranged"):
+        file = default_storage.open_ranged(name)
+    elif hasattr(default_storage, "open_movable"):
+        file = default_storage.open_movable(name)
+    else:
+        file = default_storage.open(name)
+    # Take the fingerprint from the checksum the storage verified on upload.
+    # Without one, Package.save hashes the file.
+    checksum = None
+    if hasattr(default_storage, "checksum"):
+        checksum = default_storage.checksum(name)
+    if checksum and md5 and checksum != md5:
+        file.close()
+        raise serializers.ValidationError(
+            {"message": "The uploaded file does not match md5."}
+        )
+    file.fingerprint = checksum or ""
+    return file
+
+
+def process_upload_record(record_id):
+    """
+    Create the package of a direct upload, recording progress in the state of
+    the FileUploadRecord. Runs in the background worker.
+    """
+    record = FileUploadRecord.objects.select_related("universal_app").get(
+        id=record_id
+    )
+    if record.package_id is not None:
+        # Already done by an earlier run of the job.
+        return
+    extra = record.data
+    file = None
+    try:
+        record.state = FileUploadRecord.State.Parsing
+        record.save(update_fields=["state", "update_time"])
+        if extra.get("upload_id"):
+            # Assemble the parts the client uploaded directly to the bucket.
+            default_storage.complete_multipart_upload(
+                extra["file"], extra["upload_id"]
+            )
+            del extra["upload_id"]
+            record.save(update_fields=["data", "update_time"])
+        file = open_uploaded_file(extra["file"], extra.get("md5", ""))
+        pkg = parse_package(record.universal_app, file)
+        record.state = FileUploadRecord.State.Storing
+        record.save(update_fields=["state", "update_time"])
+        uploader = AppAPIToken.objects.get(id=extra["uploader_id"])
+        instance = create_package(
+            uploader,
+            record.universal_app,
+            file,
+            extra.get("commit_id", ""),
+            extra.get("description", ""),
+            extra.get("channel", ""),
+            extra.get("build_type", "Debug"),
+            pkg=pkg,
+        )
+    except serializers.ValidationError as e:
+        message = e.detail.get("message", "") if isinstance(e.detail, dict) else ""
+        fail_upload_record(record, str(message or e.detail))
+    except parser.PARSE_ERRORS:
+        # Fields of a package are read when it is created, not only when it
+        # is parsed.
+        fail_upload_record(record, "Can not parse the package.")
+    except:  # noqa: E722
+        logger.exception("Can not process upload record %d", record.id)
+        attempts = extra.get("attempts", 0) + 1
+        if attempts < settings.JOB_MAX_ATTEMPTS:
+            # An error of the storage or the database may pass, the job runs
+            # the record again and its uploaded file is kept for it.
+            extra["attempts"] = attempts
+            record.state = FileUploadRecord.State.Queued
+            record.save(update_fields=["state", "data", "update_time"])
+            raise
+        fail_upload_record(record, "Internal error while processing the package.")
+    else:
+        record.package = instance
+        record.state = FileUploadRecord.State.Completed
+        record.save(update_fields=["package", "state", "update_time"])
+    finally:
+        if file is not None:
+            file.close()
+    # The uploaded file is not needed once the package is created, and a
+    # failed record is not retried.
+    try:
+        default_storage.delete(extra["file"])
+    except:   # noqa: E722
+        pass
+
+
+def fail_upload_record(record, error):
+    record.state = FileUploadRecord.State.Failed
+    record.error = error[:1024]
+    record.save(update_fields=["state", "error", "update_time"])
+
+
 class CheckUploadPackage(APIView):
     permission_classes = [UploadPackagePermission]
+    # Upper bound of the long-poll ?wait= seconds. A waiting request holds a
+    # thread of the web server, clients poll again rather than wait longer.
+    max_wait = 5
+    poll_interval = 0.5
 
     def plist_url_name(self, app):
         if app.owner:
@@ -439,13 +950,26 @@ class CheckUploadPackage(APIView):
         elif app.org:
             return "org-app-package-plist"
 
-    def get(self, request, record_id):
-        app = request.token.app
+    def get_object(self, app, record_id):
         try:
-            record = FileUploadRecord.objects.get(id=record_id, universal_app=app)
+            return FileUploadRecord.objects.get(id=record_id, universal_app=app)
         except FileUploadRecord.DoesNotExist:
             raise Http404
 
+    def is_finished(self, record):
+        return record.package_id is not None or record.state in (
+            FileUploadRecord.State.Completed,
+            FileUploadRecord.State.Failed,
+        )
+
+    def wait(self, record, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.is_finished(record) and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            record.refresh_from_db(fields=["state", "error", "package"])
+        return record
+
+    def response(self, app, record):
         if record.package:
             namespace = ""
             if app.owner:
@@ -462,70 +986,162 @@ class CheckUploadPackage(APIView):
                 "status": "completed",
                 "data": serializer.data
             }
+        elif record.state == FileUploadRecord.State.Failed:
+            data = {
+                "status": "failed",
+                "error": {"message": record.error}
+            }
         else:
             data = {
-                "status": "waiting"  # expired
+                "status": record.State(record.state).label.lower()
             }
-
         return Response(data)
 
+    def get(self, request, record_id):
+        app = request.token.app
+        record = self.get_object(app, record_id)
+        try:
+            seconds = min(float(request.GET.get("wait", 0)), self.max_wait)
+        except ValueError:
+            seconds = 0
+        if seconds > 0:
+            record = self.wait(record, seconds)
+        return self.response(app, record)
+
     def post(self, request, record_id):
         app = request.token.app
+        record = self.get_object(app, record_id)
+        if record.package_id is None and not chunks_complete(record.data):
+            raise serializers.ValidationError(
+                {"message": "The chunk upload is not complete."}
+            )
+        # Queue the record once. A failed record keeps its error, its file is
+        # deleted and the package has to be uploaded again.
+        queued = FileUploadRecord.objects.filter(
+            id=record.id,
+            package__isnull=True,
+            state=FileUploadRecord.State.Uploaded,
+        ).update(
+            state=FileUploadRecord.State.Queued, error="", update_time=timezone.now()
+        )
+        if queued:
+            run_in_background(process_upload_record, record.id)
+            record.refresh_from_db()
+        return self.response(app, record)
+
+
+def merge_chunk(ranges, start, end):
+    """
+    Add [start, end) to a sorted list of disjoint [start, end) ranges.
+    """
+    merged = []
+    for s, e in sorted(ranges + [[start, end]]):
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return merged
+
+
+def chunk_overlaps(ranges, start, end):
+    return any(s < end and start < e for s, e in ranges)
+
+
+def chunks_complete(extra):
+    if "chunks" not in extra:
+        return True
+    return extra["chunks"] == [[0, extra["size"]]]
+
+
+class UploadPackageChunk(APIView):
+    """
+    Resumable chunk upload of a direct upload record into the local storage.
+
+    Chunks are PUT as the raw request body with their byte offset in
+    ?offset=, in any order and in parallel, and written straight into the
+    reserved file. A chunk overlapping the received ranges is rejected. GET
+    returns the received ranges so an interrupted upload only sends what is
+    missing.
+    """
+
+    permission_classes = [UploadPackagePermission]
+    buffer_size = 1024 * 1024
+
+    def get_object(self, app, record_id):
         try:
             record = FileUploadRecord.objects.get(id=record_id, universal_app=app)
         except FileUploadRecord.DoesNotExist:
             raise Http404
+        if "chunks" not in record.data:
+            raise serializers.ValidationError(
+                {"message": "Chunk upload is not supported for this record."}
+            )
+        return record
 
-        if record.package:
-            namespace = ""
-            if app.owner:
-                namespace = app.owner.username
-            elif app.org:
-                namespace = app.org.path
-            context = {
-                "plist_url_name": self.plist_url_name(app),
-                "namespace": namespace,
-                "path": app.path,
-            }
-            serializer = PackageSerializer(record.package, context=context)
-            data = {
-                "status": "completed",
-                "data": serializer.data
-            }
-        else:
-            extra = record.data
-            file = default_storage.open(extra["file"])
-            commit_id = extra.get("commit_id", "")
-            description = extra.get("description", "")
-            build_type = extra.get("build_type", "Debug")
-            channel = extra.get("channel", "")
-            uploader = AppAPIToken.objects.get(id=extra["uploader_id"])
-            instance = create_package(
-                uploader, app, file, commit_id, description, channel, build_type
+    def response(self, record):
+        ranges = record.data.get("chunks", [])
+        offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+        return Response(
+            {"size": record.data["size"], "offset": offset, "received": ranges}
+        )
+
+    def get(self, request, record_id):
+        record = self.get_object(request.token.app, record_id)
+        return self.response(record)
+
+    def put(self, request, record_id):
+        record = self.get_object(request.token.app, record_id)
+        if record.package_id or record.state != FileUploadRecord.State.Uploaded:
+            raise serializers.ValidationError(
+                {"message": "The upload is already being processed."}
             )
-            record.package = instance
-            try:
-                default_storage.delete(extra["file"])
-            except:   # noqa: E722
-                pass
-            record.save()
-            namespace = ""
-            if app.owner:
-                namespace = app.owner.username
-            elif app.org:
-                namespace = app.org.path
-            context = {
-                "plist_url_name": self.plist_url_name(app),
-                "namespace": namespace,
-                "path": app.path,
-            }
-            serializer = PackageSerializer(instance, context=context)
-            data = {
-                "status": "completed",
-                "data": serializer.data
-            }
+        size = record.data["size"]
+        try:
+            offset = int(request.GET.get("offset", 0))
+        except ValueError:
+            offset = -1
+        if offset < 0 or offset >= size:
+            raise serializers.ValidationError({"offset": "Out of range."})
 
-        return Response(data)
+        try:
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        if length <= 0:
+            raise serializers.ValidationError({"message": "Empty chunk."})
+        end = offset + length
+        if end > size:
+            raise serializers.ValidationError(
+                {"message": "The chunk exceeds the file size."}
+            )
+        if chunk_overlaps(record.data["chunks"], offset, end):
+            raise serializers.ValidationError(
+                {"message": "The chunk overlaps bytes already received."}
+            )
+
+        written = offset
+        with open(default_storage.path(record.data["file"]), "r+b") as f:
+            f.seek(offset)
+            while written < end:
+                data = request.read(min(self.buffer_size, end - written))
+                if not data:
+                    break
+                f.write(data)
+                written += len(data)
+        if written != end:
+            raise serializers.ValidationError({"message": "Incomplete chunk."})
+
+        with transaction.atomic():
+            record = FileUploadRecord.objects.select_for_update().get(id=record.id)
+            # A concurrent PUT of the same bytes got there first. The md5 of
+            # the assembled file is checked when the package is processed.
+            if chunk_overlaps(record.data["chunks"], offset, end):
+                raise serializers.ValidationError(
+                    {"message": "The chunk overlaps bytes already received."}
+                )
+            record.data["chunks"] = merge_chunk(record.data["chunks"], offset, end)
+            record.save(update_fields=["data", "update_time"])
+        return self.response(record)
 
 
 class UserAppPackageDetail(APIView):
@@ -556,7 +1172,12 @@ class UserAppPackageDetail(APIView):
             "path": path,
         }
         serializer = PackageSerializer(package, context=context)
-        return Response(serializer.data)
+        data = serializer.data
+        version = request.GET.get("version", None)
+        if version:
+            # The client has this version installed, offer a patch from it.
+            data["patch"] = get_package_patch(package, version)
+        return Response(data)
 
     def put(self, request, namespace, path, package_id):
         app, role = check_app_manager_permission(
@@ -672,6 +1293,7 @@ class UserAppReleaseList(APIView):
             "plist_url_name": self.plist_url_name(),
             "namespace": namespace,
             "path": path,
+            "icon_size": get_icon_size(request),
         }
         serializer = ReleaseSerializer(releases, many=True, context=context)
         headers = {"X-Total-Count": count}
@@ -903,16 +1525,16 @@ class OrganizationStoreAppYingyongbao(UserStoreAppYingyongbao):
         return Namespace.organization(path)
 
 
-def update_store_app_current_version(store_app):
+def fetch_store_version(store_app):
+    # Runs in a thread, only talks to the store.
     store = get_store(store_app.store)(store_app.auth_data)
-    try:
-        data = store.store_current()
-        version = data["version"]
-        if not version:
-            return None
-    except:  # noqa: E722
-        return None
+    version = store.store_current()["version"]
+    if not version:
+        raise ValueError("The store did not return a version.")
+    return version
+
 
+def record_store_version(store_app, version):
     try:
         ret = StoreAppVersionRecord.objects.get(
             app=store_app.app,
@@ -924,9 +1546,38 @@ def update_store_app_current_version(store_app):
             app=store_app.app,
             store=store_app.store,
             short_version=version)
+        publish("store_state_change", store_app.app.universal_app_id, ret.id)
     return ret
 
 
+def refresh_store_versions(store_apps):
+    """
+    Ask the stores for the current versions at the same time, giving them
+    STORE_TIMEOUT seconds. Return (store_app, StoreAppVersionRecord, error) of
+    every store app, the record None when the store failed.
+    """
+    if not store_apps:
+        return []
+    executor = ThreadPoolExecutor(max_workers=len(store_apps))
+    futures = [executor.submit(fetch_store_version, x) for x in store_apps]
+    done, not_done = wait(futures, timeout=settings.STORE_TIMEOUT)
+    # A store still running keeps its thread until its requests time out.
+    executor.shutdown(wait=False)
+    results = []
+    for store_app, future in zip(store_apps, futures):
+        if future in not_done:
+            error = "The store did not answer in %g seconds." % settings.STORE_TIMEOUT
+            results.append((store_app, None, error))
+        elif future.exception() is not None:
+            e = future.exception()
+            error = ("%s: %s" % (type(e).__name__, e))[:256]
+            results.append((store_app, None, error))
+        else:
+            version = future.result()
+            results.append((store_app, record_store_version(store_app, version), ""))
+    return results
+
+
 class UserStoreAppCurrentVersion(APIView):
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -967,19 +1618,27 @@ class UserStoreAppCurrentVersion(APIView):
             StoreType.Yingyongbao
         ]
 
-        versions = []
-        for store in stores:
-            try:
-                store_app = StoreApp.objects.get(app__universal_app=app, store=store)
-            except StoreApp.DoesNotExist:
-                continue
-
-            ret = update_store_app_current_version(store_app)
-            if ret:
-                versions.append(ret)
+        store_apps = StoreApp.objects.filter(
+            app__universal_app=app, store__in=stores
+        ).select_related("app")
+        store_apps = sorted(store_apps, key=lambda x: stores.index(x.store))
 
-        serializer = StoreAppVersionSerializer(versions, many=True)
-        return Response(serializer.data)
+        # The versions the stores answered with, and the errors of the others.
+        data = []
+        for store_app, ret, error in refresh_store_versions(store_apps):
+            if ret is not None:
+                data.append(StoreAppVersionSerializer(ret).data)
+                continue
+            store = get_store(store_app.store)
+            data.append(
+                {
+                    "store": store.name(),
+                    "display_name": store.display_name(),
+                    "icon_file": store.icon(),
+                    "error": error,
+                }
+            )
+        return Response(data)
 
 
 class OrganizationStoreAppCurrentVersion(UserStoreAppCurrentVersion):
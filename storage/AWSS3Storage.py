@@ -1,18 +1,58 @@
 import os.path
 import random
+import re
 import string
 
 from django.conf import settings
 from django.utils import timezone
 from storages.backends.s3boto3 import S3Boto3Storage, S3Boto3StorageFile
+from storages.utils import clean_name
 
+from storage.RangeFile import RangeFile
+from util.span import span
+from util.storage import MIN_UPLOAD_PART_SIZE, upload_part_size
 from util.url import get_file_extension
 
 
+class AWSS3UploadWriter:
+    """
+    Streams a file into a multipart upload through a writable storage file,
+    which uploads a part whenever its buffer is full.
+    """
+
+    def __init__(self, storage, name, part_size):
+        self.storage = storage
+        self.name = name
+        self.file = storage._open(name, "wb")
+        self.file.buffer_size = part_size
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        return self.storage.open_ranged(self.name)
+
+    def abort(self):
+        # Closing the file would complete the upload, drop it instead.
+        if self.file._multipart is not None:
+            self.file._multipart.abort()
+        if self.file._file is not None:
+            self.file._file.close()
+
+
 class AWSS3MediaStorage(S3Boto3Storage):
 
     def _save(self, name, content):
-        cleaned_name = self._clean_name(name)
+        with span("storage.save", storage="AmazonAWSS3", size=content.size):
+            return self._save_object(name, content)
+
+    def _open(self, name, mode="rb"):
+        with span("storage.open", storage="AmazonAWSS3"):
+            return super()._open(name, mode)
+
+    def _save_object(self, name, content):
+        cleaned_name = clean_name(name)
         name = self._normalize_name(cleaned_name)
 
         if isinstance(content, S3Boto3StorageFile):
@@ -20,7 +60,8 @@ class AWSS3MediaStorage(S3Boto3Storage):
                 "Bucket": self.bucket.name,
                 "Key": os.path.join(self.location, content.name)
             }
-            self.bucket.copy(copy_source, name)
+            # Managed copy, done with multipart copy for big objects.
+            self.bucket.copy(copy_source, name, Config=self.transfer_config)
             return cleaned_name
 
         params = self._get_write_parameters(name, content)
@@ -33,15 +74,64 @@ class AWSS3MediaStorage(S3Boto3Storage):
             params['ContentEncoding'] = 'gzip'
 
         obj = self.bucket.Object(name)
-        obj.upload_fileobj(content, ExtraArgs=params, Config=self._transfer_config)  # noqa: E501
+        obj.upload_fileobj(content, ExtraArgs=params, Config=self.transfer_config)  # noqa: E501
+        return cleaned_name
+
+    def save_immutable(self, name, content):
+        """
+        Save a file whose name is derived from its content, so browsers and
+        CDNs may cache it for good.
+        """
+        cleaned_name = clean_name(name)
+        name = self._normalize_name(cleaned_name)
+        params = self._get_write_parameters(name, content)
+        params["CacheControl"] = settings.IMMUTABLE_CACHE_CONTROL
+        content.seek(0, os.SEEK_SET)
+        obj = self.bucket.Object(name)
+        obj.upload_fileobj(content, ExtraArgs=params, Config=self.transfer_config)  # noqa: E501
         return cleaned_name
 
-    def request_upload_url(self, slug, filename):
+    def open_ranged(self, name):
+        """
+        Open an object for reading with ranged GETs instead of downloading it.
+        """
+        file = self._open(name, "rb")
+        obj = file.obj
+
+        def open_range(start, end):
+            byte_range = "bytes=%d-%s" % (start, "" if end is None else end)
+            return obj.get(Range=byte_range)["Body"]
+
+        file._file = RangeFile(obj.key, obj.content_length, open_range)
+        return file
+
+    def checksum(self, name):
+        """
+        Return the MD5 hex digest of the object from its ETag, or None when the
+        ETag is not an MD5 (multipart uploads, KMS or customer key encryption).
+        """
+        obj = self._open(name, "rb").obj
+        etag = obj.e_tag.strip('"').lower()
+        if obj.server_side_encryption == "aws:kms" or obj.sse_customer_algorithm:
+            return None
+        if re.fullmatch("[0-9a-f]{32}", etag):
+            return etag
+        return None
+
+    def _temp_upload_name(self, slug, filename):
         ext = get_file_extension(filename, "zip")
         name = str(timezone.make_aware(timezone.make_naive(timezone.now())))[:19]  # noqa: E501
         suffix = "".join(random.choices(string.ascii_letters, k=4))
         name = name.replace(' ', 'T').replace(':', '-') + '-' + suffix + '.' + ext  # noqa: E501
-        name = os.path.join("temp/upload", slug, name)
+        return os.path.join("temp/upload", slug, name)
+
+    def open_upload_writer(self, slug, filename, size=None):
+        name = self._temp_upload_name(slug, filename)
+        part_size = upload_part_size(size or 0, MIN_UPLOAD_PART_SIZE)
+        return AWSS3UploadWriter(self, name, part_size)
+
+    def request_upload_url(self, slug, filename, md5=None):
+        name = self._temp_upload_name(slug, filename)
         object_name = os.path.join(self.location, name)
 
         expire_seconds = 60 * 60
@@ -56,3 +146,56 @@ class AWSS3MediaStorage(S3Boto3Storage):
             ExpiresIn=expire_seconds)
         response["file"] = name
         return response
+
+    def request_multipart_upload(self, slug, filename, size, part_size=None):
+        """
+        Start a multipart upload and presign an upload_part url for every
+        part, so the client can upload the parts in parallel.
+        """
+        name = self._temp_upload_name(slug, filename)
+        object_name = os.path.join(self.location, name)
+        client = self.bucket.meta.client
+        params = {"Bucket": self.bucket.name, "Key": object_name}
+        if settings.AWS_STORAGE_PUBLIC_READ:
+            params["ACL"] = "public-read"
+        upload_id = client.create_multipart_upload(**params)["UploadId"]
+        part_size = upload_part_size(size, part_size)
+        expire_seconds = 60 * 60 * 24
+        parts = []
+        for part_number in range(1, -(-size // part_size) + 1):
+            url = client.generate_presigned_url(
+                "upload_part",
+                Params={
+                    "Bucket": self.bucket.name,
+                    "Key": object_name,
+                    "UploadId": upload_id,
+                    "PartNumber": part_number,
+                },
+                ExpiresIn=expire_seconds)
+            parts.append({"part_number": part_number, "upload_url": url})
+        return {
+            "file": name,
+            "upload_id": upload_id,
+            "part_size": part_size,
+            "parts": parts,
+            "expire_seconds": expire_seconds
+        }
+
+    def complete_multipart_upload(self, name, upload_id):
+        object_name = os.path.join(self.location, name)
+        client = self.bucket.meta.client
+        paginator = client.get_paginator("list_parts")
+        parts = []
+        pages = paginator.paginate(
+            Bucket=self.bucket.name, Key=object_name, UploadId=upload_id
+        )
+        for page in pages:
+            for part in page.get("Parts", []):
+                parts.append(
+                    {"ETag": part["ETag"], "PartNumber": part["PartNumber"]}
+                )
+        client.complete_multipart_upload(
+            Bucket=self.bucket.name,
+            Key=object_name,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts})
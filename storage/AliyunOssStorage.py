@@ -1,7 +1,9 @@
+import base64
 import json
 import os.path
 import posixpath
 import random
+import re
 import shutil
 import string
 import tempfile
@@ -21,8 +23,16 @@ try:
 except:  # noqa: E722
     pass
 
+from storage.RangeFile import RangeFile
+from util.span import span
+from util.storage import MIN_UPLOAD_PART_SIZE, upload_part_size
 from util.url import get_file_extension
 
+# OSS copy_object only copies objects up to 1 GB, bigger objects are copied
+# part by part.
+COPY_OBJECT_LIMIT = 1024 * 1024 * 1024
+COPY_PART_SIZE = 128 * 1024 * 1024
+
 
 class AliyunOssFile(File):
     """
@@ -39,6 +49,50 @@ class AliyunOssFile(File):
         return super(AliyunOssFile, self).open(mode)
 
 
+class AliyunOssUploadWriter:
+    """
+    Streams a file into a multipart upload, holding at most one part in
+    memory.
+    """
+
+    def __init__(self, storage, name, part_size):
+        self.storage = storage
+        self.name = name
+        self.key = storage._get_key_name(name)
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        headers = None
+        if storage.public_read:
+            headers = {
+                'x-oss-object-acl': oss2.OBJECT_ACL_PUBLIC_READ
+            }
+        self.upload_id = storage.bucket.init_multipart_upload(self.key, headers=headers).upload_id  # noqa: E501
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        result = self.storage.bucket.upload_part(
+            self.key, self.upload_id, part_number, bytes(self.buffer)
+        )
+        self.parts.append(oss2.models.PartInfo(part_number, result.etag))
+        self.buffer.clear()
+
+    def close(self):
+        if self.buffer or not self.parts:
+            self._upload_part()
+        self.storage.bucket.complete_multipart_upload(self.key, self.upload_id, self.parts)  # noqa: E501
+        return self.storage.open_ranged(self.name)
+
+    def abort(self):
+        self.buffer.clear()
+        self.storage.bucket.abort_multipart_upload(self.key, self.upload_id)
+
+
 def _to_posix_path(name):
     return name.replace(os.sep, "/")
 
@@ -69,18 +123,33 @@ class AliyunOssStorage(Storage):
             raise ValueError("OSS files can only be opened in read-only mode")
 
         target_name = self._get_key_name(name)
-        tmpf = tempfile.TemporaryFile()
-        obj = self.bucket.get_object(target_name)
-
-        if obj.content_length is None:
-            shutil.copyfileobj(obj, tmpf)
-        else:
-            oss2.utils.copyfileobj_and_verify(
-                obj, tmpf, obj.content_length, request_id=obj.request_id
-            )
+        with span("storage.open", storage="AlibabaCloudOSS") as s:
+            tmpf = tempfile.TemporaryFile()
+            obj = self.bucket.get_object(target_name)
+            s.set(size=obj.content_length)
+
+            if obj.content_length is None:
+                shutil.copyfileobj(obj, tmpf)
+            else:
+                oss2.utils.copyfileobj_and_verify(
+                    obj, tmpf, obj.content_length, request_id=obj.request_id
+                )
         tmpf.seek(0)
         return AliyunOssFile(tmpf, target_name, self)
 
+    def open_ranged(self, name):
+        """
+        Open an object for reading with ranged GETs instead of downloading it.
+        """
+        target_name = self._get_key_name(name)
+        size = self.bucket.head_object(target_name).content_length
+
+        def open_range(start, end):
+            return self.bucket.get_object(target_name, byte_range=(start, end))
+
+        file = RangeFile(target_name, size, open_range)
+        return AliyunOssFile(file, target_name, self)
+
     def _save(self, name, content):
         target_name = self._get_key_name(name)
         headers = None
@@ -88,13 +157,65 @@ class AliyunOssStorage(Storage):
             headers = {
                 'x-oss-object-acl': oss2.OBJECT_ACL_PUBLIC_READ
             }
-        if isinstance(content, AliyunOssFile):
-            self.bucket.copy_object(self.bucket_name, content.name, target_name, headers=headers)  # noqa: E501
-        else:
-            content.file.seek(0)
-            self.bucket.put_object(target_name, content.file, headers=headers)
+        with span("storage.save", storage="AlibabaCloudOSS", size=content.size):
+            if isinstance(content, AliyunOssFile):
+                self._copy_object(content.name, target_name, content.size, headers)
+            else:
+                content.file.seek(0)
+                self.bucket.put_object(target_name, content.file, headers=headers)
         return os.path.normpath(name)
 
+    def save_immutable(self, name, content):
+        """
+        Save a file whose name is derived from its content, so browsers and
+        CDNs may cache it for good.
+        """
+        target_name = self._get_key_name(name)
+        headers = {"Cache-Control": settings.IMMUTABLE_CACHE_CONTROL}
+        if self.public_read:
+            headers['x-oss-object-acl'] = oss2.OBJECT_ACL_PUBLIC_READ
+        content.seek(0)
+        self.bucket.put_object(target_name, content.file, headers=headers)
+        return os.path.normpath(name)
+
+    def _copy_object(self, source_key, target_key, size, headers=None):
+        if size is None or size <= COPY_OBJECT_LIMIT:
+            self.bucket.copy_object(self.bucket_name, source_key, target_key, headers=headers)  # noqa: E501
+            return
+        upload_id = self.bucket.init_multipart_upload(target_key, headers=headers).upload_id  # noqa: E501
+        parts = []
+        try:
+            for start in range(0, size, COPY_PART_SIZE):
+                end = min(start + COPY_PART_SIZE, size) - 1
+                part_number = len(parts) + 1
+                result = self.bucket.upload_part_copy(
+                    self.bucket_name,
+                    source_key,
+                    (start, end),
+                    target_key,
+                    upload_id,
+                    part_number,
+                )
+                parts.append(oss2.models.PartInfo(part_number, result.etag))
+            self.bucket.complete_multipart_upload(target_key, upload_id, parts)
+        except:  # noqa: E722
+            self.bucket.abort_multipart_upload(target_key, upload_id)
+            raise
+
+    def checksum(self, name):
+        """
+        Return the MD5 hex digest OSS stored for the object, or None when the
+        object was not uploaded in one piece.
+        """
+        meta = self.bucket.head_object(self._get_key_name(name))
+        content_md5 = meta.headers.get("Content-MD5")
+        if content_md5:
+            return base64.b64decode(content_md5).hex()
+        etag = (meta.etag or "").lower()
+        if meta.object_type == "Normal" and re.fullmatch("[0-9a-f]{32}", etag):
+            return etag
+        return None
+
     def delete(self, name):
         self.bucket.delete_object(self._get_key_name(name))
 
@@ -150,21 +271,70 @@ class AliyunOssStorage(Storage):
 
     get_created_time = get_accessed_time = get_modified_time
 
-    def request_upload_url(self, slug, filename):
+    def _temp_upload_name(self, slug, filename):
         ext = get_file_extension(filename, "zip")
         name = str(timezone.make_aware(timezone.make_naive(timezone.now())))[:19]  # noqa: E501
         suffix = "".join(random.choices(string.ascii_letters, k=4))
         name = name.replace(' ', 'T').replace(':', '-') + '-' + suffix + '.' + ext  # noqa: E501
-        name = os.path.join("temp/upload", slug, name)
+        return os.path.join("temp/upload", slug, name)
+
+    def open_upload_writer(self, slug, filename, size=None):
+        name = self._temp_upload_name(slug, filename)
+        part_size = upload_part_size(size or 0, MIN_UPLOAD_PART_SIZE)
+        return AliyunOssUploadWriter(self, name, part_size)
+
+    def request_upload_url(self, slug, filename, md5=None):
+        name = self._temp_upload_name(slug, filename)
         object_name = os.path.join(self.key_prefix, name)
         expire_seconds = 60 * 60
-        url = self.bucket.sign_url('PUT', object_name, expire_seconds, slash_safe=True)
+        headers = {}
+        if md5:
+            # OSS rejects the PUT unless the body matches the signed checksum.
+            headers["Content-MD5"] = base64.b64encode(bytes.fromhex(md5)).decode()
+        url = self.bucket.sign_url('PUT', object_name, expire_seconds, headers=headers, slash_safe=True)  # noqa: E501
         return {
             "upload_url": url,
+            "headers": headers,
             "file": name,
             "expire_seconds": expire_seconds
         }
 
+    def request_multipart_upload(self, slug, filename, size, part_size=None):
+        """
+        Start a multipart upload and sign a PUT url for every part, so the
+        client can upload the parts in parallel.
+        """
+        name = self._temp_upload_name(slug, filename)
+        object_name = os.path.join(self.key_prefix, name)
+        headers = None
+        if self.public_read:
+            headers = {
+                'x-oss-object-acl': oss2.OBJECT_ACL_PUBLIC_READ
+            }
+        upload_id = self.bucket.init_multipart_upload(object_name, headers=headers).upload_id  # noqa: E501
+        part_size = upload_part_size(size, part_size)
+        expire_seconds = 60 * 60 * 24
+        parts = []
+        for part_number in range(1, -(-size // part_size) + 1):
+            params = {"partNumber": str(part_number), "uploadId": upload_id}
+            url = self.bucket.sign_url('PUT', object_name, expire_seconds, params=params, slash_safe=True)  # noqa: E501
+            parts.append({"part_number": part_number, "upload_url": url})
+        return {
+            "file": name,
+            "upload_id": upload_id,
+            "part_size": part_size,
+            "parts": parts,
+            "expire_seconds": expire_seconds
+        }
+
+    def complete_multipart_upload(self, name, upload_id):
+        object_name = self._get_key_name(name)
+        parts = [
+            oss2.models.PartInfo(part.part_number, part.etag)
+            for part in oss2.PartIterator(self.bucket, object_name, upload_id)
+        ]
+        self.bucket.complete_multipart_upload(object_name, upload_id, parts)
+
     def request_upload(
         self,
         filename,
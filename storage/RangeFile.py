@@ -0,0 +1,146 @@
+import collections
+import io
+
+# Number of consecutive block misses after which reads are considered a
+# sequential scan and served from a single streaming request.
+SEQUENTIAL_BLOCKS = 2
+
+
+class RangeFile(io.RawIOBase):
+    """
+    A read-only, seekable file backed by ranged reads of a remote object.
+
+    `open_range(start, end)` returns a readable stream over the bytes
+    start..end of the object (both inclusive, end is None for the rest of
+    the object). Random reads are served by fixed-size blocks kept in a small
+    LRU cache, so parsing a zip only fetches its central directory and the
+    entries that are actually read. Once reads become sequential the file
+    switches to one streaming request instead of a request per block.
+    """
+
+    def __init__(
+        self, name, size, open_range, block_size=256 * 1024, cache_blocks=32
+    ):
+        super().__init__()
+        self.name = name
+        self.size = size
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self.bytes_fetched = 0
+        self.requests = 0
+        self._open_range = open_range
+        self._blocks = collections.OrderedDict()
+        self._pos = 0
+        self._stream = None
+        self._stream_pos = None
+        self._next_block = None
+        self._sequential = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError("invalid whence (%r)" % whence)
+        if pos < 0:
+            raise ValueError("negative seek position %d" % pos)
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        # zipfile expects read(n) to return n bytes, so fill the whole buffer
+        # even when it spans several blocks.
+        view = memoryview(b).cast("B")
+        total = 0
+        while total < len(view):
+            n = self._readinto(view[total:])
+            if not n:
+                break
+            total += n
+        return total
+
+    def _readinto(self, b):
+        if self._pos >= self.size:
+            return 0
+        n = min(len(b), self.size - self._pos)
+        index = self._pos // self.block_size
+        if index in self._blocks:
+            self._blocks.move_to_end(index)
+            data = self._slice(self._blocks[index], index, n)
+        elif self._stream is not None and self._stream_pos == self._pos:
+            data = self._read_stream(n)
+        else:
+            if index == self._next_block:
+                self._sequential += 1
+            else:
+                self._sequential = 0
+            self._next_block = index + 1
+            if self._sequential >= SEQUENTIAL_BLOCKS:
+                self._start_stream()
+                data = self._read_stream(n)
+            else:
+                data = self._slice(self._fetch_block(index), index, n)
+        b[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def _slice(self, block, index, n):
+        offset = self._pos - index * self.block_size
+        return block[offset : offset + n]
+
+    def _fetch_block(self, index):
+        start = index * self.block_size
+        end = min(start + self.block_size, self.size) - 1
+        stream = self._open_range(start, end)
+        try:
+            block = stream.read()
+        finally:
+            stream.close()
+        self.requests += 1
+        self.bytes_fetched += len(block)
+        if len(block) != end - start + 1:
+            raise IOError("short read from %s at offset %d" % (self.name, start))
+        self._blocks[index] = block
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def _start_stream(self):
+        self._close_stream()
+        self._stream = self._open_range(self._pos, None)
+        self._stream_pos = self._pos
+        self.requests += 1
+
+    def _read_stream(self, n):
+        data = self._stream.read(n)
+        if not data:
+            raise IOError(
+                "unexpected end of %s at offset %d" % (self.name, self._stream_pos)
+            )
+        self._stream_pos += len(data)
+        self.bytes_fetched += len(data)
+        return data
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.close()
+        self._stream = None
+        self._stream_pos = None
+
+    def close(self):
+        if not self.closed:
+            self._close_stream()
+            self._blocks.clear()
+        super().close()
@@ -1,8 +1,17 @@
+import io
 import random
+import struct
 import tempfile
+import zlib
 
 from django.conf import settings
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Renditions generated for package icons, in pixels.
+ICON_SIZES = (48, 96, 192)
+ICON_FORMATS = {"png": "PNG", "webp": "WEBP"}
 
 
 def generate_random_image(size=(128, 128)):
@@ -107,5 +116,74 @@ def generate_logo_image(colors, size=(128, 128)):
     # return file
 
 
+def _png_chunks(data):
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack_from(">I4s", data, pos)
+        yield kind, data[pos + 8 : pos + 8 + length]
+        pos += 12 + length
+
+
+def _png_chunk(kind, body):
+    crc = zlib.crc32(kind + body) & 0xFFFFFFFF
+    return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", crc)
+
+
+def normalize_png(data):
+    """
+    Convert an Apple CgBI png, as Xcode compresses the icons of iOS apps, to
+    a standard png. Those store the pixels as premultiplied BGRA in a raw
+    deflate stream, so browsers can not render them. Other images are
+    returned unchanged.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return data
+    chunks = list(_png_chunks(data))
+    if not chunks or chunks[0][0] != b"CgBI":
+        return data
+    out = [PNG_SIGNATURE]
+    idat = b""
+    for kind, body in chunks[1:]:
+        if kind == b"IDAT":
+            idat += body
+        elif kind == b"IEND":
+            break
+        else:
+            out.append(_png_chunk(kind, body))
+    out.append(_png_chunk(b"IDAT", zlib.compress(zlib.decompress(idat, -15))))
+    out.append(_png_chunk(b"IEND", b""))
+    image = Image.open(io.BytesIO(b"".join(out)))
+    if image.mode == "RGBA":
+        b, g, r, a = image.split()
+        pixels = Image.merge("RGBA", (r, g, b, a)).tobytes()
+        image = Image.frombytes("RGBa", image.size, pixels).convert("RGBA")
+    elif image.mode == "RGB":
+        b, g, r = image.split()
+        image = Image.merge("RGB", (r, g, b))
+    file = io.BytesIO()
+    image.save(file, "PNG", optimize=True)
+    return file.getvalue()
+
+
+def icon_renditions(data, sizes=ICON_SIZES):
+    """
+    Return {size: {ext: bytes}} of the image resized to fit each size, in
+    every format of ICON_FORMATS.
+    """
+    image = Image.open(io.BytesIO(data)).convert("RGBA")
+    ret = {}
+    for size in sizes:
+        resized = ImageOps.contain(image, (size, size), Image.LANCZOS)
+        ret[size] = {}
+        for ext, image_format in ICON_FORMATS.items():
+            file = io.BytesIO()
+            if image_format == "PNG":
+                resized.save(file, image_format, optimize=True)
+            else:
+                resized.save(file, image_format, quality=85, method=6)
+            ret[size][ext] = file.getvalue()
+    return ret
+
+
 if __name__ == "__main__":
     generate_logo_image(COLORS[4], size=(128, 128))
@@ -0,0 +1,183 @@
+"""
+Timing spans of the package ingest path.
+
+    with span("package.parse", parser="ApkParser", size=size) as s:
+        ...
+        s.set(version=pkg.version)
+
+A finished span goes to the sink named by settings.SPAN_SINK:
+
+    ""        disabled, span() returns a shared span that does nothing
+    "log"     a line on the "apphub.span" logger, the span in its extra
+    "statsd"  a StatsD timer (and a histogram of the size) over UDP
+    "memory"  appended to memory_sink.spans, for tests
+
+or the dotted path of a class with an emit(span) method. Every span is
+tagged with the storage backend (settings.STORAGE_TYPE) unless it sets one
+itself.
+"""
+
+import logging
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger("apphub.span")
+
+
+class Span:
+    __slots__ = ("sink", "name", "tags", "start", "duration", "error")
+
+    def __init__(self, sink, name, tags):
+        self.sink = sink
+        self.name = name
+        self.tags = tags
+        self.duration = None
+        self.error = ""
+
+    def set(self, **tags):
+        self.tags.update(tags)
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "duration": self.duration,
+            "error": self.error,
+            "tags": {k: v for k, v in self.tags.items() if v is not None},
+        }
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        try:
+            self.sink.emit(self)
+        except:  # noqa: E722
+            # A broken sink must not fail the upload it is timing.
+            pass
+        return False
+
+
+class NullSpan:
+    def set(self, **tags):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class LogSink:
+    def emit(self, span):
+        data = span.as_dict()
+        tags = " ".join("%s=%s" % x for x in sorted(data["tags"].items()))
+        if span.error:
+            tags += " error=" + span.error
+        logger.info(
+            "%s %.1fms %s", span.name, span.duration * 1000, tags, extra={"span": data}
+        )
+
+
+def _statsd_tag(value):
+    return str(value).translate(str.maketrans(":|,#@\n", "______"))
+
+
+class StatsdSink:
+    """
+    Sends a timer of every span, tagged DogStatsD style, and a histogram of
+    its size, which would make a poor tag.
+    """
+
+    def __init__(self):
+        host, port = settings.SPAN_STATSD_ADDRESS.rsplit(":", 1)
+        self.address = (host, int(port))
+        self.prefix = settings.SPAN_STATSD_PREFIX
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, span):
+        tags = dict(span.tags)
+        size = tags.pop("size", None)
+        if span.error:
+            tags["error"] = span.error
+        tags = ",".join(
+            "%s:%s" % (k, _statsd_tag(v))
+            for k, v in sorted(tags.items())
+            if v is not None
+        )
+        suffix = "|#" + tags if tags else ""
+        metric = self.prefix + "." + span.name if self.prefix else span.name
+        lines = ["%s:%.3f|ms%s" % (metric, span.duration * 1000, suffix)]
+        if size is not None:
+            lines.append("%s.size:%d|h%s" % (metric, size, suffix))
+        self.socket.sendto("\n".join(lines).encode(), self.address)
+
+
+class MemorySink:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []
+
+    def emit(self, span):
+        with self.lock:
+            self.spans.append(span.as_dict())
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+
+    def find(self, name):
+        return [x for x in self.spans if x["name"] == name]
+
+
+memory_sink = MemorySink()
+
+SINKS = {
+    "log": LogSink,
+    "statsd": StatsdSink,
+    "memory": lambda: memory_sink,
+}
+
+# The sink in use, False when spans are disabled, None until first needed.
+_sink = None
+
+
+def get_sink():
+    global _sink
+    if _sink is None:
+        name = settings.SPAN_SINK
+        if not name:
+            _sink = False
+        elif name in SINKS:
+            _sink = SINKS[name]()
+        else:
+            _sink = import_string(name)()
+    return _sink
+
+
+@receiver(setting_changed)
+def reset_sink(setting, **kwargs):
+    global _sink
+    if setting.startswith("SPAN_"):
+        _sink = None
+
+
+def span(name, **tags):
+    sink = get_sink() if _sink is None else _sink
+    if not sink:
+        return NULL_SPAN
+    tags.setdefault("storage", settings.STORAGE_TYPE)
+    return Span(sink, name, tags)
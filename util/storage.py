@@ -19,3 +19,15 @@ def remove_directory(path):
 
 def copy_file(src, dst):
     shutil.copyfile(src, dst)
+
+
+# OSS and S3 accept at most 10000 parts per multipart upload, S3 needs every
+# part but the last to be at least 5 MB.
+MAX_UPLOAD_PARTS = 10000
+MIN_UPLOAD_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_UPLOAD_PART_SIZE = 16 * 1024 * 1024
+
+
+def upload_part_size(size, part_size=None):
+    part_size = max(part_size or DEFAULT_UPLOAD_PART_SIZE, MIN_UPLOAD_PART_SIZE)
+    return max(part_size, -(-size // MAX_UPLOAD_PARTS))
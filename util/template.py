@@ -0,0 +1,76 @@
+import json
+import re
+
+PLACEHOLDER = re.compile(r"\$\{([^}]*)\}")
+
+
+def compile_template(body):
+    """
+    Split a JSON template with ${key} placeholders into its literal text and
+    [key, quoted] placeholders, quoted telling whether the placeholder is
+    inside a JSON string. The result is JSON serializable.
+    """
+    compiled = []
+    quoted = False
+    escaped = False
+    start = 0
+    i = 0
+    while i < len(body):
+        c = body[i]
+        if escaped:
+            escaped = False
+        elif c == "\\" and quoted:
+            escaped = True
+        elif c == '"':
+            quoted = not quoted
+        elif c == "$":
+            match = PLACEHOLDER.match(body, i)
+            if match:
+                if start < i:
+                    compiled.append(body[start:i])
+                compiled.append([match.group(1), quoted])
+                start = i = match.end()
+                continue
+        i += 1
+    if start < len(body):
+        compiled.append(body[start:])
+    return compiled
+
+
+class TemplateData:
+    """
+    The values of one event for every template rendered with it, each value
+    encoded once however many templates use it.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.encoded = {}
+
+    def encode(self, key, quoted):
+        value = self.encoded.get((key, quoted))
+        if value is None:
+            if key not in self.data:
+                # Unknown placeholders are left as they are.
+                value = "${" + key + "}"
+            elif quoted:
+                value = json.dumps(str(self.data[key]), ensure_ascii=False)[1:-1]
+            else:
+                value = json.dumps(self.data[key], ensure_ascii=False)
+            self.encoded[(key, quoted)] = value
+        return value
+
+
+def render_template(compiled, data):
+    """
+    The JSON object of a compiled template with the values of `data`, a
+    TemplateData. Values inside JSON strings are escaped, values outside of
+    them are written as JSON values.
+    """
+    parts = []
+    for item in compiled:
+        if isinstance(item, str):
+            parts.append(item)
+        else:
+            parts.append(data.encode(item[0], item[1]))
+    return json.loads("".join(parts))
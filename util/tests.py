@@ -24,7 +24,7 @@ class BaseTestCase(TestCase):
             return resp.request
 
     def assertDictEqual(self, d1, d2, msg=None):
-        keys = ["icon_file", "install_url", "package_url", "package_file"]
+        keys = ["icon_file", "icons", "install_url", "package_url", "package_file"]
         dict11 = {}
         dict11.update(d1)
         dict22 = {}